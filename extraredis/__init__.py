@@ -1,3 +1,4 @@
 __version__ = '0.1.0'
 from extraredis._async import ExtraRedisAsync
 from extraredis._sync import ExtraRedis
+from extraredis.client_cache import ClientCache
@@ -1,162 +1,1684 @@
+import contextlib
+import functools
+import random
+import time
+from collections.abc import Iterator
+from collections.abc import Callable
 from collections.abc import Iterable
+from typing import Any
 from typing import AnyStr
 
+from extraredis import columns
+from extraredis import dumpfile
+from extraredis import records
+from extraredis import scripts
+from extraredis import util
+from extraredis.buffers import BytesBuffer
+from extraredis.client_cache import ALL_FIELDS
+from extraredis.client_cache import MISSING
+from extraredis.client_cache import ClientCache
+from extraredis.codecs import Codec
+from extraredis.codecs import get_codec
+from extraredis.instrumentation import Hook
+
+from .tracking import ClientTracking
+
+from extraredis.concurrency import gather_sync  # isort:skip
+from extraredis.concurrency import gather_sync  # isort:skip
+from extraredis.concurrency import executor_sync  # isort:skip
+from extraredis.concurrency import executor_sync  # isort:skip
+from extraredis.concurrency import blocking_sync  # isort:skip
+from extraredis.concurrency import blocking_sync  # isort:skip
+from extraredis.instrumentation import instrumented_sync  # isort:skip
+from extraredis.instrumentation import instrumented_sync  # isort:skip
+
 import redis.asyncio as redis_sync  # isort:skip
 import redis as redis_sync  # isort:skip
 
 redis_module = redis_sync
 
+SCAN_COUNT = 1000
+CHUNK_SIZE = 10_000
+CONCURRENCY = 1
+SCRIPT_STEPS = 100
+INDEX_KINDS = {'numeric': 'n', 'equal': 'e'}
+
+
+def check_output(output: str, choices: tuple[str, ...]) -> None:
+    if output not in choices:
+        raise ValueError(f'unknown output {output!r}, expected one of {list(choices)}')
+
+
+def migrate_options(kwargs: dict[str, Any], copy: bool, replace: bool) -> list[Any]:
+    # kwargs: connection kwargs of the target, ACL users authenticate with AUTH2
+    options = ['COPY'] if copy else []
+    if replace:
+        options.append('REPLACE')
+    if kwargs.get('username'):
+        options += ['AUTH2', kwargs['username'], kwargs.get('password') or '']
+    elif kwargs.get('password'):
+        options += ['AUTH', kwargs['password']]
+    return options
+
+
+def in_range(value: Any, min: float | str, max: float | str) -> bool:
+    # min / max: ZRANGE BYSCORE bounds, numbers or strings like '-inf', '(10'
+    try:
+        x = float(value)
+    except (TypeError, ValueError):
+        return False
+    lo, hi = (b.decode() if isinstance(b, bytes) else str(b) for b in (min, max))
+    above = x > float(lo[1:]) if lo.startswith('(') else x >= float(lo)
+    below = x < float(hi[1:]) if hi.startswith('(') else x <= float(hi)
+    return above and below
+
 
 class ExtraRedis:
     def __init__(
         self,
-        redis: redis_module.Redis | None = None,
+        redis: redis_module.Redis | redis_module.RedisCluster | None = None,
+        scan_count: int = SCAN_COUNT,
+        chunk_size: int = CHUNK_SIZE,
+        concurrency: int = CONCURRENCY,
+        hscan_threshold: int | None = None,
+        hash_tag: bool = False,
+        cache: ClientCache | None = None,
+        invalidator: ClientTracking | None = None,
+        codec: str | Codec | None = None,
+        codecs: dict[AnyStr, str | Codec] | None = None,
+        ttls: dict[AnyStr, float] | None = None,
+        ttl_jitter: float = 0,
+        hooks: Iterable[Hook] = (),
+        indexes: dict[AnyStr, dict[AnyStr, str]] | None = None,
         **kwargs,
     ):
         self.redis = redis or redis_module.Redis(**kwargs)
+        self.scan_count = scan_count
+        self.chunk_size = chunk_size
+        # max number of chunks of mhget_fields / mhset_field(s) in flight at once, each on its own pooled connection
+        self.concurrency = concurrency
+        # sync client: thread pool running the chunks of all calls, threads are started on demand and reused
+        self.executor = executor_sync()
+        # whole-hash reads of hashes with more than hscan_threshold fields use HSCAN instead of one big HGETALL reply.
+        # This costs one extra HLEN round trip per read (per chunk for mhget_fields), so it is off by default
+        self.hscan_threshold = hscan_threshold
+        self.cluster = isinstance(self.redis, redis_module.RedisCluster)
+        # keys are stored as {prefix}:key so all keys of a prefix share one cluster slot
+        self.hash_tag = hash_tag
+        self.cache = cache
+        self.invalidator = invalidator
+        # values are encoded/decoded with codecs[prefix] or codec; None passes values through unchanged
+        self.codec = get_codec(codec)
+        self.codecs = {prefix: get_codec(c) for prefix, c in (codecs or {}).items()}
+        # default expiry in seconds of keys written under a prefix, used when no ex / px / exat is passed
+        self.ttls = ttls or {}
+        # relative expiries are extended by a random fraction up to ttl_jitter so keys written together don't expire together
+        self.ttl_jitter = ttl_jitter
+        # instrumentation hooks, called before and after every public method call (see extraredis.instrumentation)
+        self.hooks = list(hooks)
+        # secondary indexes {prefix: {field: 'numeric' | 'equal'}} maintained by the hset_* / mhset_* methods
+        self.indexes = {
+            prefix: {field: INDEX_KINDS[kind] for field, kind in fields.items()}
+            for prefix, fields in (indexes or {}).items()
+        }
+        if self.indexes and self.cluster:
+            raise NotImplementedError('secondary indexes are not supported in cluster mode')
+        self._scripts = {}
+        self.decode_responses = self.redis.get_connection_kwargs().get('decode_responses', False)
+        if self.decode_responses:
+            self.sep, self.wildcard, self.tag_open, self.tag_close = ':', '*', '{', '}'
+            self.index_namespace = '__idx__'
+        else:
+            self.sep, self.wildcard, self.tag_open, self.tag_close = b':', b'*', b'{', b'}'
+            self.index_namespace = b'__idx__'
 
     @classmethod
-    def from_url(cls, url: str, **kwargs) -> 'ExtraRedis':
+    def from_url(cls, url: str, cluster: bool = False, **kwargs) -> 'ExtraRedis':
+        if cluster:
+            return cls(redis_module.RedisCluster.from_url(url, **kwargs))
         return cls(redis_module.Redis.from_url(url, **kwargs))
 
-    def addprefix(self, prefix: AnyStr, key: AnyStr) -> bytes:
-        if self.redis.get_connection_kwargs()['decode_responses']:
-            return prefix + ':' + key
-        return prefix + b':' + key
+    def keyprefix(self, prefix: AnyStr) -> AnyStr:
+        if self.hash_tag:
+            return self.tag_open + prefix + self.tag_close + self.sep
+        return prefix + self.sep
+
+    def addprefix(self, prefix: AnyStr, key: AnyStr) -> AnyStr:
+        return self.keyprefix(prefix) + key
 
     def mremoveprefix(self, prefix: AnyStr, pkeys: list[AnyStr]) -> list[AnyStr]:
-        if self.redis.get_connection_kwargs()['decode_responses']:
-            return [k.removeprefix(prefix + ':') for k in pkeys]
-        return [k.removeprefix(prefix + b':') for k in pkeys]
+        prefix = self.keyprefix(prefix)
+        return [k.removeprefix(prefix) for k in pkeys]
 
-    def maddprefix(self, prefix: AnyStr, keys: list[AnyStr] | None = None) -> list[AnyStr]:
-        if keys is None:
-            if self.redis.get_connection_kwargs()['decode_responses']:
-                suffix = ':*'
+    def enable_client_cache(
+        self,
+        prefixes: Iterable[AnyStr] = (),
+        max_entries: int = 10_000,
+        max_bytes: int = 64 * 2 ** 20,
+    ) -> ClientCache:
+        if self.cluster:
+            raise NotImplementedError('client side caching is not supported in cluster mode')
+        self.invalidator = ClientTracking(self.redis, [self.keyprefix(p) for p in prefixes])
+        self.invalidator.start()
+        self.cache = ClientCache(max_entries, max_bytes)
+        return self.cache
+
+    def disable_client_cache(self) -> None:
+        if self.invalidator is not None:
+            self.invalidator.close()
+        self.invalidator = None
+        self.cache = None
+
+    def process_invalidations(self) -> None:
+        if self.invalidator is not None:
+            self.invalidator.process(self.cache)
+
+    def codec_for(self, prefix: AnyStr) -> Codec | None:
+        return self.codecs.get(prefix, self.codec)
+
+    def _decode(self, prefix: AnyStr, value: AnyStr | None) -> Any:
+        codec = self.codec_for(prefix)
+        if codec is None or value is None:
+            return value
+        return codec.decode(value)
+
+    def _decode_dict(self, prefix: AnyStr, mapping: dict[AnyStr, AnyStr | None]) -> dict[AnyStr, Any]:
+        codec = self.codec_for(prefix)
+        if codec is None:
+            return mapping
+        return codec.decode_dict(mapping)
+
+    def index_prefix(self, prefix: AnyStr) -> AnyStr:
+        return self.index_namespace + self.sep + prefix + self.sep
+
+    def index_key(self, prefix: AnyStr, field: AnyStr, value: AnyStr | None = None) -> AnyStr:
+        # sorted set of a numeric index (value=None) or set of hash keys with field == value of an equality index
+        # the field is length-prefixed, so that no two (field, value) pairs share an equality key
+        if value is None:
+            return self.index_prefix(prefix) + util.to_response('n:', self.decode_responses) + field
+        size = len(field.encode() if isinstance(field, str) else field)
+        return self.index_prefix(prefix) + util.to_response(f'e:{size}:', self.decode_responses) + field + util.to_response(':', self.decode_responses) + value
+
+    def _ttl(
+        self,
+        prefix: AnyStr,
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+    ) -> tuple[str, int] | None:
+        # expiry normalized to ('px', milliseconds) or ('pxat', unix time in milliseconds)
+        if sum(x is not None for x in (ex, px, exat)) > 1:
+            raise ValueError('ex, px and exat are mutually exclusive')
+        if exat is not None:
+            return 'pxat', int(exat * 1000)
+        if px is None:
+            ex = self.ttls.get(prefix) if ex is None else ex
+            if ex is None:
+                return None
+            px = ex * 1000
+        return 'px', int(px)
+
+    def _jitter(self, ttl: tuple[str, int] | None) -> tuple[str, int] | None:
+        if ttl is None or ttl[0] == 'pxat' or not self.ttl_jitter:
+            return ttl
+        return 'px', ttl[1] + random.randint(0, int(ttl[1] * self.ttl_jitter))
+
+    def _pipe_expire(
+        self,
+        pipe: redis_module.client.Pipeline,
+        pkey: AnyStr,
+        ttl: tuple[str, int],
+        fields: list[AnyStr] | None = None,
+    ) -> None:
+        # fields: expire only these fields of the hash with HPEXPIRE (redis >= 7.4)
+        kind, ms = self._jitter(ttl)
+        if fields is None:
+            (pipe.pexpireat if kind == 'pxat' else pipe.pexpire)(pkey, ms)
+        else:
+            (pipe.hpexpireat if kind == 'pxat' else pipe.hpexpire)(pkey, ms, *fields)
+
+    def _invalidate(self, pkeys: Iterable[AnyStr]) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(pkeys)
+
+    def _cache_get_fields(self, pkey: AnyStr, fields: list[AnyStr] | None) -> dict[AnyStr, AnyStr] | object:
+        if fields is None:
+            # whole hashes are cached as dicts, callers get a copy they can modify
+            value = self.cache.get(pkey, ALL_FIELDS)
+            return value if value is MISSING else dict(value)
+        out = {}
+        for field in fields:
+            value = self.cache.get(pkey, field)
+            if value is MISSING:
+                return MISSING
+            out[field] = value
+        return out
+
+    def _cache_set_fields(self, pkey: AnyStr, fields: list[AnyStr] | None, value: dict[AnyStr, AnyStr]) -> None:
+        if fields is None:
+            self.cache.set(pkey, ALL_FIELDS, dict(value))
+            return
+        for field, v in value.items():
+            self.cache.set(pkey, field, v)
+
+    def pipeline(self, atomic: bool = False) -> redis_module.client.Pipeline:
+        if self.cluster:
+            # cluster pipelines are split by node and never wrapped in MULTI/EXEC
+            return self.redis.pipeline()
+        return self.redis.pipeline(transaction=atomic)
+
+    def _scan(
+        self,
+        prefix: AnyStr,
+        count: int,
+        _type: str | None = None,
+    ) -> Iterator[list[AnyStr]]:
+        match = util.escape_glob(self.keyprefix(prefix)) + self.wildcard
+        if not self.cluster:
+            cursor = 0
+            while True:
+                cursor, pkeys = self.redis.scan(cursor, match=match, count=count, _type=_type)
+                yield pkeys
+                if cursor == 0:
+                    return
+        if self.hash_tag:
+            nodes = [self.redis.get_node_from_key(self.keyprefix(prefix))]
+        else:
+            nodes = self.redis.get_primaries()
+        nodes = {node.name: node for node in nodes}
+        cursors = dict.fromkeys(nodes, 0)
+        while cursors:
+            # one SCAN step on every node that still has a cursor, in parallel
+            replies = gather_sync([
+                functools.partial(self.redis.scan, cursor, match=match, count=count, _type=_type, target_nodes=nodes[name])
+                for name, cursor in cursors.items()
+            ], executor=self.executor)
+            pkeys = []
+            for node_cursors, node_pkeys in replies:
+                cursors.update(node_cursors)
+                pkeys += node_pkeys
+            cursors = {name: cursor for name, cursor in cursors.items() if cursor != 0}
+            yield pkeys
+
+    @instrumented_sync
+    def scan_prefix(
+        self,
+        prefix: AnyStr,
+        count: int | None = None,
+        _type: str | None = None,
+        dedup: bool = True,
+    ) -> Iterator[list[AnyStr]]:
+        seen = set()  # SCAN may return the same key more than once
+        for pkeys in self._scan(prefix, count or self.scan_count, _type):
+            if dedup:
+                batch = [k for k in pkeys if k not in seen]
+                seen.update(batch)
             else:
-                suffix = b':*'
-            return self.redis.keys(prefix + suffix)
+                batch = pkeys
+            if batch:
+                yield batch
+
+    @instrumented_sync
+    def maddprefix(
+        self,
+        prefix: AnyStr,
+        keys: list[AnyStr] | None = None,
+        _type: str | None = None,
+        count: int | None = None,
+    ) -> list[AnyStr]:
+        if keys is None:
+            pkeys = []
+            for batch in self.scan_prefix(prefix, count, _type):
+                pkeys += batch
+            return pkeys
         else:
-            return [self.addprefix(prefix, k) for k in keys]
+            prefix = self.keyprefix(prefix)
+            return [prefix + k for k in keys]
 
+    @instrumented_sync
     def get(self, prefix: AnyStr, key: AnyStr) -> AnyStr | None:
         pkey = self.addprefix(prefix, key)
-        return self.redis.get(pkey)
+        if self.cache is None:
+            value = self.redis.get(pkey)
+        else:
+            self.process_invalidations()
+            value = self.cache.get(pkey)
+            if value is MISSING:
+                with self.cache.reading([pkey]):
+                    value = self.redis.get(pkey)
+                    self.cache.set(pkey, None, value)
+        return self._decode(prefix, value)
 
-    def set(self, prefix: AnyStr, key: AnyStr, value: AnyStr) -> None:
+    @instrumented_sync
+    def set(
+        self,
+        prefix: AnyStr,
+        key: AnyStr,
+        value: Any,
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+    ) -> None:
         pkey = self.addprefix(prefix, key)
-        self.redis.set(pkey, value)
+        codec = self.codec_for(prefix)
+        if codec is not None:
+            value = codec.encode(value)
+        ttl = self._jitter(self._ttl(prefix, ex, px, exat))
+        if ttl is None:
+            self.redis.set(pkey, value)
+        else:
+            kind, ms = ttl
+            self.redis.set(pkey, value, **{kind: ms})
+        self._invalidate([pkey])
 
-    def delete(self, prefix: AnyStr, *keys: Iterable[AnyStr]) -> None:
+    @instrumented_sync
+    def delete(self, prefix: AnyStr, *keys: Iterable[AnyStr], chunk_size: int | None = None) -> None:
         pkeys = self.maddprefix(prefix, keys)
-        self.redis.delete(*pkeys)
+        index = self.indexes.get(prefix)
+        for chunk in util.chunked(pkeys, chunk_size or self.chunk_size):
+            if index is None:
+                self.redis.delete(*chunk)
+            else:
+                args = [self.index_prefix(prefix)]
+                for field, kind in index.items():
+                    args += [field, kind]
+                self._script('DEL_INDEXED')(keys=chunk, args=args)
+        self._invalidate(pkeys)
 
-    def mget(self, prefix: AnyStr, keys: Iterable[AnyStr] | None = None) -> dict[AnyStr, AnyStr]:
-        pkeys = self.maddprefix(prefix, keys)
-        values = self.redis.mget(pkeys)
+    @instrumented_sync
+    def mget(
+        self,
+        prefix: AnyStr,
+        keys: Iterable[AnyStr] | None = None,
+        chunk_size: int | None = None,
+        output: str = 'dict',
+    ) -> dict[AnyStr, Any] | tuple[list[AnyStr], list[Any] | BytesBuffer]:
+        # output='lists': (keys, values) parallel lists, 'buffer': (keys, BytesBuffer of the values)
+        check_output(output, ('dict', 'lists', 'buffer'))
+        if output == 'buffer' and (self.decode_responses or self.codec_for(prefix) is not None):
+            raise ValueError("output='buffer' packs raw bytes values, it requires decode_responses=False and no codec")
+        if keys is not None and not isinstance(keys, list):
+            keys = list(keys)  # iterated twice: to prefix and to build the result
+        pkeys = self.maddprefix(prefix, keys, _type='string')
+        if self.cache is not None and keys is not None:
+            values = self._mget_cached(pkeys, chunk_size)
+        else:
+            values = []
+            for chunk in util.chunked(pkeys, chunk_size or self.chunk_size):
+                values += self._mget_pkeys(chunk)
         if keys is None:
             keys = self.mremoveprefix(prefix, pkeys)
+        codec = self.codec_for(prefix)
+        if codec is not None:
+            values = codec.decode_many(values)
+        if output == 'lists':
+            return keys, values
+        if output == 'buffer':
+            return keys, BytesBuffer(values)
         return dict(zip(keys, values))
 
-    def mset(self, prefix: AnyStr, mapping: dict[AnyStr, AnyStr]) -> None:
-        if len(mapping) == 0:
-            return
-        if self.redis.get_connection_kwargs()['decode_responses']:
-            mapping = {prefix + ':' + k: v for k, v in mapping.items()}
-        else:
-            mapping = {prefix + b':' + k: v for k, v in mapping.items()}
-        self.redis.mset(mapping)
+    def _mget_cached(self, pkeys: list[AnyStr], chunk_size: int | None = None) -> list[AnyStr | None]:
+        self.process_invalidations()
+        values = [self.cache.get(pkey) for pkey in pkeys]
+        misses = [i for i, value in enumerate(values) if value is MISSING]
+        for chunk in util.chunked(misses, chunk_size or self.chunk_size):
+            chunk_pkeys = [pkeys[i] for i in chunk]
+            with self.cache.reading(chunk_pkeys):
+                for i, value in zip(chunk, self._mget_pkeys(chunk_pkeys)):
+                    values[i] = value
+                    self.cache.set(pkeys[i], None, value)
+        return values
+
+    def _mget_pkeys(self, pkeys: list[AnyStr]) -> list[AnyStr | None]:
+        if self.cluster:
+            return self.redis.mget_nonatomic(pkeys)
+        return self.redis.mget(pkeys)
+
+    @instrumented_sync
+    def mset(
+        self,
+        prefix: AnyStr,
+        mapping: dict[AnyStr, Any],
+        chunk_size: int | None = None,
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+    ) -> None:
+        codec = self.codec_for(prefix)
+        ttl = self._ttl(prefix, ex, px, exat)
+        prefix = self.keyprefix(prefix)
+        for chunk in util.chunked(mapping.items(), chunk_size or self.chunk_size):
+            if codec is None:
+                chunk = {prefix + k: v for k, v in chunk}
+            else:
+                chunk = dict(zip([prefix + k for k, _ in chunk], codec.encode_many([v for _, v in chunk])))
+            if ttl is not None:
+                # MSET can't set an expiry, SET PX every key in one pipeline instead
+                pipe = self.pipeline(atomic=True)
+                for k, v in chunk.items():
+                    kind, ms = self._jitter(ttl)
+                    pipe.set(k, v, **{kind: ms})
+                pipe.execute()
+            elif self.cluster:
+                self.redis.mset_nonatomic(chunk)
+            else:
+                self.redis.mset(chunk)
+            self._invalidate(chunk)
 
+    @instrumented_sync
     def hget_field(
         self,
         prefix: AnyStr,
         key: AnyStr,
         field: AnyStr,
-    ) -> AnyStr | None:
+    ) -> Any:
         pkey = self.addprefix(prefix, key)
-        return self.redis.hget(pkey, field)
+        if self.cache is None:
+            value = self.redis.hget(pkey, field)
+        else:
+            self.process_invalidations()
+            value = self.cache.get(pkey, field)
+            if value is MISSING:
+                with self.cache.reading([pkey]):
+                    value = self.redis.hget(pkey, field)
+                    self.cache.set(pkey, field, value)
+        return self._decode(prefix, value)
 
+    @instrumented_sync
     def hget_fields(
         self,
         prefix: AnyStr,
         key: AnyStr,
         fields: list[AnyStr] | None = None,
-    ) -> dict[AnyStr, AnyStr]:
+        match: AnyStr | None = None,
+    ) -> dict[AnyStr, Any]:
         pkey = self.addprefix(prefix, key)
-        if fields is None:
-            return self.redis.hgetall(pkey)
-        else:
-            values = self.redis.hmget(pkey, fields)
-            return dict(zip(fields, values))
+        if match is not None:
+            if fields is not None:
+                raise ValueError('fields and match are mutually exclusive')
+            return self._decode_dict(prefix, self._hscan_dict(pkey, match))
+        value = MISSING
+        if self.cache is not None:
+            self.process_invalidations()
+            value = self._cache_get_fields(pkey, fields)
+        if value is MISSING:
+            with contextlib.nullcontext() if self.cache is None else self.cache.reading([pkey]):
+                if fields is None:
+                    value = (self._mhgetall_pkeys([pkey]))[0]
+                else:
+                    value = dict(zip(fields, self.redis.hmget(pkey, fields)))
+                if self.cache is not None:
+                    self._cache_set_fields(pkey, fields, value)
+        return self._decode_dict(prefix, value)
 
+    def _hscan(
+        self,
+        pkey: AnyStr,
+        match: AnyStr | None = None,
+        count: int | None = None,
+    ) -> Iterator[dict[AnyStr, AnyStr]]:
+        cursor = 0
+        while True:
+            cursor, data = self.redis.hscan(pkey, cursor, match=match, count=count or self.scan_count)
+            if data:
+                yield data
+            if cursor == 0:
+                return
+
+    def _hscan_dict(self, pkey: AnyStr, match: AnyStr | None = None) -> dict[AnyStr, AnyStr]:
+        out = {}
+        for data in self._hscan(pkey, match):
+            out.update(data)
+        return out
+
+    @instrumented_sync
+    def iter_hget_fields(
+        self,
+        prefix: AnyStr,
+        key: AnyStr,
+        match: AnyStr | None = None,
+        count: int | None = None,
+    ) -> Iterator[tuple[AnyStr, Any]]:
+        # HSCAN may return a field more than once if the hash is rehashed during the scan
+        codec = self.codec_for(prefix)
+        for data in self._hscan(self.addprefix(prefix, key), match, count):
+            values = data.values() if codec is None else codec.decode_many(list(data.values()))
+            for field, value in zip(data, values):
+                yield field, value
+
+    @instrumented_sync
     def hset_field(
         self,
         prefix: AnyStr,
         key: AnyStr,
         field: AnyStr,
-        value: AnyStr,
+        value: Any,
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+        per_field: bool = False,
     ) -> None:
         pkey = self.addprefix(prefix, key)
-        self.redis.hset(pkey, field, value)
+        codec = self.codec_for(prefix)
+        ttl = self._ttl(prefix, ex, px, exat)
+        if ttl is None and prefix not in self.indexes:
+            if codec is not None:
+                value = codec.encode(value)
+            self.redis.hset(pkey, field, value)
+        else:
+            self._mhset_pkeys([(pkey, value)], field, True, codec, ttl, per_field, prefix)
+        self._invalidate([pkey])
 
+    @instrumented_sync
     def hset_fields(
         self,
         prefix: AnyStr,
         key: AnyStr,
-        mapping: dict[AnyStr, AnyStr],
+        mapping: dict[AnyStr, Any],
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+        per_field: bool = False,
     ) -> None:
         pkey = self.addprefix(prefix, key)
-        self.redis.hset(pkey, mapping=mapping)
+        codec = self.codec_for(prefix)
+        ttl = self._ttl(prefix, ex, px, exat)
+        if ttl is None and prefix not in self.indexes:
+            if codec is not None:
+                mapping = codec.encode_dict(mapping)
+            self.redis.hset(pkey, mapping=mapping)
+        else:
+            self._mhset_pkeys([(pkey, mapping)], None, True, codec, ttl, per_field, prefix)
+        self._invalidate([pkey])
 
+    @instrumented_sync
     def mhget_field(
         self,
         prefix: AnyStr,
         field: AnyStr,
         keys: list[AnyStr] | None = None,
-    ) -> AnyStr | None:
-        out = self.mhget_fields(prefix, keys, [field])
-        out = {k: v[field] for k, v in out.items()}
-        return out
+        chunk_size: int | None = None,
+        atomic: bool = False,
+        concurrency: int | None = None,
+        output: str = 'dict',
+    ) -> dict[AnyStr, Any] | tuple[list[AnyStr], list[Any]]:
+        check_output(output, ('dict', 'lists'))
+        keys, rows = self.mhget_fields(prefix, keys, [field], chunk_size, atomic, concurrency, output='lists')
+        values = [row[0] for row in rows]
+        if output == 'lists':
+            return keys, values
+        return dict(zip(keys, values))
 
+    @instrumented_sync
     def mhget_fields(
         self,
         prefix: AnyStr,
         keys: list[AnyStr] | None = None,
         fields: list[AnyStr] | None = None,
-    ) -> dict[AnyStr, dict[AnyStr, AnyStr]]:
-        pkeys = self.maddprefix(prefix, keys)
-        pipe = self.redis.pipeline()
-        for key in pkeys:
-            if fields is None:
-                pipe.hgetall(key)
-            else:
-                pipe.hmget(key, fields)
-        values = pipe.execute()
-        if fields is not None:
-            values = [dict(zip(fields, v)) for v in values]
+        chunk_size: int | None = None,
+        atomic: bool = False,
+        concurrency: int | None = None,
+        match: AnyStr | None = None,
+        output: str = 'dict',
+        dtypes: dict[AnyStr, Any] | None = None,
+    ) -> dict[AnyStr, dict[AnyStr, Any]] | tuple[Any, list[Any] | dict[AnyStr, Any]]:
+        # output='lists': (keys, values) parallel lists. With fields, values are lists in fields order instead of dicts
+        # output='columns': (key index, {field: column}), columns converted with dtypes (see extraredis.columns)
+        check_output(output, ('dict', 'lists', 'columns'))
+        if fields is not None and match is not None:
+            raise ValueError('fields and match are mutually exclusive')
+        if output == 'columns' and fields is None:
+            raise ValueError("output='columns' requires fields")
+        if keys is not None and not isinstance(keys, list):
+            keys = list(keys)
+        rows = output != 'dict' and fields is not None
+        pkeys = self.maddprefix(prefix, keys, _type='hash')
+        codec = self.codec_for(prefix)
+        if self.cache is not None and keys is not None and match is None:
+            values = self._mhget_cached(pkeys, fields, chunk_size, atomic)
+            if codec is not None:
+                values = [codec.decode_dict(v) for v in values]
+            if rows:
+                values = [[v[f] for f in fields] for v in values]
+        else:
+            results = gather_sync([
+                functools.partial(self._mhget_pkeys, chunk, fields, atomic, codec, match, rows)
+                for chunk in util.chunked(pkeys, chunk_size or self.chunk_size)
+            ], concurrency or self.concurrency, self.executor)
+            values = [v for result in results for v in result]
         if keys is None:
             keys = self.mremoveprefix(prefix, pkeys)
+        if output == 'columns':
+            dtypes = dtypes or {}
+            cols = zip(*values) if values else [()] * len(fields)
+            return columns.to_index(keys), {f: columns.to_column(list(c), dtypes.get(f)) for f, c in zip(fields, cols)}
+        if output == 'lists':
+            return keys, values
         return dict(zip(keys, values))
 
+    def _mhget_pkeys(
+        self,
+        pkeys: list[AnyStr],
+        fields: list[AnyStr] | None = None,
+        atomic: bool = False,
+        codec: Codec | None = None,
+        match: AnyStr | None = None,
+        rows: bool = False,
+    ) -> list[dict[AnyStr, Any]] | list[list[Any]]:
+        # rows: with fields, return the HMGET value lists as they are instead of building a dict per hash
+        if fields is None:
+            values = self._mhgetall_pkeys(pkeys, atomic, match)
+            if codec is None:
+                return values
+            return [codec.decode_dict(v) for v in values]
+        pipe = self.pipeline(atomic)
+        for key in pkeys:
+            pipe.hmget(key, fields)
+        values = pipe.execute()
+        if codec is not None:
+            # decode the values of all hashes at once and build the per-hash dicts from the flat list
+            flat = codec.decode_many([x for v in values for x in v])
+            n = len(fields)
+            if rows:
+                return [flat[i:i + n] for i in range(0, len(flat), n)]
+            return [dict(zip(fields, flat[i:i + n])) for i in range(0, len(flat), n)]
+        if rows:
+            return values
+        return [dict(zip(fields, v)) for v in values]
+
+    def _mhgetall_pkeys(
+        self,
+        pkeys: list[AnyStr],
+        atomic: bool = False,
+        match: AnyStr | None = None,
+    ) -> list[dict[AnyStr, AnyStr]]:
+        # HGETALL in one pipeline, except for hashes read with HSCAN (all of them with match, large ones with hscan_threshold)
+        if match is not None:
+            scan = [True] * len(pkeys)
+        elif self.hscan_threshold is not None:
+            pipe = self.pipeline()
+            for key in pkeys:
+                pipe.hlen(key)
+            scan = [n > self.hscan_threshold for n in pipe.execute()]
+        else:
+            scan = [False] * len(pkeys)
+        # the first HSCAN step of every scanned hash goes into the HGETALL pipeline
+        pipe = self.pipeline(atomic)
+        for key, scan_key in zip(pkeys, scan):
+            if scan_key:
+                pipe.hscan(key, 0, match=match, count=self.scan_count)
+            else:
+                pipe.hgetall(key)
+        values, cursors = [], {}
+        for i, (scan_key, reply) in enumerate(zip(scan, pipe.execute())):
+            if scan_key:
+                cursor, reply = reply
+                if cursor != 0:
+                    cursors[i] = cursor
+            values.append(reply)
+        self._hscan_rest(pkeys, values, cursors, match)
+        return values
+
+    def _hscan_rest(
+        self,
+        pkeys: list[AnyStr],
+        values: list[dict[AnyStr, AnyStr]],
+        cursors: dict[int, int],
+        match: AnyStr | None = None,
+    ) -> None:
+        # next HSCAN steps of the unfinished hashes values[i], one pipeline per step
+        while cursors:
+            pipe = self.pipeline()
+            for i, cursor in cursors.items():
+                pipe.hscan(pkeys[i], cursor, match=match, count=self.scan_count)
+            for i, (cursor, data) in zip(list(cursors), pipe.execute()):
+                values[i].update(data)
+                if cursor == 0:
+                    del cursors[i]
+                else:
+                    cursors[i] = cursor
+
+    def _mhget_cached(
+        self,
+        pkeys: list[AnyStr],
+        fields: list[AnyStr] | None = None,
+        chunk_size: int | None = None,
+        atomic: bool = False,
+    ) -> list[dict[AnyStr, AnyStr]]:
+        self.process_invalidations()
+        values = [self._cache_get_fields(pkey, fields) for pkey in pkeys]
+        misses = [i for i, value in enumerate(values) if value is MISSING]
+        for chunk in util.chunked(misses, chunk_size or self.chunk_size):
+            chunk_pkeys = [pkeys[i] for i in chunk]
+            with self.cache.reading(chunk_pkeys):
+                for i, value in zip(chunk, self._mhget_pkeys(chunk_pkeys, fields, atomic)):
+                    values[i] = value
+                    self._cache_set_fields(pkeys[i], fields, value)
+        return values
+
+    # iter_* methods hold at most one SCAN batch in memory.
+    # With dedup=False a key may be yielded twice if the keyspace is rehashed during the scan.
+    # Keys deleted between SCAN and the read are skipped (unless fields are projected with HMGET).
+
+    @instrumented_sync
+    def iter_mget(
+        self,
+        prefix: AnyStr,
+        count: int | None = None,
+        dedup: bool = False,
+    ) -> Iterator[tuple[AnyStr, Any]]:
+        codec = self.codec_for(prefix)
+        for pkeys in self.scan_prefix(prefix, count, _type='string', dedup=dedup):
+            values = self._mget_pkeys(pkeys)
+            decoded = values if codec is None else codec.decode_many(values)
+            for key, value, decoded_value in zip(self.mremoveprefix(prefix, pkeys), values, decoded):
+                if value is not None:
+                    yield key, decoded_value
+
+    @instrumented_sync
+    def iter_mhget_fields(
+        self,
+        prefix: AnyStr,
+        fields: list[AnyStr] | None = None,
+        count: int | None = None,
+        dedup: bool = False,
+        match: AnyStr | None = None,
+    ) -> Iterator[tuple[AnyStr, dict[AnyStr, Any]]]:
+        codec = self.codec_for(prefix)
+        for pkeys in self.scan_prefix(prefix, count, _type='hash', dedup=dedup):
+            values = self._mhget_pkeys(pkeys, fields, codec=codec, match=match)
+            for key, value in zip(self.mremoveprefix(prefix, pkeys), values):
+                if value or fields is not None:
+                    yield key, value
+
+    @instrumented_sync
     def mhset_field(
         self,
         prefix: AnyStr,
         field: AnyStr,
-        mapping: dict[AnyStr, AnyStr],
+        mapping: dict[AnyStr, Any],
+        chunk_size: int | None = None,
+        atomic: bool = True,
+        concurrency: int | None = None,
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+        per_field: bool = False,
     ) -> None:
         pkeys = self.maddprefix(prefix, mapping.keys())
-        pipe = self.redis.pipeline()
-        for key, value in zip(pkeys, mapping.values()):
-            pipe.hset(key, field, value)
-        pipe.execute()
+        ttl = self._ttl(prefix, ex, px, exat)
+        gather_sync([
+            functools.partial(self._mhset_pkeys, chunk, field, atomic, self.codec_for(prefix), ttl, per_field, prefix)
+            for chunk in util.chunked(zip(pkeys, mapping.values()), chunk_size or self.chunk_size)
+        ], concurrency or self.concurrency, self.executor)
+        self._invalidate(pkeys)
 
+    @instrumented_sync
     def mhset_fields(
         self,
         prefix: AnyStr,
-        mapping: dict[AnyStr, dict[AnyStr, AnyStr]],
+        mapping: dict[AnyStr, dict[AnyStr, Any]],
+        chunk_size: int | None = None,
+        atomic: bool = True,
+        concurrency: int | None = None,
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+        per_field: bool = False,
     ) -> None:
         pkeys = self.maddprefix(prefix, mapping.keys())
-        pipe = self.redis.pipeline()
-        for key, value in zip(pkeys, mapping.values()):
-            pipe.hset(key, mapping=value)
+        ttl = self._ttl(prefix, ex, px, exat)
+        gather_sync([
+            functools.partial(self._mhset_pkeys, chunk, None, atomic, self.codec_for(prefix), ttl, per_field, prefix)
+            for chunk in util.chunked(zip(pkeys, mapping.values()), chunk_size or self.chunk_size)
+        ], concurrency or self.concurrency, self.executor)
+        self._invalidate(pkeys)
+
+    def _mhset_pkeys(
+        self,
+        items: list[tuple[AnyStr, Any]],
+        field: AnyStr | None = None,
+        atomic: bool = True,
+        codec: Codec | None = None,
+        ttl: tuple[str, int] | None = None,
+        per_field: bool = False,
+        prefix: AnyStr | None = None,
+    ) -> None:
+        # field=None: values are whole mappings (mhset_fields), otherwise values of a single field (mhset_field)
+        # hashes of indexed prefixes are written with the HSET_INDEXED script, in the same pipeline
+        index = self.indexes.get(prefix)
+        if codec is not None:
+            if field is None:
+                items = [(k, codec.encode_dict(v)) for k, v in items]
+            else:
+                items = zip([k for k, _ in items], codec.encode_many([v for _, v in items]))
+        pipe = self.pipeline(atomic)
+        for key, value in items:
+            if index is not None:
+                args = [self.index_prefix(prefix)]
+                for f, v in (value.items() if field is None else [(field, value)]):
+                    args += [f, v, index.get(f, '-')]
+                self._script('HSET_INDEXED')(keys=[key], args=args, client=pipe)
+            elif field is None:
+                pipe.hset(key, mapping=value)
+            else:
+                pipe.hset(key, field, value)
+            if ttl is not None:
+                fields = None
+                if per_field:
+                    fields = list(value) if field is None else [field]
+                self._pipe_expire(pipe, key, ttl, fields)
         pipe.execute()
+
+    @instrumented_sync
+    def mget_records(
+        self,
+        cls: type,
+        keys: list[Any] | None = None,
+        chunk_size: int | None = None,
+        concurrency: int | None = None,
+    ) -> list[Any]:
+        # records of a @record class (see extraredis.records), None for missing hashes
+        if keys is not None:
+            keys = [util.to_response(k, self.decode_responses) for k in keys]
+        keys, rows = self.mhget_fields(
+            cls.__record_prefix__,
+            keys,
+            list(cls.__record_fields__),
+            chunk_size,
+            concurrency=concurrency,
+            output='lists',
+        )
+        return records.load(cls, keys, rows)
+
+    @instrumented_sync
+    def mset_records(
+        self,
+        items: Iterable[Any],
+        chunk_size: int | None = None,
+        atomic: bool = True,
+        concurrency: int | None = None,
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+    ) -> None:
+        prefix, mapping = records.dump(items, self.decode_responses)
+        if mapping:
+            self.mhset_fields(prefix, mapping, chunk_size, atomic, concurrency, ex, px, exat)
+
+    # Secondary index queries. Hashes are read back to check the indexed field, so entries of deleted / expired hashes
+    # (indexes are not updated by delete) and of values written without the hset_* / mhset_* methods are skipped.
+
+    @instrumented_sync
+    def find_equal(
+        self,
+        prefix: AnyStr,
+        field: AnyStr,
+        value: Any,
+        limit: int | None = None,
+        fields: list[AnyStr] | None = None,
+    ) -> list[AnyStr] | dict[AnyStr, dict[AnyStr, Any]]:
+        # keys of hashes with field == value, or {key: {field: value}} of the requested fields
+        codec = self.codec_for(prefix)
+        value = util.to_response(value if codec is None else codec.encode(value), self.decode_responses)
+        index_key = self.index_key(prefix, field, value)
+        read = [field, *(fields or [])]
+        args = (index_key, field, INDEX_KINDS['equal'], value, read, lambda v: v == value)
+        if limit is None:
+            found, _ = self._index_check(list(self.redis.smembers(index_key)), *args)
+            return self._index_result(prefix, fields, found)
+        found, seen, cursor = [], set(), 0
+        while len(found) < limit:
+            cursor, batch = self.redis.sscan(index_key, cursor, count=limit)
+            batch = [pkey for pkey in batch if pkey not in seen]  # SSCAN may return a member twice
+            seen.update(batch)
+            found += (self._index_check(batch, *args))[0]
+            if cursor == 0:
+                break
+        return self._index_result(prefix, fields, found[:limit])
+
+    @instrumented_sync
+    def find_range(
+        self,
+        prefix: AnyStr,
+        field: AnyStr,
+        min: float | str = '-inf',
+        max: float | str = '+inf',
+        offset: int = 0,
+        limit: int | None = None,
+        desc: bool = False,
+        fields: list[AnyStr] | None = None,
+    ) -> list[AnyStr] | dict[AnyStr, dict[AnyStr, Any]]:
+        # keys of hashes with min <= field <= max ('(' for exclusive bounds) ordered by the field value
+        start, end = (max, min) if desc else (min, max)
+        index_key = self.index_key(prefix, field)
+        read = [field, *(fields or [])]
+        args = (index_key, field, INDEX_KINDS['numeric'], '', read, lambda v: in_range(v, min, max))
+        if limit is None:
+            pkeys = self.redis.zrange(index_key, start, end, desc=desc, byscore=True, offset=offset or None, num=-1 if offset else None)
+            found, _ = self._index_check(pkeys, *args)
+            return self._index_result(prefix, fields, found)
+        found = []
+        while len(found) < limit:
+            # stale entries are removed from the sorted set, so the next page starts fewer positions further
+            n = limit - len(found)
+            pkeys = self.redis.zrange(index_key, start, end, desc=desc, byscore=True, offset=offset, num=n)
+            matches, removed = self._index_check(pkeys, *args)
+            found += matches
+            if len(pkeys) < n:
+                break
+            offset += len(pkeys) - removed
+        return self._index_result(prefix, fields, found)
+
+    def _index_check(
+        self,
+        pkeys: list[AnyStr],
+        index_key: AnyStr,
+        field: AnyStr,
+        kind: str,
+        value: AnyStr,
+        read: list[AnyStr],
+        check: Callable[[AnyStr | None], bool],
+    ) -> tuple[list[tuple[AnyStr, list[Any]]], int]:
+        # reads back the indexed field (and the requested fields) of index entries: entries of deleted / expired hashes
+        # and of changed values don't match and are cleaned up -> ([(pkey, row)], number of cleaned up entries)
+        rows = []
+        for chunk in util.chunked(pkeys, self.chunk_size):
+            rows += self._mhget_pkeys(chunk, read, rows=True)
+        found = [(pkey, row) for pkey, row in zip(pkeys, rows) if check(row[0])]
+        if len(found) == len(pkeys):
+            return found, 0
+        stale = [pkey for pkey, row in zip(pkeys, rows) if not check(row[0])]
+        return found, self._script('INDEX_CLEANUP')(keys=[index_key], args=[field, kind, value, *stale])
+
+    def _index_result(
+        self,
+        prefix: AnyStr,
+        fields: list[AnyStr] | None,
+        found: list[tuple[AnyStr, list[Any]]],
+    ) -> list[AnyStr] | dict[AnyStr, dict[AnyStr, Any]]:
+        keys = self.mremoveprefix(prefix, [pkey for pkey, _ in found])
+        if fields is None:
+            return keys
+        codec = self.codec_for(prefix)
+        values = [v for _, row in found for v in row[1:]]
+        if codec is not None:
+            values = codec.decode_many(values)
+        n = len(fields)
+        return {key: dict(zip(fields, values[i * n:i * n + n])) for i, key in enumerate(keys)}
+
+    # Server side scripts. *_prefix scripts SCAN the keyspace on the server, `steps` SCAN calls per round trip,
+    # so no keys are transferred to the client.
+
+    def _script(self, name: str) -> Any:
+        script = self._scripts.get(name)
+        if script is None:
+            script = self._scripts[name] = self.redis.register_script(getattr(scripts, name))
+        return script
+
+    def _run_scan_script(
+        self,
+        name: str,
+        prefix: AnyStr,
+        count: int | None = None,
+        steps: int | None = None,
+        *args: Any,
+        match: AnyStr | None = None,
+    ) -> Iterator[list[Any]]:
+        # match: SCAN pattern other than the keys of prefix
+        if self.cluster:
+            raise NotImplementedError('prefix scripts are not supported in cluster mode')
+        if match is None:
+            match = util.escape_glob(self.keyprefix(prefix)) + self.wildcard
+        script = self._script(name)
+        cursor = 0
+        while True:
+            cursor, *reply = script(args=[cursor, match, count or self.scan_count, steps or SCRIPT_STEPS, *args])
+            yield reply
+            if int(cursor) == 0:
+                return
+
+    def _run_keys_script(self, name: str, pkeys: list[AnyStr], args: list[Any]) -> list[Any]:
+        if self.cluster and not self.hash_tag:
+            # all keys of a script must be in one slot
+            raise NotImplementedError('multi-key scripts in cluster mode require hash_tag=True')
+        return self._script(name)(keys=pkeys, args=args)
+
+    @instrumented_sync
+    def delete_prefix(
+        self,
+        prefix: AnyStr,
+        count: int | None = None,
+        steps: int | None = None,
+    ) -> int:
+        n = 0
+        for reply in self._run_scan_script('DELETE_PREFIX', prefix, count, steps):
+            n += reply[0]
+        if prefix in self.indexes:
+            # all hashes of the prefix are gone, and so are all their index entries
+            match = util.escape_glob(self.index_prefix(prefix)) + self.wildcard
+            for _ in self._run_scan_script('DELETE_PREFIX', prefix, count, steps, match=match):
+                pass
+        if self.cache is not None:
+            # deleted keys are not sent back, so the local cache can't be invalidated key by key
+            self.cache.clear()
+        return n
+
+    @instrumented_sync
+    def count_prefix(
+        self,
+        prefix: AnyStr,
+        _type: str | None = None,
+        count: int | None = None,
+        steps: int | None = None,
+    ) -> int:
+        n = 0
+        args = [] if _type is None else [_type]
+        for reply in self._run_scan_script('COUNT_PREFIX', prefix, count, steps, *args):
+            n += reply[0]
+        return n
+
+    @instrumented_sync
+    def mhget_field_server(
+        self,
+        prefix: AnyStr,
+        field: AnyStr,
+        keys: list[AnyStr] | None = None,
+        chunk_size: int | None = None,
+        count: int | None = None,
+        steps: int | None = None,
+    ) -> dict[AnyStr, Any]:
+        if keys is None:
+            pkeys, values = [], []
+            for reply in self._run_scan_script('HGET_PREFIX', prefix, count, steps, field):
+                pkeys += reply[::2]
+                values += reply[1::2]
+            keys = self.mremoveprefix(prefix, pkeys)
+        else:
+            pkeys = self.maddprefix(prefix, keys)
+            values = []
+            for chunk in util.chunked(pkeys, chunk_size or self.chunk_size):
+                values += self._run_keys_script('HGET_KEYS', chunk, [field])
+        codec = self.codec_for(prefix)
+        if codec is not None:
+            values = codec.decode_many(values)
+        return dict(zip(keys, values))
+
+    @instrumented_sync
+    def mset_nx(
+        self,
+        prefix: AnyStr,
+        mapping: dict[AnyStr, Any],
+        chunk_size: int | None = None,
+    ) -> dict[AnyStr, bool]:
+        # sets only the keys which don't exist yet, returns key -> whether it was set
+        codec = self.codec_for(prefix)
+        prefix = self.keyprefix(prefix)
+        out = {}
+        for chunk in util.chunked(mapping.items(), chunk_size or self.chunk_size):
+            keys = [k for k, _ in chunk]
+            values = [v for _, v in chunk]
+            if codec is not None:
+                values = codec.encode_many(values)
+            pkeys = [prefix + k for k in keys]
+            is_set = self._run_keys_script('MSET_NX', pkeys, values)
+            self._invalidate([k for k, x in zip(pkeys, is_set) if x])
+            out.update(zip(keys, map(bool, is_set)))
+        return out
+
+    @instrumented_sync
+    def export_prefix(
+        self,
+        prefix: AnyStr,
+        path: str,
+        count: int | None = None,
+        compression: str | None = None,
+        resume: bool = False,
+    ) -> int:
+        # writes DUMP of every key under prefix to a dump file (see extraredis.dumpfile), returns the number of keys
+        if self.cluster:
+            raise NotImplementedError('export_prefix is not supported in cluster mode')
+        if self.decode_responses:
+            raise ValueError('DUMP values are binary, export_prefix requires decode_responses=False')
+        kprefix = self.keyprefix(prefix)
+        match = util.escape_glob(kprefix) + self.wildcard
+        # file IO, compression and the thread join of the writer (and reader below) run in a thread in the async client
+        writer = blocking_sync(dumpfile.DumpWriter, path, kprefix, compression, resume)
+        cursor = writer.cursor
+        n = 0
+        complete = False
+        try:
+            while True:
+                cursor, pkeys = self.redis.scan(cursor, match=match, count=count or self.scan_count)
+                batch = []
+                if pkeys:
+                    pipe = self.pipeline()
+                    for pkey in pkeys:
+                        pipe.dump(pkey)
+                        pipe.pttl(pkey)
+                    replies = pipe.execute()
+                    now = int(time.time() * 1000)
+                    for pkey, value, pttl in zip(pkeys, replies[::2], replies[1::2]):
+                        if value is None:  # deleted or expired since SCAN
+                            continue
+                        batch.append((pkey.removeprefix(kprefix), now + pttl if pttl > 0 else 0, value))
+                blocking_sync(writer.write, batch, cursor)
+                n += len(batch)
+                if cursor == 0:
+                    break
+            complete = True
+        finally:
+            blocking_sync(writer.close, complete)
+        return n
+
+    @instrumented_sync
+    def import_prefix(
+        self,
+        path: str,
+        prefix: AnyStr | None = None,
+        replace: bool = True,
+        resume: bool = False,
+    ) -> int:
+        # restores keys of a dump file under prefix (the exported prefix by default), returns the number of keys
+        # one pipeline of RESTORE per block; keys which expired since the export are not restored
+        if self.decode_responses:
+            raise ValueError('DUMP values are binary, import_prefix requires decode_responses=False')
+        reader = blocking_sync(dumpfile.DumpReader, path, resume)
+        kprefix = bytes(reader.prefix) if prefix is None else self.keyprefix(prefix)
+        n = 0
+        complete = False
+        try:
+            blocks = iter(reader)
+            while (block := blocking_sync(next, blocks, None)) is not None:
+                offset, batch = block
+                pipe = self.pipeline()
+                pkeys = []
+                now = int(time.time() * 1000)
+                for key, expire_at, value in batch:
+                    if expire_at:
+                        ttl = expire_at - now
+                        if ttl <= 0:
+                            continue
+                    else:
+                        ttl = 0
+                    pkey = kprefix + key
+                    pipe.restore(pkey, ttl, value, replace=replace)
+                    pkeys.append(pkey)
+                pipe.execute()
+                self._invalidate(pkeys)
+                blocking_sync(reader.checkpoint, offset)
+                n += len(pkeys)
+            complete = True
+        finally:
+            blocking_sync(reader.close, complete)
+        return n
+
+    def _check_prefixes(self, prefix: AnyStr, new_prefix: AnyStr) -> None:
+        # keys written under new_prefix must not match the SCAN of prefix
+        src, dst = self.keyprefix(prefix), self.keyprefix(new_prefix)
+        if src.startswith(dst) or dst.startswith(src):
+            raise ValueError(f'prefixes {prefix!r} and {new_prefix!r} overlap')
+
+    def _transfer(
+        self,
+        prefix: AnyStr,
+        func: Callable[[list[AnyStr]], Any],
+        count: int | None = None,
+        concurrency: int | None = None,
+        progress: Callable[[int], Any] | None = None,
+    ) -> int:
+        # runs func (returns the number of transferred keys) on SCAN batches of prefix, up to `concurrency` batches at a time
+        concurrency = concurrency or self.concurrency
+        n = 0
+        batches = []
+
+        def run() -> int:
+            done = gather_sync([functools.partial(func, b) for b in batches], concurrency, self.executor)
+            batches.clear()
+            if progress is not None:
+                progress(n + sum(done))
+            return sum(done)
+
+        for pkeys in self._scan(prefix, count or self.scan_count):
+            if pkeys:
+                batches.append(pkeys)
+            if len(batches) >= concurrency:
+                n += run()
+        if batches:
+            n += run()
+        return n
+
+    def _restore_batch(
+        self,
+        pkeys: list[AnyStr],
+        target: 'ExtraRedis',
+        src: AnyStr,
+        dst: AnyStr,
+        replace: bool,
+        delete: bool,
+    ) -> int:
+        # DUMP + PTTL from this instance, RESTORE to target, then UNLINK the sources when moving
+        # a key changed between DUMP and UNLINK loses the change, MIGRATE / RENAME don't have this race
+        pipe = self.pipeline()
+        for pkey in pkeys:
+            pipe.dump(pkey)
+            pipe.pttl(pkey)
+        replies = pipe.execute()
+        tpipe = target.pipeline()
+        sent = []
+        for pkey, value, pttl in zip(pkeys, replies[::2], replies[1::2]):
+            if value is None:  # deleted or expired since SCAN
+                continue
+            tpipe.restore(dst + pkey.removeprefix(src), max(pttl, 0), value, replace=replace)
+            sent.append(pkey)
+        if not sent:
+            return 0
+        restored = []
+        for pkey, reply in zip(sent, tpipe.execute(raise_on_error=False)):
+            if isinstance(reply, Exception):
+                if not str(reply).startswith('BUSYKEY'):
+                    raise reply
+                continue  # the target key exists and replace is False
+            restored.append(pkey)
+        target._invalidate([dst + pkey.removeprefix(src) for pkey in restored])
+        if delete and restored:
+            pipe = self.pipeline()
+            for pkey in restored:
+                pipe.unlink(pkey)
+            pipe.execute()
+            self._invalidate(restored)
+        return len(restored)
+
+    @instrumented_sync
+    def copy_prefix(
+        self,
+        prefix: AnyStr,
+        new_prefix: AnyStr,
+        replace: bool = False,
+        count: int | None = None,
+        concurrency: int | None = None,
+        progress: Callable[[int], Any] | None = None,
+    ) -> int:
+        # copies keys of any type, returns the number of copied keys; existing keys under new_prefix are kept unless replace
+        self._check_prefixes(prefix, new_prefix)
+        src, dst = self.keyprefix(prefix), self.keyprefix(new_prefix)
+        if self.cluster:
+            # COPY needs both keys in one slot
+            func = functools.partial(self._restore_batch, target=self, src=src, dst=dst, replace=replace, delete=False)
+            return self._transfer(prefix, func, count, concurrency, progress)
+
+        def copy(pkeys: list[AnyStr]) -> int:
+            pipe = self.pipeline()
+            for pkey in pkeys:
+                pipe.copy(pkey, dst + pkey.removeprefix(src), replace=replace)
+            copied = pipe.execute()
+            self._invalidate([dst + pkey.removeprefix(src) for pkey, x in zip(pkeys, copied) if x])
+            return sum(copied)
+
+        return self._transfer(prefix, copy, count, concurrency, progress)
+
+    @instrumented_sync
+    def rename_prefix(
+        self,
+        prefix: AnyStr,
+        new_prefix: AnyStr,
+        replace: bool = False,
+        count: int | None = None,
+        concurrency: int | None = None,
+        progress: Callable[[int], Any] | None = None,
+    ) -> int:
+        # renames keys of any type, returns the number of renamed keys; keys whose new name exists stay unless replace
+        self._check_prefixes(prefix, new_prefix)
+        src, dst = self.keyprefix(prefix), self.keyprefix(new_prefix)
+        if self.cluster:
+            # RENAME needs both keys in one slot
+            func = functools.partial(self._restore_batch, target=self, src=src, dst=dst, replace=replace, delete=True)
+            return self._transfer(prefix, func, count, concurrency, progress)
+
+        def rename(pkeys: list[AnyStr]) -> int:
+            pipe = self.pipeline()
+            for pkey in pkeys:
+                if replace:
+                    pipe.rename(pkey, dst + pkey.removeprefix(src))
+                else:
+                    pipe.renamenx(pkey, dst + pkey.removeprefix(src))
+            renamed = []
+            for pkey, reply in zip(pkeys, pipe.execute(raise_on_error=False)):
+                if isinstance(reply, Exception):
+                    if 'no such key' not in str(reply):
+                        raise reply
+                    continue  # deleted or expired since SCAN
+                if reply:
+                    renamed.append(pkey)
+            self._invalidate(renamed)
+            self._invalidate([dst + pkey.removeprefix(src) for pkey in renamed])
+            return len(renamed)
+
+        return self._transfer(prefix, rename, count, concurrency, progress)
+
+    @instrumented_sync
+    def migrate_prefix(
+        self,
+        prefix: AnyStr,
+        target: 'ExtraRedis',
+        new_prefix: AnyStr | None = None,
+        copy: bool = False,
+        replace: bool = False,
+        count: int | None = None,
+        concurrency: int | None = None,
+        progress: Callable[[int], Any] | None = None,
+        address: tuple[str, int] | None = None,
+        timeout: int = 5000,
+    ) -> int:
+        # moves (or copies) keys of any type to another instance, returns the number of transferred keys
+        # existing keys of target are kept unless replace
+        # keys are read with DUMP and written with RESTORE through this client. With address (host, port of target
+        # as this server reaches it, which is not always the address this client uses) keys are sent server-side with MIGRATE
+        if target is self:
+            if new_prefix is None:
+                raise ValueError('migrate_prefix to the same instance requires new_prefix')
+            self._check_prefixes(prefix, new_prefix)
+        src = self.keyprefix(prefix)
+        dst = src if new_prefix is None else target.keyprefix(new_prefix)
+        if address is not None:
+            if src != dst or self.cluster or target.cluster:
+                raise ValueError('MIGRATE requires the same key names and no cluster on either side')
+            kwargs = target.redis.get_connection_kwargs()
+            migrate = functools.partial(self._migrate_batch, target=target, address=address, kwargs=kwargs, copy=copy, replace=replace, timeout=timeout)
+            return self._transfer(prefix, migrate, count, concurrency, progress)
+        if self.decode_responses or target.decode_responses:
+            raise ValueError('DUMP values are binary, migrate_prefix without MIGRATE requires decode_responses=False')
+        restore = functools.partial(self._restore_batch, target=target, src=src, dst=dst, replace=replace, delete=not copy)
+        return self._transfer(prefix, restore, count, concurrency, progress)
+
+    def _pipe_keys(self, command: str, pkeys: list[AnyStr]) -> list[Any]:
+        # one `command` per key in a single pipeline, for batches which already run on self.executor
+        pipe = self.pipeline()
+        for pkey in pkeys:
+            getattr(pipe, command)(pkey)
+        return pipe.execute()
+
+    def _migrate_batch(
+        self,
+        pkeys: list[AnyStr],
+        target: 'ExtraRedis',
+        address: tuple[str, int],
+        kwargs: dict[str, Any],
+        copy: bool,
+        replace: bool,
+        timeout: int,
+    ) -> int:
+        # keys deleted since SCAN and, without replace, keys existing in target are not sent, like in _restore_batch
+        exists = self._pipe_keys('exists', pkeys)
+        pkeys = [pkey for pkey, x in zip(pkeys, exists) if x]
+        if pkeys and not replace:
+            exists = target._pipe_keys('exists', pkeys)
+            pkeys = [pkey for pkey, x in zip(pkeys, exists) if not x]
+        if not pkeys:
+            return 0
+        host, port = address
+        try:
+            reply = self.redis.execute_command(
+                'MIGRATE', host, port, '', kwargs.get('db', 0), timeout,
+                *migrate_options(kwargs, copy, replace), 'KEYS', *pkeys,
+            )
+        except redis_module.ResponseError as e:
+            if not str(e).startswith('BUSYKEY'):
+                raise
+            # a key was created in target since the check above. MIGRATE still transferred the other keys:
+            # moved keys are gone from this instance, copied keys have the same DUMP value on both sides
+            if copy:
+                values = self._pipe_keys('dump', pkeys)
+                target_values = target._pipe_keys('dump', pkeys)
+                pkeys = [pkey for pkey, a, b in zip(pkeys, values, target_values) if a is not None and a == b]
+            else:
+                exists = self._pipe_keys('exists', pkeys)
+                pkeys = [pkey for pkey, x in zip(pkeys, exists) if not x]
+        else:
+            if reply in (b'NOKEY', 'NOKEY'):  # all keys were deleted since the EXISTS check
+                return 0
+        if not copy:
+            self._invalidate(pkeys)
+        target._invalidate(pkeys)
+        return len(pkeys)
+
+    def _pipe_calls(
+        self,
+        command: str,
+        calls: list[tuple[AnyStr, tuple[Any, ...]]],
+        chunk_size: int | None = None,
+        atomic: bool = False,
+        concurrency: int | None = None,
+        ttl: tuple[str, int] | None = None,
+    ) -> list[Any]:
+        # one `command` per (pkey, args) pipelined in chunks, replies in the order of calls
+        def run(chunk: list[tuple[AnyStr, tuple[Any, ...]]]) -> list[Any]:
+            pipe = self.pipeline(atomic)
+            for pkey, args in chunk:
+                getattr(pipe, command)(pkey, *args)
+                if ttl is not None:
+                    self._pipe_expire(pipe, pkey, ttl)
+            replies = pipe.execute()
+            return replies if ttl is None else replies[::2]
+
+        results = gather_sync([
+            functools.partial(run, chunk)
+            for chunk in util.chunked(calls, chunk_size or self.chunk_size)
+        ], concurrency or self.concurrency, self.executor)
+        return [reply for replies in results for reply in replies]
+
+    def _mcall(
+        self,
+        command: str,
+        prefix: AnyStr,
+        mapping: dict[AnyStr, Iterable[Any]],
+        empty: Any,
+        chunk_size: int | None = None,
+        atomic: bool = False,
+        concurrency: int | None = None,
+        ttl: tuple[str, int] | None = None,
+        star: bool = False,
+    ) -> dict[AnyStr, Any]:
+        # command(pkey, values) for every key, or command(pkey, *values) with star
+        # redis rejects calls without values, keys with no values get `empty` without a call
+        keys, values = [], []
+        for k, v in mapping.items():
+            if not isinstance(v, dict):
+                v = list(v)
+            if v:
+                keys.append(k)
+                values.append(tuple(v) if star else (v,))
+        pkeys = self.maddprefix(prefix, keys)
+        replies = self._pipe_calls(command, list(zip(pkeys, values)), chunk_size, atomic, concurrency, ttl)
+        out = dict.fromkeys(mapping, empty)
+        out.update(zip(keys, replies))
+        return out
+
+    @instrumented_sync
+    def zadd(
+        self,
+        prefix: AnyStr,
+        key: AnyStr,
+        mapping: dict[AnyStr, float],
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+    ) -> int:
+        # -> number of added members
+        return (self.mzadd(prefix, {key: mapping}, ex=ex, px=px, exat=exat))[key]
+
+    @instrumented_sync
+    def mzadd(
+        self,
+        prefix: AnyStr,
+        mapping: dict[AnyStr, dict[AnyStr, float]],
+        chunk_size: int | None = None,
+        atomic: bool = True,
+        concurrency: int | None = None,
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+    ) -> dict[AnyStr, int]:
+        # key -> {member: score}, returns key -> number of added members
+        ttl = self._ttl(prefix, ex, px, exat)
+        return self._mcall('zadd', prefix, mapping, 0, chunk_size, atomic, concurrency, ttl)
+
+    @instrumented_sync
+    def zrange(
+        self,
+        prefix: AnyStr,
+        key: AnyStr,
+        start: int = 0,
+        end: int = -1,
+        desc: bool = False,
+        withscores: bool = True,
+    ) -> list[Any]:
+        # withscores: [(member, score)], otherwise [member]
+        return self.redis.zrange(self.addprefix(prefix, key), start, end, desc=desc, withscores=withscores)
+
+    @instrumented_sync
+    def mzrange(
+        self,
+        prefix: AnyStr,
+        keys: Iterable[AnyStr],
+        start: int = 0,
+        end: int = -1,
+        desc: bool = False,
+        withscores: bool = True,
+        chunk_size: int | None = None,
+        concurrency: int | None = None,
+    ) -> dict[AnyStr, list[Any]]:
+        # the same slice of every key, e.g. top 10 of many leaderboards: mzrange(prefix, keys, 0, 9, desc=True)
+        keys = list(keys)
+        pkeys = self.maddprefix(prefix, keys)
+        calls = [(pkey, (start, end, desc, withscores)) for pkey in pkeys]
+        return dict(zip(keys, self._pipe_calls('zrange', calls, chunk_size, concurrency=concurrency)))
+
+    @instrumented_sync
+    def zmscore(
+        self,
+        prefix: AnyStr,
+        key: AnyStr,
+        members: Iterable[AnyStr],
+    ) -> list[float | None]:
+        # None for missing members
+        members = list(members)
+        if not members:
+            return []
+        return self.redis.zmscore(self.addprefix(prefix, key), members)
+
+    @instrumented_sync
+    def mzmscore(
+        self,
+        prefix: AnyStr,
+        mapping: dict[AnyStr, Iterable[AnyStr]],
+        chunk_size: int | None = None,
+        concurrency: int | None = None,
+    ) -> dict[AnyStr, list[float | None]]:
+        # key -> members, returns key -> scores
+        return self._mcall('zmscore', prefix, mapping, [], chunk_size, concurrency=concurrency)
+
+    @instrumented_sync
+    def sadd(
+        self,
+        prefix: AnyStr,
+        key: AnyStr,
+        members: Iterable[AnyStr],
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+    ) -> int:
+        # -> number of added members
+        return (self.msadd(prefix, {key: members}, ex=ex, px=px, exat=exat))[key]
+
+    @instrumented_sync
+    def msadd(
+        self,
+        prefix: AnyStr,
+        mapping: dict[AnyStr, Iterable[AnyStr]],
+        chunk_size: int | None = None,
+        atomic: bool = True,
+        concurrency: int | None = None,
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+    ) -> dict[AnyStr, int]:
+        # key -> members, returns key -> number of added members
+        ttl = self._ttl(prefix, ex, px, exat)
+        return self._mcall('sadd', prefix, mapping, 0, chunk_size, atomic, concurrency, ttl, star=True)
+
+    @instrumented_sync
+    def smismember(
+        self,
+        prefix: AnyStr,
+        key: AnyStr,
+        members: Iterable[AnyStr],
+    ) -> list[bool]:
+        return (self.msmismember(prefix, {key: members}))[key]
+
+    @instrumented_sync
+    def msmismember(
+        self,
+        prefix: AnyStr,
+        mapping: dict[AnyStr, Iterable[AnyStr]],
+        chunk_size: int | None = None,
+        concurrency: int | None = None,
+    ) -> dict[AnyStr, list[bool]]:
+        # key -> members, returns key -> whether each member is in the set
+        out = self._mcall('smismember', prefix, mapping, [], chunk_size, concurrency=concurrency)
+        return {k: [bool(x) for x in v] for k, v in out.items()}
+
+    @instrumented_sync
+    def rpush(
+        self,
+        prefix: AnyStr,
+        key: AnyStr,
+        values: Iterable[Any],
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+    ) -> int | None:
+        # -> length of the list after the push, None when there was nothing to push
+        return (self.mrpush(prefix, {key: values}, ex=ex, px=px, exat=exat))[key]
+
+    @instrumented_sync
+    def mrpush(
+        self,
+        prefix: AnyStr,
+        mapping: dict[AnyStr, Iterable[Any]],
+        chunk_size: int | None = None,
+        atomic: bool = True,
+        concurrency: int | None = None,
+        ex: float | None = None,
+        px: int | None = None,
+        exat: float | None = None,
+    ) -> dict[AnyStr, int | None]:
+        # key -> values appended to the list, returns key -> length of the list
+        ttl = self._ttl(prefix, ex, px, exat)
+        return self._mcall('rpush', prefix, mapping, None, chunk_size, atomic, concurrency, ttl, star=True)
+
+    @instrumented_sync
+    def lrange(
+        self,
+        prefix: AnyStr,
+        key: AnyStr,
+        start: int = 0,
+        end: int = -1,
+    ) -> list[Any]:
+        return self.redis.lrange(self.addprefix(prefix, key), start, end)
+
+    @instrumented_sync
+    def mlrange(
+        self,
+        prefix: AnyStr,
+        keys: Iterable[AnyStr],
+        start: int = 0,
+        end: int = -1,
+        chunk_size: int | None = None,
+        concurrency: int | None = None,
+    ) -> dict[AnyStr, list[Any]]:
+        # the same slice of every list, e.g. the head of many queues: mlrange(prefix, keys, 0, 99)
+        keys = list(keys)
+        pkeys = self.maddprefix(prefix, keys)
+        calls = [(pkey, (start, end)) for pkey in pkeys]
+        return dict(zip(keys, self._pipe_calls('lrange', calls, chunk_size, concurrency=concurrency)))
@@ -0,0 +1,80 @@
+from collections.abc import Iterable
+from typing import AnyStr
+
+from extraredis.client_cache import ClientCache
+
+from extraredis.concurrency import lock_sync  # isort:skip
+from extraredis.concurrency import lock_sync  # isort:skip
+
+import redis.asyncio as redis_sync  # isort:skip
+import redis as redis_sync  # isort:skip
+
+redis_module = redis_sync
+
+INVALIDATE_CHANNEL = '__redis__:invalidate'
+
+
+class ClientTracking:
+    """
+    Invalidation source for ClientCache based on CLIENT TRACKING in BCAST mode (RESP2 redirect).
+
+    One dedicated connection subscribes to __redis__:invalidate, a second one enables tracking
+    with REDIRECT to the first and must stay open for tracking to remain active.
+    Pending invalidation messages are drained without blocking before every cached read.
+    If either connection breaks, invalidations may have been lost: the cache is cleared and tracking started again.
+    """
+
+    def __init__(self, redis: redis_module.Redis, prefixes: Iterable[AnyStr] = ()):
+        self.redis = redis
+        self.prefixes = list(prefixes)
+        self.listener = None
+        self.tracker = None
+        self.lock = lock_sync()
+
+    def start(self) -> None:
+        pool = self.redis.connection_pool
+        self.listener = pool.get_connection()
+        self.listener.send_command('CLIENT', 'ID')
+        client_id = self.listener.read_response()
+        self.listener.send_command('SUBSCRIBE', INVALIDATE_CHANNEL)
+        self.listener.read_response()
+        self.tracker = pool.get_connection()
+        args = ['CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id, 'BCAST']
+        for prefix in self.prefixes:
+            args += ['PREFIX', prefix]
+        self.tracker.send_command(*args)
+        self.tracker.read_response()
+
+    def process(self, cache: ClientCache) -> None:
+        with self.lock:
+            try:
+                self._drain(cache)
+            except (redis_module.RedisError, OSError):
+                cache.clear()
+                self.close()
+                self.start()
+
+    def _drain(self, cache: ClientCache) -> None:
+        # can_read() reconnects a closed connection without the subscription / tracking, so check it is still open
+        if self.listener is None or self.tracker is None or not (self.listener.is_connected and self.tracker.is_connected):
+            raise redis_module.ConnectionError('client tracking connection closed')
+        if self.tracker.can_read():
+            # nothing is sent to the tracker after CLIENT TRACKING, so it was closed by the server
+            raise redis_module.ConnectionError('client tracking connection closed by the server')
+        while self.listener.can_read():
+            kind, _, pkeys = self.listener.read_response()
+            if kind not in (b'message', 'message'):
+                continue
+            if pkeys is None:  # FLUSHDB / FLUSHALL
+                cache.clear()
+            else:
+                cache.invalidate(pkeys)
+
+    def close(self) -> None:
+        pool = self.redis.connection_pool
+        for connection in (self.tracker, self.listener):
+            if connection is not None:
+                connection.disconnect()
+                pool.release(connection)
+        self.listener = None
+        self.tracker = None
@@ -0,0 +1,104 @@
+import asyncio
+from collections.abc import Hashable
+from typing import Any
+
+import redis.asyncio as redis_asyncio
+
+
+class AutoBatchRedis:
+    """
+    Wraps a redis.asyncio.Redis client and coalesces concurrent GET / HGET calls.
+
+    Calls issued in the same event loop tick (or within `window` seconds) are sent as one MGET
+    plus one HMGET per hash in a single non-transactional pipeline, and every caller's future is resolved
+    from the shared reply. All other attributes are forwarded to the wrapped client, so it can be passed
+    to ExtraRedisAsync as is:
+
+        extraredis = ExtraRedisAsync(AutoBatchRedis(redis.asyncio.Redis()))
+    """
+
+    def __init__(self, redis: redis_asyncio.Redis, window: float = 0, max_batch: int = 10_000):
+        if isinstance(redis, redis_asyncio.RedisCluster):
+            raise TypeError('AutoBatchRedis does not support RedisCluster')
+        self.redis = redis
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self._gets: dict[Hashable, asyncio.Future[Any]] = {}
+        self._hgets: dict[tuple[Hashable, Hashable], asyncio.Future[Any]] = {}
+        self._flush_handle: asyncio.Handle | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.redis, name)
+
+    async def get(self, name: Hashable) -> Any:
+        return await self._enqueue(self._gets, name)
+
+    async def hget(self, name: Hashable, key: Hashable) -> Any:
+        return await self._enqueue(self._hgets, (name, key))
+
+    async def _enqueue(self, pending: dict[Any, asyncio.Future[Any]], key: Any) -> Any:
+        future = pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            pending[key] = future
+            if len(self._gets) + len(self._hgets) >= self.max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                if self.window:
+                    self._flush_handle = loop.call_later(self.window, self._flush)
+                else:
+                    self._flush_handle = loop.call_soon(self._flush)
+        # shield: one cancelled caller must not cancel the shared future of the others
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        gets, self._gets = self._gets, {}
+        hgets, self._hgets = self._hgets, {}
+        if not gets and not hgets:
+            return
+        task = asyncio.ensure_future(self._execute(gets, hgets))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _execute(
+        self,
+        gets: dict[Hashable, asyncio.Future[Any]],
+        hgets: dict[tuple[Hashable, Hashable], asyncio.Future[Any]],
+    ) -> None:
+        # one pipeline command per group of futures: MGET of all gets, one HMGET per hash
+        pipe = self.redis.pipeline(transaction=False)
+        groups = []
+        if gets:
+            pipe.mget(list(gets))
+            groups.append(list(gets.values()))
+        fields_by_key: dict[Hashable, list[Hashable]] = {}
+        for name, key in hgets:
+            fields_by_key.setdefault(name, []).append(key)
+        for name, fields in fields_by_key.items():
+            pipe.hmget(name, fields)
+            groups.append([hgets[name, field] for field in fields])
+        try:
+            # an error reply (e.g. WRONGTYPE) fails only the calls of its command
+            replies = await pipe.execute(raise_on_error=False)
+            self.batches += 1
+        except Exception as e:
+            replies = [e] * len(groups)
+        for futures, reply in zip(groups, replies):
+            _resolve(futures, reply)
+
+
+def _resolve(futures: list[asyncio.Future[Any]], reply: Any) -> None:
+    failed = isinstance(reply, Exception)
+    for i, future in enumerate(futures):
+        if future.done():
+            continue
+        if failed:
+            future.set_exception(reply)
+        else:
+            future.set_result(reply[i])
@@ -0,0 +1,335 @@
+"""
+Benchmark every ExtraRedis / ExtraRedisAsync operation.
+
+usage:
+    python -m extraredis.bench                                  # fakeredis (pip install extraredis[bench]), results as JSON to stdout
+    python -m extraredis.bench --url redis://localhost:6379/15  # existing server (keys under the bench prefix are deleted)
+    python -m extraredis.bench --redis-server                   # launch a local redis-server on a free port
+    python -m extraredis.bench --n-keys 100 10000 --value-size 16 4096 --ops mget mset --output bench.json
+    python -m extraredis.bench --ops mget mget_lists --allocations   # also trace memory blocks allocated per key
+    python -m extraredis.bench --ops mhset_fields mhset_fields_plain  # MULTI/EXEC vs plain pipelines
+    python -m extraredis.bench --ops maddprefix maddprefix_per_key    # decode_responses resolved once vs per key
+"""
+import argparse
+import asyncio
+import contextlib
+import inspect
+import json
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from collections.abc import Iterator
+from typing import Any
+from typing import AnyStr
+
+import redis
+
+import extraredis
+from extraredis import ExtraRedis
+from extraredis import ExtraRedisAsync
+
+PREFIX = 'extraredis_bench'
+HPREFIX = 'extraredis_bench_hash'
+N_FIELDS = 8
+MAX_SINGLE_KEY_CALLS = 1000
+OPS = (
+    'get',
+    'set',
+    'maddprefix',
+    'maddprefix_per_key',
+    'mget',
+    'mget_lists',
+    'mset',
+    'hget_field',
+    'hget_fields',
+    'hset_field',
+    'hset_fields',
+    'mhget_field',
+    'mhget_field_lists',
+    'mhget_fields',
+    'mhget_fields_lists',
+    'mhset_field',
+    'mhset_fields',
+    'mhget_fields_atomic',
+    'mhset_fields_plain',
+)
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def make_data(n_keys: int, value_size: int, decode: bool) -> dict[str, Any]:
+    def enc(s: str) -> str | bytes:
+        return s if decode else s.encode()
+
+    keys = [enc(str(i)) for i in range(n_keys)]
+    fields = [enc(f'f{j}') for j in range(N_FIELDS)]
+    value = enc('x' * value_size)
+    return {
+        'prefix': enc(PREFIX),
+        'hprefix': enc(HPREFIX),
+        'keys': keys,
+        'fields': fields,
+        'value': value,
+        'mapping': dict.fromkeys(keys, value),
+        'hmapping': {k: dict.fromkeys(fields, value) for k in keys},
+    }
+
+
+def maddprefix_per_key(er: ExtraRedis | ExtraRedisAsync, prefix: AnyStr, keys: list[AnyStr]) -> list[AnyStr]:
+    # baseline for maddprefix: decode_responses looked up with get_connection_kwargs() once per key, as before it was resolved at construction
+    def addprefix(key: AnyStr) -> AnyStr:
+        if er.redis.get_connection_kwargs().get('decode_responses'):
+            return prefix + ':' + key
+        return prefix + b':' + key
+    return [addprefix(k) for k in keys]
+
+
+async def maddprefix_per_key_async(er: ExtraRedisAsync, prefix: AnyStr, keys: list[AnyStr]) -> list[AnyStr]:
+    return maddprefix_per_key(er, prefix, keys)
+
+
+def make_calls(er: ExtraRedis | ExtraRedisAsync, d: dict[str, Any]) -> dict[str, tuple[list[Callable[[], Any]], int]]:
+    # op -> (calls, keys per call)
+    p, hp, keys, fields, value = d['prefix'], d['hprefix'], d['keys'], d['fields'], d['value']
+    single = keys[:MAX_SINGLE_KEY_CALLS]
+    per_key = maddprefix_per_key_async if isinstance(er, ExtraRedisAsync) else maddprefix_per_key
+    field = fields[0]
+    return {
+        'get': ([lambda k=k: er.get(p, k) for k in single], 1),
+        'set': ([lambda k=k: er.set(p, k, value) for k in single], 1),
+        'maddprefix': ([lambda: er.maddprefix(p, keys)], len(keys)),
+        'maddprefix_per_key': ([lambda: per_key(er, p, keys)], len(keys)),
+        'mget': ([lambda: er.mget(p, keys)], len(keys)),
+        'mget_lists': ([lambda: er.mget(p, keys, output='lists')], len(keys)),
+        'mset': ([lambda: er.mset(p, d['mapping'])], len(keys)),
+        'hget_field': ([lambda k=k: er.hget_field(hp, k, field) for k in single], 1),
+        'hget_fields': ([lambda k=k: er.hget_fields(hp, k) for k in single], 1),
+        'hset_field': ([lambda k=k: er.hset_field(hp, k, field, value) for k in single], 1),
+        'hset_fields': ([lambda k=k: er.hset_fields(hp, k, d['hmapping'][k]) for k in single], 1),
+        'mhget_field': ([lambda: er.mhget_field(hp, field, keys)], len(keys)),
+        'mhget_field_lists': ([lambda: er.mhget_field(hp, field, keys, output='lists')], len(keys)),
+        'mhget_fields': ([lambda: er.mhget_fields(hp, keys)], len(keys)),
+        # all fields projected with HMGET, so the reply is the same as the HGETALL of mhget_fields
+        'mhget_fields_lists': ([lambda: er.mhget_fields(hp, keys, fields, output='lists')], len(keys)),
+        'mhset_field': ([lambda: er.mhset_field(hp, field, d['mapping'])], len(keys)),
+        'mhset_fields': ([lambda: er.mhset_fields(hp, d['hmapping'])], len(keys)),
+        # the other pipeline mode: mhget_fields defaults to a plain pipeline, mhset_fields to MULTI/EXEC
+        'mhget_fields_atomic': ([lambda: er.mhget_fields(hp, keys, atomic=True)], len(keys)),
+        'mhset_fields_plain': ([lambda: er.mhset_fields(hp, d['hmapping'], atomic=False)], len(keys)),
+    }
+
+
+def summarize(latencies: list[float], cpu: float, keys_per_call: int) -> dict[str, float]:
+    wall = sum(latencies)
+    n_keys = len(latencies) * keys_per_call
+    return {
+        'calls': len(latencies),
+        'keys_per_call': keys_per_call,
+        'ops_per_sec': len(latencies) / wall,
+        'keys_per_sec': n_keys / wall,
+        'p50_ms': percentile(latencies, 0.5) * 1e3,
+        'p99_ms': percentile(latencies, 0.99) * 1e3,
+        'mean_ms': statistics.fmean(latencies) * 1e3,
+        'cpu_us_per_key': cpu / n_keys * 1e6,
+    }
+
+
+def run_sync(calls: list[Callable[[], Any]], repeat: int) -> tuple[list[float], float]:
+    latencies = []
+    cpu0 = time.process_time()
+    for _ in range(repeat):
+        for call in calls:
+            t0 = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - t0)
+    return latencies, time.process_time() - cpu0
+
+
+async def run_async(calls: list[Callable[[], Any]], repeat: int) -> tuple[list[float], float]:
+    latencies = []
+    cpu0 = time.process_time()
+    for _ in range(repeat):
+        for call in calls:
+            t0 = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - t0)
+    return latencies, time.process_time() - cpu0
+
+
+def make_client(cls: type, url: str | None, decode: bool) -> ExtraRedis | ExtraRedisAsync:
+    is_async = cls is ExtraRedisAsync
+    if url is not None:
+        return cls.from_url(url, decode_responses=decode)
+    try:
+        import fakeredis
+    except ImportError:
+        raise ImportError('the default backend requires fakeredis: pip install extraredis[bench], or pass --url / --redis-server') from None
+    fake_cls = fakeredis.FakeAsyncRedis if is_async else fakeredis.FakeRedis
+    return cls(fake_cls(decode_responses=decode))
+
+
+async def maybe_await(x: Any) -> Any:
+    if inspect.isawaitable(x):
+        return await x
+    return x
+
+
+async def trace_allocations(call: Callable[[], Any], keys_per_call: int) -> dict[str, float]:
+    # blocks and bytes still allocated when the call returns (mostly the result) and peak bytes during the call
+    tracemalloc.start()
+    try:
+        result = await maybe_await(call())
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    stats = snapshot.statistics('filename')
+    return {
+        'blocks_per_key': sum(s.count for s in stats) / keys_per_call,
+        'bytes_per_key': sum(s.size for s in stats) / keys_per_call,
+        'peak_bytes_per_key': peak / keys_per_call,
+    }
+
+
+async def bench_config(
+    cls: type,
+    url: str | None,
+    n_keys: int,
+    value_size: int,
+    decode: bool,
+    ops: list[str],
+    repeat: int,
+    allocations: bool = False,
+) -> list[dict[str, Any]]:
+    er = make_client(cls, url, decode)
+    d = make_data(n_keys, value_size, decode)
+
+    # seed data for the read ops
+    await maybe_await(er.mset(d['prefix'], d['mapping']))
+    await maybe_await(er.mhset_fields(d['hprefix'], d['hmapping']))
+
+    results = []
+    for op, (calls, keys_per_call) in make_calls(er, d).items():
+        if op not in ops:
+            continue
+        if cls is ExtraRedisAsync:
+            latencies, cpu = await run_async(calls, repeat)
+        else:
+            latencies, cpu = run_sync(calls, repeat)
+        results.append({
+            'client': cls.__name__,
+            'op': op,
+            'n_keys': n_keys,
+            'value_size': value_size,
+            'decode_responses': decode,
+            **summarize(latencies, cpu, keys_per_call),
+        })
+        if allocations:
+            results[-1].update(await trace_allocations(calls[0], keys_per_call))
+
+    await maybe_await(er.delete(d['prefix'], *d['keys']))
+    await maybe_await(er.delete(d['hprefix'], *d['keys']))
+    if cls is ExtraRedisAsync:
+        await er.redis.aclose()
+    else:
+        er.redis.close()
+    return results
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def launch_redis_server() -> Iterator[str]:
+    executable = shutil.which('redis-server')
+    if executable is None:
+        raise SystemExit('redis-server not found in PATH')
+    port = free_port()
+    process = subprocess.Popen(
+        [executable, '--port', str(port), '--save', '', '--appendonly', 'no'],
+        stdout=subprocess.DEVNULL,
+    )
+    url = f'redis://127.0.0.1:{port}'
+    try:
+        client = redis.Redis.from_url(url)
+        for _ in range(100):
+            try:
+                client.ping()
+                break
+            except redis.ConnectionError:
+                time.sleep(0.05)
+        else:
+            raise SystemExit('redis-server did not start')
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run(args: argparse.Namespace, url: str | None) -> dict[str, Any]:
+    classes = {'sync': [ExtraRedis], 'async': [ExtraRedisAsync], 'both': [ExtraRedis, ExtraRedisAsync]}[args.client]
+    decodes = {'bytes': [False], 'str': [True], 'both': [False, True]}[args.decode]
+    results = []
+    for cls in classes:
+        for n_keys in args.n_keys:
+            for value_size in args.value_size:
+                for decode in decodes:
+                    results += asyncio.run(bench_config(cls, url, n_keys, value_size, decode, args.ops, args.repeat, args.allocations))
+    return {
+        'meta': {
+            'extraredis': extraredis.__version__,
+            'redis-py': redis.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': 'fakeredis' if url is None else url,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'results': results,
+    }
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(prog='python -m extraredis.bench')
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument('--url', help='benchmark against an existing server instead of fakeredis')
+    backend.add_argument('--redis-server', action='store_true', help='launch a local redis-server for the run')
+    parser.add_argument('--client', choices=['sync', 'async', 'both'], default='both')
+    parser.add_argument('--decode', choices=['bytes', 'str', 'both'], default='both', help='decode_responses modes')
+    parser.add_argument('--n-keys', type=int, nargs='+', default=[100, 10_000])
+    parser.add_argument('--value-size', type=int, nargs='+', default=[16, 1024])
+    parser.add_argument('--ops', nargs='+', choices=OPS, default=list(OPS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--allocations', action='store_true', help='trace memory allocated per key (slower)')
+    parser.add_argument('--output', help='write JSON to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    if args.redis_server:
+        with launch_redis_server() as url:
+            report = run(args, url)
+    else:
+        report = run(args, args.url)
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
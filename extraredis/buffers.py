@@ -0,0 +1,44 @@
+from array import array
+from collections.abc import Iterable
+from collections.abc import Sequence
+
+
+class BytesBuffer(Sequence):
+    """
+    Read-only sequence of bytes values (or None) packed into one bytes object.
+    Items are memoryview slices of the packed data, so reading them doesn't copy.
+    Holds 2 ints per value instead of one bytes object per value.
+    """
+
+    def __init__(self, values: Iterable[bytes | None]):
+        self.offsets = array('q')
+        self.lengths = array('q')  # -1 for None
+        parts = []
+        pos = 0
+        for value in values:
+            self.offsets.append(pos)
+            if value is None:
+                self.lengths.append(-1)
+                continue
+            if not isinstance(value, (bytes, bytearray, memoryview)):
+                raise TypeError(f'BytesBuffer values must be bytes, got {type(value).__name__}')
+            parts.append(value)
+            self.lengths.append(len(value))
+            pos += len(value)
+        self.data = b''.join(parts)
+        self.view = memoryview(self.data)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def __getitem__(self, i: int | slice) -> memoryview | None | list[memoryview | None]:  # type: ignore[override]
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = self.lengths[i]
+        if n < 0:
+            return None
+        start = self.offsets[i]
+        return self.view[start:start + n]
+
+    def tolist(self) -> list[bytes | None]:
+        return [None if v is None else v.tobytes() for v in self]
@@ -0,0 +1,126 @@
+import contextlib
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable
+from collections.abc import Iterable
+from collections.abc import Iterator
+from typing import Any
+
+MISSING = object()
+ALL_FIELDS = object()  # field slot for a whole hash read with HGETALL
+
+
+def sizeof(value: Any) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, dict):
+        return sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(sizeof(v) for v in value)
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    return 8
+
+
+class ClientCache:
+    """
+    In-process LRU cache of values read from redis, bounded by entry count and total size in bytes.
+    Entries are keyed by (prefixed key, field); field is None for strings.
+    Values read inside reading(pkeys) are not cached if an invalidation of their key arrives during the read.
+    """
+
+    def __init__(self, max_entries: int = 10_000, max_bytes: int = 64 * 2 ** 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple[Hashable, Any], tuple[Any, int]] = OrderedDict()
+        self.fields: dict[Hashable, set[Any]] = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.reads: dict[Hashable, int] = {}  # pkey -> reads in flight
+        self.stale: set[Hashable] = set()  # keys invalidated while a read was in flight
+        self.lock = threading.Lock()  # the sync client shares the cache between threads
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, pkey: Hashable, field: Any = None) -> Any:
+        with self.lock:
+            entry = self.entries.get((pkey, field))
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self.entries.move_to_end((pkey, field))
+            self.hits += 1
+            return entry[0]
+
+    def set(self, pkey: Hashable, field: Any, value: Any) -> None:
+        size = sizeof(pkey) + sizeof(field) + sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if pkey in self.stale:
+                return  # the value may predate a write whose invalidation was already processed
+            self._pop((pkey, field))
+            self.entries[pkey, field] = value, size
+            self.fields.setdefault(pkey, set()).add(field)
+            self.nbytes += size
+            while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+                self._pop(next(iter(self.entries)))
+                self.evictions += 1
+
+    @contextlib.contextmanager
+    def reading(self, pkeys: list[Hashable]) -> Iterator[None]:
+        # wraps a read from redis and the set() of its values
+        with self.lock:
+            for pkey in pkeys:
+                self.reads[pkey] = self.reads.get(pkey, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                for pkey in pkeys:
+                    n = self.reads.pop(pkey) - 1
+                    if n:
+                        self.reads[pkey] = n
+                    else:
+                        self.stale.discard(pkey)
+
+    def invalidate(self, pkeys: Iterable[Hashable]) -> None:
+        with self.lock:
+            for pkey in pkeys:
+                if pkey in self.reads:
+                    self.stale.add(pkey)
+                for field in list(self.fields.get(pkey, ())):
+                    self._pop((pkey, field))
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.fields.clear()
+            self.nbytes = 0
+            self.stale.update(self.reads)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'entries': len(self.entries),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    def _pop(self, key: tuple[Hashable, Any]) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.nbytes -= entry[1]
+        pkey, field = key
+        fields = self.fields[pkey]
+        fields.discard(field)
+        if not fields:
+            del self.fields[pkey]
@@ -0,0 +1,123 @@
+import json
+import pickle
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec:
+    # Binary codecs (msgpack, pickle) need a client with decode_responses=False.
+
+    def encode(self, value: Any) -> bytes | str:
+        raise NotImplementedError
+
+    def decode(self, data: bytes | str) -> Any:
+        raise NotImplementedError
+
+    def encode_dict(self, mapping: dict[Any, Any]) -> dict[Any, bytes | str]:
+        encode = self.encode
+        return {k: encode(v) for k, v in mapping.items()}
+
+    def decode_dict(self, mapping: dict[Any, bytes | str | None]) -> dict[Any, Any]:
+        decode = self.decode
+        return {k: None if v is None else decode(v) for k, v in mapping.items()}
+
+    def encode_many(self, values: list[Any]) -> list[bytes | str]:
+        encode = self.encode
+        return [encode(v) for v in values]
+
+    def decode_many(self, values: list[bytes | str | None]) -> list[Any]:
+        decode = self.decode
+        return [None if v is None else decode(v) for v in values]
+
+
+class RawCodec(Codec):
+    def encode(self, value: bytes | str) -> bytes | str:
+        return value
+
+    def decode(self, data: bytes | str) -> bytes | str:
+        return data
+
+    def encode_many(self, values: list[Any]) -> list[bytes | str]:
+        return values
+
+    def decode_many(self, values: list[bytes | str | None]) -> list[Any]:
+        return values
+
+    def encode_dict(self, mapping: dict[Any, Any]) -> dict[Any, bytes | str]:
+        return mapping
+
+    def decode_dict(self, mapping: dict[Any, bytes | str | None]) -> dict[Any, Any]:
+        return mapping
+
+
+class Utf8Codec(Codec):
+    def encode(self, value: str) -> bytes:
+        return value.encode()
+
+    def decode(self, data: bytes | str) -> str:
+        if isinstance(data, str):
+            return data
+        return data.decode()
+
+
+class JsonCodec(Codec):
+    def __init__(self):
+        if orjson is not None:
+            self.encode = orjson.dumps
+            self.decode = orjson.loads
+
+    def encode(self, value: Any) -> bytes | str:
+        return json.dumps(value, separators=(',', ':'))
+
+    def decode(self, data: bytes | str) -> Any:
+        return json.loads(data)
+
+
+class MsgpackCodec(Codec):
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('MsgpackCodec requires msgpack: pip install extraredis[msgpack]')
+
+    def encode(self, value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+class PickleCodec(Codec):
+    def __init__(self, protocol: int = pickle.HIGHEST_PROTOCOL):
+        self.protocol = protocol
+
+    def encode(self, value: Any) -> bytes:
+        return pickle.dumps(value, protocol=self.protocol)
+
+    def decode(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
+
+CODECS = {
+    'raw': RawCodec,
+    'utf8': Utf8Codec,
+    'json': JsonCodec,
+    'msgpack': MsgpackCodec,
+    'pickle': PickleCodec,
+}
+
+
+def get_codec(codec: str | Codec | None) -> Codec | None:
+    if codec is None or isinstance(codec, Codec):
+        return codec
+    try:
+        return CODECS[codec]()
+    except KeyError:
+        raise ValueError(f'unknown codec {codec!r}, expected one of {list(CODECS)}') from None
@@ -0,0 +1,38 @@
+from array import array
+from typing import Any
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ARRAY_TYPECODES = {int: 'q', float: 'd'}
+
+
+def to_index(keys: list[Any]) -> Any:
+    if numpy is None:
+        return keys
+    # object array of the key objects: a fixed width S / U array pads keys to the longest one and drops trailing NULs
+    return numpy.array(keys, dtype=object)
+
+
+def to_column(values: list[Any], dtype: Any = None) -> Any:
+    """
+    One field of many hashes as an array. dtype None keeps the values as they are (a list).
+    int / float values are parsed in bulk: a numpy array when numpy is installed, array.array otherwise.
+    Missing values are nan in float columns and an error in int columns.
+    Other dtypes (str, bytes, numpy dtypes) need numpy.
+    """
+    if dtype is None:
+        return values
+    if dtype is float:
+        values = [float('nan') if v is None else v for v in values]
+    elif None in values:
+        raise ValueError(f'missing values can only be converted to float, got dtype {dtype!r}')
+    if numpy is not None:
+        # an array of bytes / str is parsed in C by astype
+        return numpy.array(values).astype(dtype)
+    typecode = ARRAY_TYPECODES.get(dtype)
+    if typecode is None:
+        raise ImportError(f'dtype {dtype!r} requires numpy: pip install extraredis[numpy]')
+    return array(typecode, map(dtype, values))
@@ -0,0 +1,177 @@
+import lzma
+import zlib
+from concurrent.futures import Executor
+from typing import Any
+
+from extraredis import util
+from extraredis.codecs import Codec
+from extraredis.codecs import get_codec
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# compressed values are stored as MAGIC + algorithm id + payload.
+# Values below the threshold are stored as is, unless they happen to start with MAGIC:
+# those get MAGIC + STORED so every value decodes unambiguously.
+MAGIC = b'\x00\xfeXR'
+STORED = 0
+
+
+class Compressor:
+    id: int
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    id = 1
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class LzmaCompressor(Compressor):
+    id = 2
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data)
+
+
+class ZstdCompressor(Compressor):
+    id = 3
+
+    def __init__(self, level: int = 3):
+        if zstandard is None:
+            raise ImportError('ZstdCompressor requires zstandard: pip install extraredis[zstd]')
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        # zstandard (de)compressor objects are not thread safe, create one per call
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+class Lz4Compressor(Compressor):
+    id = 4
+
+    def __init__(self, level: int = 0):
+        if lz4 is None:
+            raise ImportError('Lz4Compressor requires lz4: pip install extraredis[lz4]')
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4.frame.compress(data, compression_level=self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lz4.frame.decompress(data)
+
+
+COMPRESSORS = {
+    'zlib': ZlibCompressor,
+    'lzma': LzmaCompressor,
+    'zstd': ZstdCompressor,
+    'lz4': Lz4Compressor,
+}
+
+
+class CompressedCodec(Codec):
+    # Wraps another codec and compresses its output when it is at least `threshold` bytes.
+    # Compressed data is binary, so the client must use decode_responses=False.
+    # With an executor, encode_many/decode_many of at least `parallel_threshold` values
+    # are split into batches of that size and processed on the executor (zlib, lzma, zstd and lz4 release the GIL).
+
+    def __init__(
+        self,
+        codec: str | Codec | None = None,
+        algorithm: str | Compressor = 'zlib',
+        threshold: int = 1024,
+        executor: Executor | None = None,
+        parallel_threshold: int = 1000,
+    ):
+        self.codec = get_codec(codec)
+        if isinstance(algorithm, str):
+            algorithm = COMPRESSORS[algorithm]()
+        self.compressor = algorithm
+        self.threshold = threshold
+        self.executor = executor
+        self.parallel_threshold = parallel_threshold
+        self.header = MAGIC + bytes([algorithm.id])
+        self.decompressors = {algorithm.id: algorithm}
+
+    def encode(self, value: Any) -> bytes:
+        data = value if self.codec is None else self.codec.encode(value)
+        if isinstance(data, str):
+            data = data.encode()
+        if len(data) >= self.threshold:
+            return self.header + self.compressor.compress(data)
+        if data.startswith(MAGIC):
+            return MAGIC + bytes([STORED]) + data
+        return data
+
+    def decode(self, data: bytes) -> Any:
+        if data.startswith(MAGIC):
+            algorithm_id = data[len(MAGIC)]
+            data = data[len(MAGIC) + 1:]
+            if algorithm_id != STORED:
+                data = self._decompressor(algorithm_id).decompress(data)
+        return data if self.codec is None else self.codec.decode(data)
+
+    def encode_many(self, values: list[Any]) -> list[bytes]:
+        if self.executor is None or len(values) < self.parallel_threshold:
+            return super().encode_many(values)
+        return self._map(super().encode_many, values)
+
+    def decode_many(self, values: list[bytes | None]) -> list[Any]:
+        if self.executor is None or len(values) < self.parallel_threshold:
+            return super().decode_many(values)
+        return self._map(super().decode_many, values)
+
+    def encode_dict(self, mapping: dict[Any, Any]) -> dict[Any, bytes]:
+        return dict(zip(mapping, self.encode_many(list(mapping.values()))))
+
+    def decode_dict(self, mapping: dict[Any, bytes | None]) -> dict[Any, Any]:
+        return dict(zip(mapping, self.decode_many(list(mapping.values()))))
+
+    def _map(self, f, values: list[Any]) -> list[Any]:
+        out = []
+        for batch in self.executor.map(f, util.chunked(values, self.parallel_threshold)):
+            out += batch
+        return out
+
+    def _decompressor(self, algorithm_id: int) -> Compressor:
+        # values written with a different algorithm still decode
+        decompressor = self.decompressors.get(algorithm_id)
+        if decompressor is None:
+            for compressor in COMPRESSORS.values():
+                if compressor.id == algorithm_id:
+                    decompressor = compressor()
+                    break
+            else:
+                raise ValueError(f'unknown compression algorithm id {algorithm_id}')
+            self.decompressors[algorithm_id] = decompressor
+        return decompressor
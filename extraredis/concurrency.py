@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from collections.abc import Awaitable
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import TypeVar
+
+T = TypeVar('T')
+
+
+async def gather_async(
+    funcs: list[Callable[[], Awaitable[T]]],
+    concurrency: int | None = None,
+    executor: None = None,
+) -> list[T]:
+    # executor: for the signature of gather_sync, coroutines run on the event loop
+    if concurrency is None:
+        return await asyncio.gather(*(f() for f in funcs))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(f: Callable[[], Awaitable[T]]) -> T:
+        async with semaphore:
+            return await f()
+
+    return await asyncio.gather(*(run(f) for f in funcs))
+
+
+def gather_sync(
+    funcs: list[Callable[[], T]],
+    concurrency: int | None = None,
+    executor: ThreadPoolExecutor | None = None,
+) -> list[T]:
+    # funcs must not call gather_sync with the same executor: they could wait for threads they occupy
+    if len(funcs) <= 1 or concurrency == 1:
+        return [f() for f in funcs]
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=concurrency or len(funcs)) as pool:
+            return list(pool.map(lambda f: f(), funcs))
+    if concurrency is None:
+        return list(executor.map(lambda f: f(), funcs))
+    semaphore = threading.Semaphore(concurrency)
+
+    def run(f: Callable[[], T]) -> T:
+        with semaphore:
+            return f()
+
+    return list(executor.map(run, funcs))
+
+
+def executor_async() -> None:
+    return None
+
+
+def executor_sync() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(thread_name_prefix='extraredis')
+
+
+async def blocking_async(func: Callable[..., T], *args: Any) -> T:
+    # file IO, compression, thread joins: off the event loop
+    return await asyncio.to_thread(func, *args)
+
+
+def blocking_sync(func: Callable[..., T], *args: Any) -> T:
+    return func(*args)
+
+
+def lock_async() -> asyncio.Lock:
+    return asyncio.Lock()
+
+
+def lock_sync() -> threading.Lock:
+    return threading.Lock()
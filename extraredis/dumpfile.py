@@ -0,0 +1,197 @@
+"""
+File format of export_prefix / import_prefix:
+
+    header: MAGIC, u16 prefix length, prefix
+    blocks: u32 number of records, u8 compressor id (0: not compressed), u64 payload length, payload
+    payload records: u32 key length, i64 expire time (unix ms, 0: no expiry), u32 value length, key, DUMP value
+
+Keys are stored without the prefix. One block holds the keys of one SCAN batch. Files are read with mmap,
+keys and values of uncompressed blocks are memoryview slices of the mapped file.
+A checkpoint file next to the dump (path + '.checkpoint' / '.import-checkpoint') records the progress after every block,
+so an interrupted export / import can continue with resume=True.
+"""
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+from collections.abc import Iterator
+from typing import Any
+
+from extraredis.compression import COMPRESSORS
+from extraredis.compression import Compressor
+
+MAGIC = b'XRDUMP\x01'
+PREFIX = struct.Struct('<H')
+BLOCK = struct.Struct('<IBQ')
+RECORD = struct.Struct('<IqI')
+COMPRESSORS_BY_ID = {cls.id: cls for cls in COMPRESSORS.values()}
+
+Record = tuple[bytes | memoryview, int, bytes | memoryview]  # key, expire time, DUMP value
+
+
+def read_checkpoint(path: str) -> dict[str, Any] | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path: str, state: dict[str, Any]) -> None:
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def encode_records(records: list[Record]) -> bytes:
+    parts = []
+    for key, expire_at, value in records:
+        parts += [RECORD.pack(len(key), expire_at, len(value)), key, value]
+    return b''.join(parts)
+
+
+def decode_records(data: memoryview, n: int) -> list[Record]:
+    records = []
+    pos = 0
+    for _ in range(n):
+        key_len, expire_at, value_len = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        key = data[pos:pos + key_len]
+        pos += key_len
+        records.append((key, expire_at, data[pos:pos + value_len]))
+        pos += value_len
+    return records
+
+
+class DumpWriter:
+    # with a compressor, blocks are compressed and written by a background thread; at most `queue_size` blocks are pending
+
+    def __init__(
+        self,
+        path: str,
+        prefix: bytes,
+        compression: str | Compressor | None = None,
+        resume: bool = False,
+        queue_size: int = 2,
+    ):
+        self.path = path
+        self.checkpoint_path = path + '.checkpoint'
+        if isinstance(compression, str):
+            compression = COMPRESSORS[compression]()
+        self.compressor = compression
+        state = read_checkpoint(self.checkpoint_path) if resume else None
+        if state is None:
+            self.cursor = 0
+            self.file = open(path, 'wb')
+            self.file.write(MAGIC + PREFIX.pack(len(prefix)) + prefix)
+        else:
+            self.cursor = state['cursor']
+            self.file = open(path, 'r+b')
+            self.file.truncate(state['offset'])  # drop a block written after the last checkpoint
+            self.file.seek(state['offset'])
+        self.error: BaseException | None = None
+        self.thread = None
+        if self.compressor is not None:
+            self.queue: queue.Queue[tuple[list[Record], int] | None] = queue.Queue(queue_size)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def write(self, records: list[Record], cursor: int) -> None:
+        # records of one SCAN batch and the cursor to continue from
+        if self.thread is None:
+            self._write_block(records, cursor)
+            return
+        if self.error is not None:
+            raise self.error
+        self.queue.put((records, cursor))
+
+    def _run(self) -> None:
+        while (item := self.queue.get()) is not None:
+            if self.error is None:
+                try:
+                    self._write_block(*item)
+                except BaseException as e:
+                    self.error = e
+
+    def _write_block(self, records: list[Record], cursor: int) -> None:
+        if records:
+            data = encode_records(records)
+            compressor_id = 0
+            if self.compressor is not None:
+                data = self.compressor.compress(data)
+                compressor_id = self.compressor.id
+            self.file.write(BLOCK.pack(len(records), compressor_id, len(data)))
+            self.file.write(data)
+            self.file.flush()
+        write_checkpoint(self.checkpoint_path, {'cursor': cursor, 'offset': self.file.tell()})
+
+    def close(self, complete: bool) -> None:
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+        if complete:
+            remove(self.checkpoint_path)
+
+
+class DumpReader:
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.checkpoint_path = path + '.import-checkpoint'
+        self.file = open(path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            self.close(False)
+            raise ValueError(f'{path} is not an extraredis dump file')
+        offset = len(MAGIC)
+        (prefix_len,) = PREFIX.unpack_from(self.mmap, offset)
+        offset += PREFIX.size
+        self.prefix = self.mmap[offset:offset + prefix_len]
+        self.offset = offset + prefix_len
+        state = read_checkpoint(self.checkpoint_path) if resume else None
+        if state is not None:
+            self.offset = state['offset']
+        self.compressors: dict[int, Compressor] = {}
+
+    def __iter__(self) -> Iterator[tuple[int, list[Record]]]:
+        # -> (offset after the block, records of the block)
+        view = memoryview(self.mmap)
+        offset = self.offset
+        try:
+            while offset < len(view):
+                n, compressor_id, size = BLOCK.unpack_from(view, offset)
+                offset += BLOCK.size
+                data = view[offset:offset + size]
+                offset += size
+                if compressor_id:
+                    compressor = self.compressors.get(compressor_id)
+                    if compressor is None:
+                        compressor = self.compressors[compressor_id] = COMPRESSORS_BY_ID[compressor_id]()
+                    data = memoryview(compressor.decompress(data))
+                yield offset, decode_records(data, n)
+        finally:
+            view.release()
+
+    def checkpoint(self, offset: int) -> None:
+        write_checkpoint(self.checkpoint_path, {'offset': offset})
+
+    def close(self, complete: bool) -> None:
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass  # slices of the mapping are still referenced, it is unmapped when they are released
+        self.file.close()
+        if complete:
+            remove(self.checkpoint_path)
@@ -0,0 +1,320 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import time
+from collections.abc import Callable
+from typing import Any
+
+from extraredis.client_cache import sizeof
+
+try:
+    from opentelemetry import metrics as otel_metrics
+except ImportError:
+    otel_metrics = None
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+# seconds
+DURATION_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'),
+)
+
+# set while an instrumented method runs, so the instrumented methods it calls (mhget_field -> mhget_fields) are not reported
+_active = contextvars.ContextVar('extraredis_instrumented', default=False)
+
+
+class Call:
+    """
+    One call of an ExtraRedis(Async) method, passed to Hook.before and Hook.after.
+    keys is None before the call if the whole prefix is read. Byte counts are estimated from the arguments
+    and the returned (decoded) values, not measured on the wire.
+    """
+
+    __slots__ = ('method', 'prefix', 'keys', 'request_bytes', 'reply_bytes', 'duration', 'error')
+
+    def __init__(self, method: str, prefix: Any = None, keys: int | None = None, request_bytes: int = 0):
+        self.method = method
+        self.prefix = prefix
+        self.keys = keys
+        self.request_bytes = request_bytes
+        self.reply_bytes = 0
+        self.duration = 0.0
+        self.error: BaseException | None = None
+
+
+class Hook:
+    def before(self, call: Call) -> None:
+        pass
+
+    def after(self, call: Call) -> None:
+        pass
+
+
+def _start(hooks: list[Hook], name: str, signature: inspect.Signature, args: tuple[Any, ...], kwargs: dict[str, Any]) -> Call:
+    arguments = signature.bind(*args, **kwargs).arguments
+    if 'key' in arguments:
+        keys = 1
+    else:
+        keys = arguments.get('keys', arguments.get('mapping'))
+        keys = len(keys) if hasattr(keys, '__len__') else None
+    request_bytes = sum(sizeof(arguments.get(a)) for a in ('key', 'keys', 'field', 'fields', 'value', 'mapping'))
+    call = Call(name, arguments.get('prefix'), keys, request_bytes)
+    for hook in hooks:
+        hook.before(call)
+    return call
+
+
+def _finish(hooks: list[Hook], call: Call, result: Any = None) -> None:
+    if call.error is None:
+        call.reply_bytes += sizeof(result)
+        if call.keys is None and isinstance(result, (dict, list)):
+            call.keys = len(result)
+    for hook in hooks:
+        hook.after(call)
+
+
+async def _instrumented_agen(hooks: list[Hook], call: Call, it: Any) -> Any:
+    # only the time spent in the iterator counts, not the time of the consumer between items
+    n = 0
+    try:
+        while True:
+            token = _active.set(True)
+            t0 = time.perf_counter()
+            try:
+                item = await it.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                call.duration += time.perf_counter() - t0
+                _active.reset(token)
+            n += len(item) if isinstance(item, list) else 1  # scan_prefix yields batches
+            call.reply_bytes += sizeof(item)
+            yield item
+    except GeneratorExit:  # the consumer stopped early
+        raise
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        await it.aclose()
+        if call.keys is None:
+            call.keys = n
+        _finish(hooks, call)
+
+
+def instrumented_async(f: Callable[..., Any]) -> Callable[..., Any]:
+    # with no hook registered a call costs one extra function call and a check of self.hooks
+    name = f.__name__
+    signature = inspect.signature(f)
+
+    if inspect.isasyncgenfunction(f):
+        @functools.wraps(f)
+        async def gen_wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+            it = f(self, *args, **kwargs)
+            if self.hooks and not _active.get():
+                it = _instrumented_agen(self.hooks, _start(self.hooks, name, signature, (self, *args), kwargs), it)
+            try:
+                async for item in it:
+                    yield item
+            finally:
+                await it.aclose()  # async for doesn't forward aclose like yield from does
+        return gen_wrapper
+
+    @functools.wraps(f)
+    async def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+        if not self.hooks or _active.get():
+            return await f(self, *args, **kwargs)
+        call = _start(self.hooks, name, signature, (self, *args), kwargs)
+        token = _active.set(True)
+        t0 = time.perf_counter()
+        result = None
+        try:
+            result = await f(self, *args, **kwargs)
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.duration = time.perf_counter() - t0
+            _active.reset(token)
+            _finish(self.hooks, call, result)
+    return wrapper
+
+
+def _instrumented_gen(hooks: list[Hook], call: Call, it: Any) -> Any:
+    n = 0
+    try:
+        while True:
+            token = _active.set(True)
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                break
+            finally:
+                call.duration += time.perf_counter() - t0
+                _active.reset(token)
+            n += len(item) if isinstance(item, list) else 1
+            call.reply_bytes += sizeof(item)
+            yield item
+    except GeneratorExit:
+        raise
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        it.close()
+        if call.keys is None:
+            call.keys = n
+        _finish(hooks, call)
+
+
+def instrumented_sync(f: Callable[..., Any]) -> Callable[..., Any]:
+    name = f.__name__
+    signature = inspect.signature(f)
+
+    if inspect.isgeneratorfunction(f):
+        @functools.wraps(f)
+        def gen_wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+            if not self.hooks or _active.get():
+                yield from f(self, *args, **kwargs)
+                return
+            call = _start(self.hooks, name, signature, (self, *args), kwargs)
+            yield from _instrumented_gen(self.hooks, call, f(self, *args, **kwargs))
+        return gen_wrapper
+
+    @functools.wraps(f)
+    def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+        if not self.hooks or _active.get():
+            return f(self, *args, **kwargs)
+        call = _start(self.hooks, name, signature, (self, *args), kwargs)
+        token = _active.set(True)
+        t0 = time.perf_counter()
+        result = None
+        try:
+            result = f(self, *args, **kwargs)
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.duration = time.perf_counter() - t0
+            _active.reset(token)
+            _finish(self.hooks, call, result)
+    return wrapper
+
+
+class Series:
+    __slots__ = ('count', 'errors', 'keys', 'request_bytes', 'reply_bytes', 'duration', 'buckets')
+
+    def __init__(self, n_buckets: int):
+        self.count = 0
+        self.errors = 0
+        self.keys = 0
+        self.request_bytes = 0
+        self.reply_bytes = 0
+        self.duration = 0.0
+        self.buckets = [0] * n_buckets
+
+
+class HistogramCollector(Hook):
+    """In-process duration histogram and key / byte totals per (method, prefix)."""
+
+    def __init__(self, buckets: tuple[float, ...] = DURATION_BUCKETS):
+        self.bounds = buckets
+        self.series: dict[tuple[str, Any], Series] = {}
+
+    def after(self, call: Call) -> None:
+        series = self.series.get((call.method, call.prefix))
+        if series is None:
+            series = self.series[call.method, call.prefix] = Series(len(self.bounds))
+        series.count += 1
+        series.errors += call.error is not None
+        series.keys += call.keys or 0
+        series.request_bytes += call.request_bytes
+        series.reply_bytes += call.reply_bytes
+        series.duration += call.duration
+        series.buckets[min(bisect.bisect_left(self.bounds, call.duration), len(self.bounds) - 1)] += 1
+
+    def quantile(self, method: str, prefix: Any, q: float) -> float:
+        # upper bound of the bucket containing the q-quantile
+        series = self.series[method, prefix]
+        rank = q * series.count
+        total = 0
+        for bound, n in zip(self.bounds, series.buckets):
+            total += n
+            if total >= rank:
+                return bound
+        return self.bounds[-1]
+
+    def stats(self) -> dict[tuple[str, Any], dict[str, float]]:
+        return {
+            key: {
+                'count': s.count,
+                'errors': s.errors,
+                'keys': s.keys,
+                'request_bytes': s.request_bytes,
+                'reply_bytes': s.reply_bytes,
+                'duration': s.duration,
+                'p50': self.quantile(*key, 0.5),
+                'p99': self.quantile(*key, 0.99),
+            }
+            for key, s in self.series.items()
+        }
+
+    def clear(self) -> None:
+        self.series.clear()
+
+
+def _label(prefix: Any) -> str:
+    if isinstance(prefix, bytes):
+        return prefix.decode(errors='replace')
+    return '' if prefix is None else str(prefix)
+
+
+class OpenTelemetryHook(Hook):
+    def __init__(self, meter: Any = None):
+        if otel_metrics is None:
+            raise ImportError('OpenTelemetryHook requires opentelemetry-api: pip install extraredis[opentelemetry]')
+        meter = meter or otel_metrics.get_meter('extraredis')
+        self.duration = meter.create_histogram('extraredis.call.duration', unit='s')
+        self.keys = meter.create_counter('extraredis.call.keys')
+        self.request_bytes = meter.create_counter('extraredis.call.request_bytes', unit='By')
+        self.reply_bytes = meter.create_counter('extraredis.call.reply_bytes', unit='By')
+        self.errors = meter.create_counter('extraredis.call.errors')
+
+    def after(self, call: Call) -> None:
+        attributes = {'method': call.method, 'prefix': _label(call.prefix)}
+        self.duration.record(call.duration, attributes)
+        self.keys.add(call.keys or 0, attributes)
+        self.request_bytes.add(call.request_bytes, attributes)
+        self.reply_bytes.add(call.reply_bytes, attributes)
+        if call.error is not None:
+            self.errors.add(1, attributes)
+
+
+class PrometheusHook(Hook):
+    def __init__(self, registry: Any = None, namespace: str = 'extraredis'):
+        if prometheus_client is None:
+            raise ImportError('PrometheusHook requires prometheus-client: pip install extraredis[prometheus]')
+        kwargs = {'namespace': namespace, 'labelnames': ('method', 'prefix')}
+        if registry is not None:
+            kwargs['registry'] = registry
+        self.duration = prometheus_client.Histogram('call_duration_seconds', 'duration of calls', buckets=DURATION_BUCKETS, **kwargs)
+        self.keys = prometheus_client.Counter('call_keys', 'keys read or written', **kwargs)
+        self.request_bytes = prometheus_client.Counter('call_request_bytes', 'estimated request bytes', **kwargs)
+        self.reply_bytes = prometheus_client.Counter('call_reply_bytes', 'estimated reply bytes', **kwargs)
+        self.errors = prometheus_client.Counter('call_errors', 'failed calls', **kwargs)
+
+    def after(self, call: Call) -> None:
+        labels = call.method, _label(call.prefix)
+        self.duration.labels(*labels).observe(call.duration)
+        self.keys.labels(*labels).inc(call.keys or 0)
+        self.request_bytes.labels(*labels).inc(call.request_bytes)
+        self.reply_bytes.labels(*labels).inc(call.reply_bytes)
+        if call.error is not None:
+            self.errors.labels(*labels).inc()
@@ -0,0 +1,155 @@
+import heapq
+import os
+import random
+import sys
+import sysconfig
+import warnings
+from typing import Any
+
+from extraredis.instrumentation import Call
+from extraredis.instrumentation import Hook
+
+# methods which SCAN the whole prefix when called without keys
+WHOLE_PREFIX_METHODS = frozenset({
+    'maddprefix', 'mget', 'mhget_field', 'mhget_fields', 'mhget_field_server',
+    'iter_mget', 'iter_mhget_fields', 'mget_records',
+})
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_STDLIB_DIR = sysconfig.get_paths()['stdlib']
+
+
+def _internal(filename: str) -> bool:
+    if filename.startswith((_PACKAGE_DIR, '<frozen')):
+        return True
+    return filename.startswith(_STDLIB_DIR) and 'site-packages' not in filename
+
+
+def caller_site() -> tuple[str, int, str] | None:
+    # first frame outside extraredis and the standard library (asyncio, contextlib, ...)
+    frame = sys._getframe(1)
+    while frame is not None:
+        if not _internal(frame.f_code.co_filename):
+            return frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name
+        frame = frame.f_back
+    return None
+
+
+class Profiler(Hook):
+    """
+    Slow-call and hot-prefix profiler, registered as an instrumentation hook:
+
+        profiler = Profiler(sample_rate=0.01, slow_threshold=0.05)
+        extraredis = ExtraRedisAsync(hooks=[profiler])
+        ...
+        print(profiler.report())
+
+    Every call is counted per prefix. The caller's frame is recorded for a sample_rate fraction of calls
+    and for every call slower than slow_threshold seconds (the max_slow slowest are kept).
+    A call site which issues hot_scan_calls whole-prefix reads (no keys, so the whole keyspace is SCANned) gets a RuntimeWarning.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.01,
+        slow_threshold: float = 0.1,
+        max_slow: int = 100,
+        hot_scan_calls: int = 10,
+    ):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_slow = max_slow
+        self.hot_scan_calls = hot_scan_calls
+        # prefix -> [calls, seconds, bytes, keys]
+        self.prefixes: dict[Any, list[float]] = {}
+        # call site -> {'calls', 'seconds', 'keys': sampled calls, their time and keys, 'prefixes': {prefix: sampled calls}}
+        self.sites: dict[tuple[str, int, str], dict[str, Any]] = {}
+        self.slow: list[tuple[float, int, dict[str, Any]]] = []  # min-heap of the slowest calls
+        self.scans: dict[tuple[str, int, str], int] = {}
+        self._n_slow = 0
+
+    def before(self, call: Call) -> None:
+        if call.keys is not None or call.method not in WHOLE_PREFIX_METHODS:
+            return
+        site = caller_site()
+        if site is None:
+            return
+        n = self.scans[site] = self.scans.get(site, 0) + 1
+        if n == self.hot_scan_calls:
+            filename, lineno, _ = site
+            warnings.warn_explicit(
+                f'{call.method}({call.prefix!r}) without keys scans the whole keyspace and was called {n} times here, '
+                'pass keys or cache the key list',
+                RuntimeWarning,
+                filename,
+                lineno,
+            )
+
+    def after(self, call: Call) -> None:
+        stats = self.prefixes.get(call.prefix)
+        if stats is None:
+            stats = self.prefixes[call.prefix] = [0, 0.0, 0, 0]
+        stats[0] += 1
+        stats[1] += call.duration
+        stats[2] += call.request_bytes + call.reply_bytes
+        stats[3] += call.keys or 0
+        slow = call.duration >= self.slow_threshold
+        if not slow and random.random() >= self.sample_rate:
+            return
+        site = caller_site()
+        if site is not None:
+            site_stats = self.sites.get(site)
+            if site_stats is None:
+                site_stats = self.sites[site] = {'calls': 0, 'seconds': 0.0, 'keys': 0, 'prefixes': {}}
+            site_stats['calls'] += 1
+            site_stats['seconds'] += call.duration
+            site_stats['keys'] += call.keys or 0
+            site_stats['prefixes'][call.prefix] = site_stats['prefixes'].get(call.prefix, 0) + 1
+        if slow:
+            record = {
+                'method': call.method,
+                'prefix': call.prefix,
+                'keys': call.keys,
+                'bytes': call.request_bytes + call.reply_bytes,
+                'duration': call.duration,
+                'site': site,
+            }
+            self._n_slow += 1  # tie breaker, records are not comparable
+            item = call.duration, self._n_slow, record
+            if len(self.slow) < self.max_slow:
+                heapq.heappush(self.slow, item)
+            else:
+                heapq.heappushpop(self.slow, item)
+
+    def top_prefixes(self, by: str = 'duration', n: int = 10) -> list[tuple[Any, float]]:
+        i = {'calls': 0, 'duration': 1, 'bytes': 2, 'keys': 3}[by]
+        return heapq.nlargest(n, ((prefix, stats[i]) for prefix, stats in self.prefixes.items()), key=lambda x: x[1])
+
+    def top_sites(self, n: int = 10) -> list[tuple[tuple[str, int, str], dict[str, Any]]]:
+        # by sampled time
+        return heapq.nlargest(n, self.sites.items(), key=lambda x: x[1]['seconds'])
+
+    def slow_calls(self) -> list[dict[str, Any]]:
+        return [record for _, _, record in sorted(self.slow, reverse=True)]
+
+    def report(self, n: int = 10) -> str:
+        lines = []
+        for by in ('duration', 'bytes', 'keys'):
+            lines.append(f'top prefixes by {by}:')
+            lines += [f'  {prefix!r}: {value:g}' for prefix, value in self.top_prefixes(by, n)]
+        lines.append('top call sites by sampled time:')
+        for (filename, lineno, function), stats in self.top_sites(n):
+            prefixes = ', '.join(repr(p) for p in stats['prefixes'])
+            lines.append(f"  {filename}:{lineno} {function}: {stats['seconds']:.6f}s {stats['calls']} calls {stats['keys']} keys, prefixes {prefixes}")
+        lines.append(f'calls slower than {self.slow_threshold}s:')
+        for record in self.slow_calls()[:n]:
+            site = record['site']
+            where = '' if site is None else f' at {site[0]}:{site[1]}'
+            lines.append(f"  {record['method']}({record['prefix']!r}) {record['keys']} keys {record['duration']:.6f}s{where}")
+        return '\n'.join(lines)
+
+    def clear(self) -> None:
+        self.prefixes.clear()
+        self.sites.clear()
+        self.slow.clear()
+        self.scans.clear()
@@ -0,0 +1,225 @@
+import asyncio
+import inspect
+import time
+from collections.abc import Callable
+from collections.abc import Hashable
+from collections.abc import Iterable
+from typing import Any
+
+from extraredis._async import ExtraRedisAsync
+
+
+class ReadThroughCache:
+    """
+    Read-through / write-behind cache of one prefix in front of a slow source.
+
+    Keys missing from redis are loaded with one `loader(keys) -> {key: value}` call per read (sync or async loader),
+    concurrent reads of a key being loaded wait for the same load (single-flight) and loaded values are written back.
+    Keys the loader doesn't return are not cached and read as None.
+    With hash=True values are hashes read with mhget_fields (projected to `fields`) and written with mhset_fields.
+
+    With write_behind (seconds), writes are buffered and flushed in bulk mset / mhset_fields batches
+    after write_behind seconds or when max_buffer keys are buffered. Buffered values and values being written are served
+    to reads of this instance and are not overwritten by loaded values. A failed flush keeps its values buffered
+    and the error is raised by the next flush() / close().
+
+        cache = ReadThroughCache(ExtraRedisAsync(), b'user', load_users, write_behind=0.1)
+        users = await cache.get_many(ids)
+    """
+
+    def __init__(
+        self,
+        extraredis: ExtraRedisAsync,
+        prefix: Hashable,
+        loader: Callable[[list[Any]], Any],
+        hash: bool = False,
+        fields: list[Any] | None = None,
+        ex: float | None = None,
+        write_behind: float | None = None,
+        max_buffer: int = 10_000,
+    ):
+        self.extraredis = extraredis
+        self.prefix = prefix
+        self.loader = loader
+        self.hash = hash
+        self.fields = fields
+        self.ex = ex
+        self.write_behind = write_behind
+        self.max_buffer = max_buffer
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_errors = 0
+        self.load_seconds = 0.0
+        self.max_load_seconds = 0.0
+        self.writes = 0
+        self._loading: dict[Any, asyncio.Future[Any]] = {}
+        self._buffer: dict[Any, Any] = {}
+        self._inflight: dict[Any, Any] = {}  # values being written
+        self._written: set[Any] = set()  # keys set while loads are running
+        self._flush_error: BaseException | None = None
+        self._flush_handle: asyncio.Handle | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def get(self, key: Any) -> Any:
+        return (await self.get_many([key]))[key]
+
+    async def get_many(self, keys: Iterable[Any]) -> dict[Any, Any]:
+        requested = list(dict.fromkeys(keys))
+        out = {}
+        for k in requested:
+            if k in self._buffer:
+                out[k] = self._project(self._buffer[k])
+            elif k in self._inflight:
+                out[k] = self._project(self._inflight[k])
+        self.hits += len(out)
+        keys = [k for k in requested if k not in out]
+        if not keys:
+            return out
+        if self.hash:
+            values = await self.extraredis.mhget_fields(self.prefix, keys, self.fields)
+        else:
+            values = await self.extraredis.mget(self.prefix, keys)
+        misses = []
+        for key, value in values.items():
+            if self._is_miss(value):
+                misses.append(key)
+            else:
+                out[key] = value
+        self.hits += len(keys) - len(misses)
+        self.misses += len(misses)
+        if misses:
+            out.update(await self._load(misses))
+        return {k: out[k] for k in requested}
+
+    async def set(self, key: Any, value: Any) -> None:
+        await self.set_many({key: value})
+
+    async def set_many(self, mapping: dict[Any, Any]) -> None:
+        if self._loading:
+            self._written.update(mapping)
+        if self.write_behind is None:
+            await self._write(mapping)
+            return
+        self._buffer.update(mapping)
+        if len(self._buffer) >= self.max_buffer:
+            self._schedule_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.write_behind, self._schedule_flush)
+
+    async def flush(self) -> None:
+        self._schedule_flush()
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+        if self._flush_error is not None:
+            error, self._flush_error = self._flush_error, None
+            raise error
+
+    async def close(self) -> None:
+        await self.flush()
+
+    def stats(self) -> dict[str, float]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0,
+            'loads': self.loads,
+            'load_errors': self.load_errors,
+            'mean_load_seconds': self.load_seconds / self.loads if self.loads else 0.0,
+            'max_load_seconds': self.max_load_seconds,
+            'buffered': len(self._buffer),
+            'writes': self.writes,
+        }
+
+    def _is_miss(self, value: Any) -> bool:
+        if not self.hash:
+            return value is None
+        if self.fields is None:
+            return not value  # HGETALL of a missing hash
+        return all(v is None for v in value.values())
+
+    def _project(self, value: Any) -> Any:
+        # loaded and buffered hashes are returned like the ones read from redis: only the projected fields
+        if value is None or not self.hash or self.fields is None:
+            return value
+        return {f: value.get(f) for f in self.fields}
+
+    async def _load(self, keys: list[Any]) -> dict[Any, Any]:
+        # keys already being loaded by another caller are awaited, the rest are loaded here in one loader call
+        waiting = {k: self._loading[k] for k in keys if k in self._loading}
+        todo = [k for k in keys if k not in waiting]
+        loaded = {}
+        if todo:
+            loop = asyncio.get_running_loop()
+            futures = {k: loop.create_future() for k in todo}
+            self._loading.update(futures)
+            try:
+                loaded = await self._call_loader(todo)
+                # a key set while it was loading keeps the set value
+                fresh = {k: v for k, v in loaded.items() if k not in self._written and k not in self._buffer and k not in self._inflight}
+            except BaseException as e:
+                for future in futures.values():
+                    future.set_exception(e)
+                    future.exception()  # retrieved: nobody else may be waiting
+                raise
+            finally:
+                for k in todo:
+                    del self._loading[k]
+                if not self._loading:
+                    self._written.clear()
+            for k, future in futures.items():
+                future.set_result(self._project(loaded.get(k)))
+            if fresh:
+                await self.set_many(fresh)
+        out = {k: await asyncio.shield(future) for k, future in waiting.items()}
+        return out | {k: futures[k].result() for k in todo}
+
+    async def _call_loader(self, keys: list[Any]) -> dict[Any, Any]:
+        t0 = time.perf_counter()
+        self.loads += 1
+        try:
+            loaded = self.loader(keys)
+            if inspect.isawaitable(loaded):
+                loaded = await loaded
+        except BaseException:
+            self.load_errors += 1
+            raise
+        finally:
+            dt = time.perf_counter() - t0
+            self.load_seconds += dt
+            self.max_load_seconds = max(self.max_load_seconds, dt)
+        return loaded
+
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        buffer, self._buffer = self._buffer, {}
+        if not buffer:
+            return
+        self._inflight.update(buffer)  # before the task starts, so the values are never neither buffered nor in flight
+        task = asyncio.ensure_future(self._flush(buffer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, buffer: dict[Any, Any]) -> None:
+        try:
+            await self._write(buffer)
+        except Exception as e:
+            # values set since this flush started are newer than the failed ones
+            for k, v in buffer.items():
+                self._buffer.setdefault(k, v)
+            self._flush_error = e
+
+    async def _write(self, mapping: dict[Any, Any]) -> None:
+        self._inflight.update(mapping)
+        try:
+            if self.hash:
+                await self.extraredis.mhset_fields(self.prefix, mapping, ex=self.ex)
+            else:
+                await self.extraredis.mset(self.prefix, mapping, ex=self.ex)
+        finally:
+            for k, v in mapping.items():
+                if self._inflight.get(k) is v:  # not replaced by a later write of the key
+                    del self._inflight[k]
+        self.writes += 1
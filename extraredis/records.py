@@ -0,0 +1,104 @@
+import dataclasses
+import types
+import typing
+from collections.abc import Callable
+from collections.abc import Iterable
+from typing import Any
+from typing import AnyStr
+
+from extraredis import util
+
+
+def _str(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _bytes(value: Any) -> bytes:
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+def _bool(value: Any) -> bool:
+    return _str(value) not in ('', '0', 'false', 'False')
+
+
+LOADERS: dict[Any, Callable[[Any], Any]] = {int: int, float: float, str: _str, bytes: _bytes, bool: _bool}
+
+
+def _loader(annotation: Any) -> Callable[[Any], Any] | None:
+    # int | None -> int; unknown types are returned as read
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        if len(args) == 1:
+            annotation = args[0]
+    return LOADERS.get(annotation)
+
+
+def record(prefix: AnyStr) -> Callable[[type], type]:
+    """
+    Declares a record type stored as one hash per record under prefix:
+
+        @record(b'user')
+        class User:
+            id: str  # the first field is the key of the hash, it is not stored in the hash
+            name: str
+            age: int | None = None
+
+    The class becomes a dataclass with __slots__. ExtraRedis(Async).mget_records / mset_records read and write lists of
+    records with HMGET of the declared fields, converting field values to the annotated types (int, float, str, bytes, bool).
+    """
+    def wrap(cls: type) -> type:
+        cls = dataclasses.dataclass(slots=True)(cls)
+        hints = typing.get_type_hints(cls)
+        names = [f.name for f in dataclasses.fields(cls)]
+        if len(names) < 2:
+            raise TypeError('a record needs a key field and at least one stored field')
+        cls.__record_prefix__ = prefix
+        cls.__record_fields__ = tuple(names[1:])
+        cls.__record_loaders__ = tuple(_loader(hints[name]) for name in names)
+        return cls
+    return wrap
+
+
+def is_record(cls: type) -> bool:
+    return hasattr(cls, '__record_fields__')
+
+
+def load(cls: type, keys: list[Any], rows: list[list[Any]]) -> list[Any]:
+    # rows: HMGET values of cls.__record_fields__ per key; a hash without any of the fields is None
+    key_loader, *loaders = cls.__record_loaders__
+    cols = []
+    for loader, col in zip(loaders, zip(*rows)):
+        if loader is not None:
+            col = [None if v is None else loader(v) for v in col]
+        cols.append(col)
+    if key_loader is not None:
+        keys = map(key_loader, keys)
+    return [
+        None if all(v is None for v in row) else cls(key, *values)
+        for key, row, values in zip(keys, rows, zip(*cols))
+    ]
+
+
+def dump(records: Iterable[Any], decode_responses: bool) -> tuple[Any, dict[Any, dict[str, Any]]]:
+    # -> (prefix, {key: {field: value}}); None fields are not written, bools are stored as 1 / 0
+    records = list(records)
+    if not records:
+        return None, {}
+    cls = type(records[0])
+    if not is_record(cls):
+        raise TypeError(f'{cls.__name__} is not a record, declare it with @record(prefix)')
+    key_name = dataclasses.fields(cls)[0].name
+    fields = cls.__record_fields__
+    mapping = {}
+    for r in records:
+        if type(r) is not cls:
+            raise TypeError(f'records of one call must have the same type, got {cls.__name__} and {type(r).__name__}')
+        key = util.to_response(getattr(r, key_name), decode_responses)
+        values = {}
+        for field in fields:
+            value = getattr(r, field)
+            if value is not None:
+                values[field] = int(value) if isinstance(value, bool) else value
+        if values:  # a hash needs at least one field, a record without values reads as None anyway
+            mapping[key] = values
+    return cls.__record_prefix__, mapping
@@ -0,0 +1,156 @@
+# Lua scripts run with EVALSHA by ExtraRedis(Async). redis-py Script objects cache the SHA and reload the script on NOSCRIPT.
+#
+# *_PREFIX scripts walk the keyspace with up to `steps` SCAN calls per invocation, so each invocation blocks the server
+# for a bounded time and the client loops until the returned cursor is 0.
+# ARGV: cursor, match, count, steps[, type]
+
+_SCAN_STEP = '''
+local reply
+if scan_type then
+    reply = redis.call('SCAN', cursor, 'MATCH', ARGV[2], 'COUNT', ARGV[3], 'TYPE', scan_type)
+else
+    reply = redis.call('SCAN', cursor, 'MATCH', ARGV[2], 'COUNT', ARGV[3])
+end
+cursor = reply[1]
+local keys = reply[2]
+'''
+
+# returns {cursor, number of deleted keys}
+DELETE_PREFIX = '''
+local cursor, n, scan_type = ARGV[1], 0, ARGV[5]
+for _ = 1, tonumber(ARGV[4]) do
+''' + _SCAN_STEP + '''
+    -- unpack is limited by the Lua C stack, SCAN may return more than COUNT keys
+    for i = 1, #keys, 1000 do
+        n = n + redis.call('UNLINK', unpack(keys, i, math.min(i + 999, #keys)))
+    end
+    if cursor == '0' then break end
+end
+return {cursor, n}
+'''
+
+# returns {cursor, number of keys}; a key may be counted twice if the keyspace is rehashed during the scan
+COUNT_PREFIX = '''
+local cursor, n, scan_type = ARGV[1], 0, ARGV[5]
+for _ = 1, tonumber(ARGV[4]) do
+''' + _SCAN_STEP + '''
+    n = n + #keys
+    if cursor == '0' then break end
+end
+return {cursor, n}
+'''
+
+# ARGV: cursor, match, count, steps, field. Returns {cursor, key1, value1, key2, value2, ...}
+HGET_PREFIX = '''
+local cursor, out, scan_type = ARGV[1], {}, 'hash'
+for _ = 1, tonumber(ARGV[4]) do
+''' + _SCAN_STEP + '''
+    for _, key in ipairs(keys) do
+        out[#out + 1] = key
+        out[#out + 1] = redis.call('HGET', key, ARGV[5])
+    end
+    if cursor == '0' then break end
+end
+table.insert(out, 1, cursor)
+return out
+'''
+
+# KEYS: hashes, ARGV: field. Returns the values of the field (nil for missing hashes / fields)
+HGET_KEYS = '''
+local out = {}
+for i, key in ipairs(KEYS) do
+    out[i] = redis.call('HGET', key, ARGV[1])
+end
+return out
+'''
+
+# KEYS: keys, ARGV: values. SET NX every key on its own (unlike all-or-nothing MSETNX), returns 1 for keys that were set
+MSET_NX = '''
+local out = {}
+for i, key in ipairs(KEYS) do
+    out[i] = redis.call('SET', key, ARGV[i], 'NX') and 1 or 0
+end
+return out
+'''
+
+# HSET which keeps secondary indexes of the hash fields up to date, so it needs no read of the old values by the client.
+# KEYS: hash, ARGV: index key prefix, then (field, value, kind) triples. kind: 'n' numeric (sorted set of hash keys
+# scored by the value), 'e' equality (set of hash keys per value), '-' not indexed. Returns the number of new fields
+# Equality keys are e:<byte length of field>:<field>:<value>, see ExtraRedis.index_key
+HSET_INDEXED = '''
+local idx, n = ARGV[1], 0
+local function ekey(field, value)
+    return idx .. 'e:' .. #field .. ':' .. field .. ':' .. value
+end
+for i = 2, #ARGV, 3 do
+    local field, value, kind = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+    if kind == 'e' then
+        local old = redis.call('HGET', KEYS[1], field)
+        if old ~= value then
+            if old then
+                redis.call('SREM', ekey(field, old), KEYS[1])
+            end
+            redis.call('SADD', ekey(field, value), KEYS[1])
+        end
+    elseif kind == 'n' then
+        local score = tonumber(value)
+        if score then
+            redis.call('ZADD', idx .. 'n:' .. field, score, KEYS[1])
+        else
+            redis.call('ZREM', idx .. 'n:' .. field, KEYS[1])
+        end
+    end
+    n = n + redis.call('HSET', KEYS[1], field, value)
+end
+return n
+'''
+
+# deletes hashes of an indexed prefix together with their index entries
+# KEYS: hashes, ARGV: index prefix, then field, kind ('e' / 'n') pairs; returns the number of deleted hashes
+DEL_INDEXED = '''
+local idx, n = ARGV[1], 0
+local function ekey(field, value)
+    return idx .. 'e:' .. #field .. ':' .. field .. ':' .. value
+end
+for _, key in ipairs(KEYS) do
+    for i = 2, #ARGV, 2 do
+        local field, kind = ARGV[i], ARGV[i + 1]
+        if kind == 'e' then
+            local old = redis.call('HGET', key, field)
+            if old then
+                redis.call('SREM', ekey(field, old), key)
+            end
+        else
+            redis.call('ZREM', idx .. 'n:' .. field, key)
+        end
+    end
+    n = n + redis.call('DEL', key)
+end
+return n
+'''
+
+# removes index entries whose hash no longer matches: deleted or expired hashes, changed values
+# numeric entries of hashes with a changed numeric value are re-scored
+# KEYS[1]: index set / sorted set, ARGV: field, kind ('e' / 'n'), value of an equality index ('' otherwise), hash keys
+# returns the number of entries removed or re-scored
+INDEX_CLEANUP = '''
+local field, kind, value, n = ARGV[1], ARGV[2], ARGV[3], 0
+for i = 4, #ARGV do
+    local key = ARGV[i]
+    local current = redis.call('HGET', key, field)
+    if kind == 'e' then
+        if current ~= value then
+            n = n + redis.call('SREM', KEYS[1], key)
+        end
+    else
+        local score = current and tonumber(current)
+        if not score then
+            n = n + redis.call('ZREM', KEYS[1], key)
+        elseif tonumber(redis.call('ZSCORE', KEYS[1], key)) ~= score then
+            redis.call('ZADD', KEYS[1], score, key)
+            n = n + 1
+        end
+    end
+end
+return n
+'''
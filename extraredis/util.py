@@ -1,3 +1,17 @@
+import itertools
+import re
+from collections.abc import Iterable
+from collections.abc import Iterator
+from typing import Any
+from typing import AnyStr
+from typing import TypeVar
+
+T = TypeVar('T')
+
+GLOB_SPECIAL_STR = re.compile(r'([*?\[\]\\])')
+GLOB_SPECIAL_BYTES = re.compile(rb'([*?\[\]\\])')
+
+
 def encode_list(values: list[str]) -> list[bytes]:
     return [value.encode() for value in values]
 
@@ -28,3 +42,22 @@ def encode_dict_values(mapping: dict[str, str]) -> dict[str, bytes]:
 
 def decode_dict_values(mapping: dict[str, bytes]) -> dict[str, str]:
     return {key: value.decode() for key, value in mapping.items()}
+
+
+def to_response(value: Any, decode_responses: bool) -> str | bytes:
+    # value as redis returns it: int 1 is read back as b'1' or '1'
+    if decode_responses:
+        return value.decode() if isinstance(value, bytes) else str(value)
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+def escape_glob(pattern: AnyStr) -> AnyStr:
+    if isinstance(pattern, bytes):
+        return GLOB_SPECIAL_BYTES.sub(rb'\\\1', pattern)
+    return GLOB_SPECIAL_STR.sub(r'\\\1', pattern)
+
+
+def chunked(values: Iterable[T], size: int) -> Iterator[list[T]]:
+    it = iter(values)
+    while chunk := list(itertools.islice(it, size)):
+        yield chunk
@@ -10,6 +10,13 @@ ADDITIONAL_REPLACEMENTS = {
     'pytest_mark_asyncio': 'pytest_mark_sync',
     'pytest_asyncio': 'pytest',
     'ExtraRedisAsync': 'ExtraRedis',
+    'gather_async': 'gather_sync',
+    'executor_async': 'executor_sync',
+    'lock_async': 'lock_sync',
+    'blocking_async': 'blocking_sync',
+    'ClientTrackingAsync': 'ClientTracking',
+    'instrumented_async': 'instrumented_sync',
+    '_async': '_sync',
 }
 
 
@@ -1,7 +1,22 @@
+import array
+import math
+import random
+import time
+
 import pytest
 import pytest_asyncio
+from redis.exceptions import ResponseError
 
+from extraredis import ClientCache
 from extraredis import ExtraRedisAsync
+from extraredis import columns
+from extraredis import dumpfile
+from extraredis._async.tracking import ClientTrackingAsync
+from extraredis.client_cache import MISSING
+from extraredis.compression import CompressedCodec
+from extraredis.instrumentation import HistogramCollector
+from extraredis.instrumentation import Hook
+from extraredis.records import record
 
 import fakeredis.aioredis as fake_redis_async  # isort:skip
 import fakeredis as fake_redis_sync  # isort:skip
@@ -289,3 +304,811 @@ async def test_mhset_fields(extraredis, extraredis_decode, khashtable):
         '2': {'a': '222', 'b': '2222', 'c': '22222'},
         '3': {'a': '333', 'b': '3333', 'c': '33333'},
     }
+
+
+@pytest_mark_asyncio
+async def test_scan_prefix(extraredis, extraredis_decode, kvtable, khashtable):
+    batches = [b async for b in extraredis.scan_prefix(b'kvtable', count=1)]
+    assert sorted(k for b in batches for k in b) == [b'kvtable:0', b'kvtable:1', b'kvtable:2']
+    assert await extraredis.maddprefix(b'kvtable', _type='hash') == []
+    assert await extraredis.maddprefix(b'khashtable', _type='hash') == [b'khashtable:0', b'khashtable:1', b'khashtable:2']
+    assert await extraredis_decode.maddprefix('khashtable', _type='string') == []
+
+
+@pytest_mark_asyncio
+async def test_scan_prefix_escapes_glob(extraredis):
+    await extraredis.mset(b'a*', {b'1': b'1'})
+    await extraredis.mset(b'ab', {b'1': b'1'})
+    assert await extraredis.maddprefix(b'a*') == [b'a*:1']
+
+
+@pytest_mark_asyncio
+async def test_scan_prefix_deduplicates(extraredis, monkeypatch):
+    replies = [(1, [b'p:0', b'p:1']), (0, [b'p:1', b'p:2'])]
+
+    async def scan(cursor, **kwargs):
+        return replies.pop(0)
+
+    monkeypatch.setattr(extraredis.redis, 'scan', scan)
+    assert await extraredis.maddprefix(b'p') == [b'p:0', b'p:1', b'p:2']
+
+
+@pytest_mark_asyncio
+async def test_mget_skips_other_types(extraredis, kvtable):
+    await extraredis.hset_field(b'kvtable', b'h', b'a', b'1')
+    assert await extraredis.mget(b'kvtable') == {b'0': b'0', b'1': b'1', b'2': b'2'}
+    assert await extraredis.mhget_fields(b'kvtable') == {b'h': {b'a': b'1'}}
+
+
+@pytest_mark_asyncio
+async def test_iter_mget(extraredis, extraredis_decode, kvtable):
+    assert [kv async for kv in extraredis.iter_mget(b'kvtable', count=1)] == [(b'0', b'0'), (b'1', b'1'), (b'2', b'2')]
+    assert [kv async for kv in extraredis_decode.iter_mget('kvtable')] == [('0', '0'), ('1', '1'), ('2', '2')]
+    assert [kv async for kv in extraredis.iter_mget(b'missing')] == []
+
+
+@pytest_mark_asyncio
+async def test_iter_mhget_fields(extraredis, extraredis_decode, khashtable):
+    assert dict([kv async for kv in extraredis.iter_mhget_fields(b'khashtable', count=1)]) == {
+        b'0': {b'a': b'0', b'b': b'0', b'c': b'0'},
+        b'1': {b'a': b'1', b'b': b'10', b'c': b'100'},
+        b'2': {b'a': b'2', b'b': b'20', b'c': b'200'},
+    }
+    assert dict([kv async for kv in extraredis_decode.iter_mhget_fields('khashtable', fields=['a', 'z'])]) == {
+        '0': {'a': '0', 'z': None},
+        '1': {'a': '1', 'z': None},
+        '2': {'a': '2', 'z': None},
+    }
+
+
+@pytest_mark_asyncio
+async def test_chunking(redis, monkeypatch):
+    extraredis = ExtraRedisAsync(redis, chunk_size=2)
+    mapping = {str(i).encode(): str(i * 10).encode() for i in range(5)}
+    calls = []
+    mset = redis.mset
+
+    async def mset_spy(m):
+        calls.append(len(m))
+        return await mset(m)
+
+    monkeypatch.setattr(redis, 'mset', mset_spy)
+    await extraredis.mset(b'chunks', mapping)
+    assert calls == [2, 2, 1]
+    await extraredis.mset(b'chunks', mapping, chunk_size=10)
+    assert calls == [2, 2, 1, 5]
+
+    keys = [b'4', b'0', b'7', b'2', b'1']
+    assert list((await extraredis.mget(b'chunks', keys)).items()) == [(k, mapping.get(k)) for k in keys]
+    assert await extraredis.mget(b'chunks', chunk_size=3) == mapping
+
+    hmapping = {k: {b'v': v} for k, v in mapping.items()}
+    await extraredis.mhset_fields(b'hchunks', hmapping)
+    await extraredis.mhset_field(b'hchunks', b'w', mapping)
+    assert await extraredis.mhget_field(b'hchunks', b'v', keys) == {k: mapping.get(k) for k in keys}
+    assert await extraredis.mhget_fields(b'hchunks', fields=[b'w'], chunk_size=1) == {k: {b'w': v} for k, v in mapping.items()}
+
+    await extraredis.delete(b'chunks', *keys)
+    assert await extraredis.mget(b'chunks') == {b'3': b'30'}
+
+
+@pytest_mark_asyncio
+async def test_pipeline_atomic(extraredis, khashtable, monkeypatch):
+    transactions = []
+    pipeline = extraredis.redis.pipeline
+
+    def pipeline_spy(transaction=True):
+        transactions.append(transaction)
+        return pipeline(transaction=transaction)
+
+    monkeypatch.setattr(extraredis.redis, 'pipeline', pipeline_spy)
+    await extraredis.mhget_fields(b'khashtable')
+    await extraredis.mhget_fields(b'khashtable', atomic=True)
+    await extraredis.mhset_field(b'khashtable', b'a', {b'1': b'1'})
+    await extraredis.mhset_fields(b'khashtable', {b'1': {b'a': b'1'}}, atomic=False)
+    assert transactions == [False, True, True, False]
+
+
+@pytest_mark_asyncio
+async def test_decode_responses_resolved_once(redis, monkeypatch):
+    extraredis = ExtraRedisAsync(redis)
+    assert (extraredis.decode_responses, extraredis.sep) == (False, b':')
+
+    def fail():
+        raise AssertionError('get_connection_kwargs called after construction')
+
+    monkeypatch.setattr(redis, 'get_connection_kwargs', fail)
+    await extraredis.mset(b'p', {b'1': b'1'})
+    assert await extraredis.mget(b'p') == {b'1': b'1'}
+    assert await extraredis.maddprefix(b'p', [b'1', b'2']) == [b'p:1', b'p:2']
+
+
+@pytest_mark_asyncio
+async def test_hash_tag(redis, redis_decode):
+    extraredis = ExtraRedisAsync(redis, hash_tag=True)
+    await extraredis.mset(b'kv', {b'0': b'0', b'1': b'1'})
+    await extraredis.set(b'kv', b'2', b'2')
+    assert await redis.keys() == [b'{kv}:0', b'{kv}:1', b'{kv}:2']
+    assert await extraredis.mget(b'kv') == {b'0': b'0', b'1': b'1', b'2': b'2'}
+
+    extraredis_decode = ExtraRedisAsync(redis_decode, hash_tag=True)
+    await extraredis_decode.mhset_fields('h', {'0': {'a': '0'}})
+    assert await extraredis_decode.maddprefix('h') == ['{h}:0']
+    assert await extraredis_decode.mhget_fields('h') == {'0': {'a': '0'}}
+
+
+class FakeClusterNode:
+    def __init__(self, name, pkeys):
+        self.name = name
+        self.pkeys = pkeys
+
+
+@pytest_mark_asyncio
+async def test_cluster_scan_fan_out(extraredis, monkeypatch):
+    nodes = [
+        FakeClusterNode('node0', [b'p:0', b'p:1', b'p:2']),
+        FakeClusterNode('node1', [b'p:3']),
+        FakeClusterNode('node2', []),
+    ]
+    calls = []
+
+    async def scan(cursor, match, count, _type, target_nodes):
+        calls.append((target_nodes.name, cursor))
+        pkeys = target_nodes.pkeys[cursor:cursor + count]
+        cursor = cursor + count if cursor + count < len(target_nodes.pkeys) else 0
+        return {target_nodes.name: cursor}, pkeys
+
+    async def mget_nonatomic(pkeys):
+        return [k.removeprefix(b'p:') for k in pkeys]
+
+    extraredis.cluster = True
+    monkeypatch.setattr(extraredis.redis, 'get_primaries', lambda: nodes, raising=False)
+    monkeypatch.setattr(extraredis.redis, 'scan', scan)
+    monkeypatch.setattr(extraredis.redis, 'mget_nonatomic', mget_nonatomic, raising=False)
+    assert [b async for b in extraredis.scan_prefix(b'p', count=2)] == [[b'p:0', b'p:1', b'p:3'], [b'p:2']]
+    assert sorted(calls) == [('node0', 0), ('node0', 2), ('node1', 0), ('node2', 0)]
+    assert await extraredis.mget(b'p') == {b'0': b'0', b'1': b'1', b'3': b'3', b'2': b'2'}
+
+
+class FakeInvalidator:
+    def __init__(self):
+        self.pending = []
+
+    async def process(self, cache):
+        cache.invalidate(self.pending)
+        self.pending.clear()
+
+
+@pytest_mark_asyncio
+async def test_client_cache(redis, kvtable, khashtable, monkeypatch):
+    invalidator = FakeInvalidator()
+    cache = ClientCache()
+    extraredis = ExtraRedisAsync(redis, cache=cache, invalidator=invalidator)
+    assert await extraredis.get(b'kvtable', b'1') == b'1'
+    assert await extraredis.get(b'kvtable', b'7') is None
+    assert await extraredis.hget_field(b'khashtable', b'1', b'a') == b'1'
+    assert await extraredis.hget_fields(b'khashtable', b'2') == {b'a': b'2', b'b': b'20', b'c': b'200'}
+    assert cache.misses == 4
+
+    await redis.set(b'kvtable:1', b'changed elsewhere')
+    await redis.hset(b'khashtable:1', b'a', b'changed elsewhere')
+    assert await extraredis.get(b'kvtable', b'1') == b'1'
+    assert await extraredis.get(b'kvtable', b'7') is None
+    assert await extraredis.hget_field(b'khashtable', b'1', b'a') == b'1'
+    assert await extraredis.hget_fields(b'khashtable', b'2') == {b'a': b'2', b'b': b'20', b'c': b'200'}
+    assert cache.hits == 4
+
+    invalidator.pending += [b'kvtable:1', b'khashtable:1']
+    assert await extraredis.get(b'kvtable', b'1') == b'changed elsewhere'
+    assert await extraredis.hget_field(b'khashtable', b'1', b'a') == b'changed elsewhere'
+
+    await extraredis.set(b'kvtable', b'1', b'1')
+    assert await extraredis.get(b'kvtable', b'1') == b'1'
+
+    # a write and its invalidation processed while the read is in flight: the value read is not cached
+    get = redis.get
+
+    async def get_racing(pkey):
+        value = await get(pkey)
+        await redis.set(pkey, b'written during the read')
+        invalidator.pending.append(pkey)
+        await extraredis.process_invalidations()
+        return value
+
+    monkeypatch.setattr(redis, 'get', get_racing)
+    invalidator.pending.append(b'kvtable:1')
+    assert await extraredis.get(b'kvtable', b'1') == b'1'
+    monkeypatch.undo()
+    assert await extraredis.get(b'kvtable', b'1') == b'written during the read'
+
+
+class FakeTrackingConnection:
+    def __init__(self, replies=()):
+        self.replies = list(replies)
+        self.is_connected = True
+
+    async def can_read(self):
+        return bool(self.replies)
+
+    async def read_response(self):
+        return self.replies.pop(0)
+
+
+@pytest_mark_asyncio
+async def test_client_tracking_reconnect(redis, monkeypatch):
+    tracking = ClientTrackingAsync(redis)
+    started = []
+
+    async def start():
+        started.append(True)
+        tracking.listener = FakeTrackingConnection([[b'message', b'__redis__:invalidate', [b'k']]])
+        tracking.tracker = FakeTrackingConnection()
+
+    async def close():
+        tracking.listener = tracking.tracker = None
+
+    monkeypatch.setattr(tracking, 'start', start)
+    monkeypatch.setattr(tracking, 'close', close)
+    await tracking.start()
+    cache = ClientCache()
+    cache.set(b'k', None, b'1')
+    cache.set(b'j', None, b'2')
+    await tracking.process(cache)
+    assert cache.get(b'k') is MISSING
+    assert cache.get(b'j') == b'2'
+
+    tracking.listener.is_connected = False  # can_read() would reconnect without the subscription
+    await tracking.process(cache)
+    assert len(cache) == 0
+    assert len(started) == 2
+    cache.set(b'j', None, b'2')
+    tracking.tracker.replies.append(b'')  # the server closed the tracking connection
+    await tracking.process(cache)
+    assert len(cache) == 0
+    assert len(started) == 3
+
+
+@pytest_mark_asyncio
+async def test_client_cache_mget(redis, kvtable, khashtable, monkeypatch):
+    extraredis = ExtraRedisAsync(redis, cache=ClientCache(), invalidator=FakeInvalidator())
+    assert await extraredis.get(b'kvtable', b'0') == b'0'
+    assert await extraredis.hget_field(b'khashtable', b'0', b'b') == b'0'
+    requested = []
+    mget = redis.mget
+
+    async def mget_spy(pkeys):
+        requested.extend(pkeys)
+        return await mget(pkeys)
+
+    monkeypatch.setattr(redis, 'mget', mget_spy)
+    assert await extraredis.mget(b'kvtable', [b'0', b'1', b'7']) == {b'0': b'0', b'1': b'1', b'7': None}
+    assert requested == [b'kvtable:1', b'kvtable:7']
+    assert await extraredis.mget(b'kvtable', [b'0', b'1', b'7']) == {b'0': b'0', b'1': b'1', b'7': None}
+    assert requested == [b'kvtable:1', b'kvtable:7']
+
+    assert await extraredis.mhget_field(b'khashtable', b'b', [b'0', b'1']) == {b'0': b'0', b'1': b'10'}
+    await redis.hset(b'khashtable:1', b'b', b'changed elsewhere')
+    assert await extraredis.mhget_field(b'khashtable', b'b', [b'0', b'1']) == {b'0': b'0', b'1': b'10'}
+    await extraredis.mhset_field(b'khashtable', b'b', {b'1': b'11'})
+    assert await extraredis.mhget_field(b'khashtable', b'b', [b'0', b'1']) == {b'0': b'0', b'1': b'11'}
+
+    # results are copies of the cached hashes
+    (await extraredis.hget_fields(b'khashtable', b'2'))[b'a'] = b'mutated'
+    (await extraredis.mhget_fields(b'khashtable', [b'2']))[b'2'][b'b'] = b'mutated'
+    assert await extraredis.hget_fields(b'khashtable', b'2') == {b'a': b'2', b'b': b'20', b'c': b'200'}
+    assert await extraredis.mhget_fields(b'khashtable', [b'2']) == {b'2': {b'a': b'2', b'b': b'20', b'c': b'200'}}
+
+
+@pytest_mark_asyncio
+async def test_codecs(redis, khashtable):
+    extraredis = ExtraRedisAsync(redis, codec='json', codecs={b'raw': 'raw', b'khashtable': 'raw'})
+    await extraredis.set(b'j', b'0', {'a': 1})
+    await extraredis.mset(b'j', {b'1': [1, 2], b'2': None})
+    assert await redis.get(b'j:1') == b'[1,2]'
+    assert await extraredis.get(b'j', b'0') == {'a': 1}
+    assert await extraredis.mget(b'j', [b'0', b'1', b'2', b'7']) == {b'0': {'a': 1}, b'1': [1, 2], b'2': None, b'7': None}
+    assert dict([kv async for kv in extraredis.iter_mget(b'j')]) == {b'0': {'a': 1}, b'1': [1, 2], b'2': None}
+
+    await extraredis.hset_field(b'h', b'0', b'a', 1.5)
+    await extraredis.hset_fields(b'h', b'0', {b'b': 'x'})
+    await extraredis.mhset_field(b'h', b'a', {b'1': [1]})
+    await extraredis.mhset_fields(b'h', {b'2': {b'a': True}})
+    assert await extraredis.hget_field(b'h', b'0', b'a') == 1.5
+    assert await extraredis.hget_fields(b'h', b'0') == {b'a': 1.5, b'b': 'x'}
+    assert await extraredis.mhget_field(b'h', b'a', [b'0', b'1', b'2']) == {b'0': 1.5, b'1': [1], b'2': True}
+    assert await extraredis.mhget_fields(b'h', fields=[b'a', b'b']) == {
+        b'0': {b'a': 1.5, b'b': 'x'},
+        b'1': {b'a': [1], b'b': None},
+        b'2': {b'a': True, b'b': None},
+    }
+    assert dict([kv async for kv in extraredis.iter_mhget_fields(b'h')]) == {b'0': {b'a': 1.5, b'b': 'x'}, b'1': {b'a': [1]}, b'2': {b'a': True}}
+
+    await extraredis.set(b'raw', b'0', b'{not json')
+    assert await extraredis.get(b'raw', b'0') == b'{not json'
+    assert await extraredis.hget_fields(b'khashtable', b'1') == {b'a': b'1', b'b': b'10', b'c': b'100'}
+
+
+@pytest_mark_asyncio
+async def test_compression(redis):
+    extraredis = ExtraRedisAsync(redis, codec=CompressedCodec('json', threshold=64))
+    small = {'a': 1}
+    big = {'html': '<p>' * 1000}
+    await extraredis.mset(b'c', {b'small': small, b'big': big})
+    assert await redis.get(b'c:small') == b'{"a":1}'
+    assert len(await redis.get(b'c:big')) < 100
+    assert await extraredis.mget(b'c') == {b'big': big, b'small': small}
+    await extraredis.mhset_fields(b'hc', {b'0': {b'small': small, b'big': big}})
+    assert await extraredis.mhget_fields(b'hc', fields=[b'small', b'big', b'z']) == {b'0': {b'small': small, b'big': big, b'z': None}}
+
+
+@pytest_mark_asyncio
+async def test_concurrent_chunks(redis, monkeypatch):
+    extraredis = ExtraRedisAsync(redis, chunk_size=2, concurrency=3)
+    mapping = {str(i).encode(): {b'a': str(i).encode(), b'b': str(i * 10).encode()} for i in range(11)}
+    await extraredis.mhset_fields(b'h', mapping)
+    await extraredis.mhset_field(b'h', b'c', {k: v[b'a'] for k, v in mapping.items()}, concurrency=2)
+
+    in_flight = []
+    calls = []
+    mhget_pkeys = extraredis._mhget_pkeys
+
+    async def spy(*args):
+        in_flight.append(1)
+        calls.append(len(in_flight))
+        try:
+            return await mhget_pkeys(*args)
+        finally:
+            in_flight.pop()
+
+    monkeypatch.setattr(extraredis, '_mhget_pkeys', spy)
+    keys = list(reversed(mapping))
+    assert list((await extraredis.mhget_fields(b'h', keys, [b'a', b'b'])).items()) == [(k, mapping[k]) for k in keys]
+    assert len(calls) == 6
+    assert max(calls) <= 3
+    assert await extraredis.mhget_field(b'h', b'c', keys, concurrency=1) == {k: mapping[k][b'a'] for k in keys}
+
+
+@pytest_mark_asyncio
+async def test_hscan(redis, extraredis_decode, khashtable, monkeypatch):
+    big = {f'f{i}'.encode(): str(i).encode() for i in range(20)} | {b'g0': b'x'}
+    await redis.hset(b'big:0', mapping=big)
+    extraredis = ExtraRedisAsync(redis, hscan_threshold=10)
+    assert dict([kv async for kv in extraredis.iter_hget_fields(b'big', b'0', count=3)]) == big
+    assert dict([kv async for kv in extraredis.iter_hget_fields(b'big', b'0', match=b'f1*')]) == {
+        k: v for k, v in big.items() if k.startswith(b'f1')
+    }
+    assert await extraredis.hget_fields(b'big', b'0', match=b'g*') == {b'g0': b'x'}
+    assert await extraredis_decode.hget_fields('khashtable', '1', match='[ab]') == {'a': '1', 'b': '10'}
+    with pytest.raises(ValueError):
+        await extraredis.hget_fields(b'big', b'0', fields=[b'f0'], match=b'g*')
+
+    hscans = []
+    hscan = redis.hscan
+
+    async def hscan_spy(name, *args, **kwargs):
+        hscans.append(name)
+        return await hscan(name, *args, **kwargs)
+
+    monkeypatch.setattr(redis, 'hscan', hscan_spy)
+    assert await extraredis.hget_fields(b'big', b'0') == big
+    assert await extraredis.hget_fields(b'khashtable', b'1') == {b'a': b'1', b'b': b'10', b'c': b'100'}
+    assert await extraredis.mhget_fields(b'big') == {b'0': big}
+    assert hscans == []  # HSCAN steps of all scanned hashes are pipelined
+    await redis.hset(b'big:1', mapping=big)
+    extraredis_steps = ExtraRedisAsync(redis, scan_count=3)
+    assert await extraredis_steps.mhget_fields(b'big', [b'0', b'1', b'2'], match=b'f1*') == {
+        b'0': {k: v for k, v in big.items() if k.startswith(b'f1')},
+        b'1': {k: v for k, v in big.items() if k.startswith(b'f1')},
+        b'2': {},
+    }
+    assert hscans == []
+    assert await extraredis.mhget_fields(b'khashtable', match=b'a') == {b'0': {b'a': b'0'}, b'1': {b'a': b'1'}, b'2': {b'a': b'2'}}
+    assert dict([kv async for kv in extraredis.iter_mhget_fields(b'khashtable', match=b'c')]) == {
+        b'0': {b'c': b'0'}, b'1': {b'c': b'100'}, b'2': {b'c': b'200'},
+    }
+
+
+@pytest_mark_asyncio
+async def test_scripts(redis, extraredis_decode, kvtable, khashtable):
+    pytest.importorskip('lupa')
+    extraredis = ExtraRedisAsync(redis, scan_count=2, codec='utf8')
+    assert await extraredis.count_prefix(b'kvtable', steps=1) == 3
+    assert await extraredis.count_prefix(b'khashtable', _type='hash') == 3
+    assert await extraredis.count_prefix(b'khashtable', _type='string') == 0
+    assert await extraredis.mhget_field_server(b'khashtable', b'b') == {b'0': '0', b'1': '10', b'2': '20'}
+    assert await extraredis.mhget_field_server(b'khashtable', b'b', [b'2', b'3'], chunk_size=1) == {b'2': '20', b'3': None}
+    assert await extraredis_decode.mhget_field_server('khashtable', 'c', steps=1) == {'0': '0', '1': '100', '2': '200'}
+
+    assert await extraredis.mset_nx(b'kvtable', {b'2': 'x', b'3': 'y'}) == {b'2': False, b'3': True}
+    assert await extraredis.mget(b'kvtable', [b'2', b'3']) == {b'2': '2', b'3': 'y'}
+
+    await redis.script_flush()  # EVALSHA fails with NOSCRIPT and the script is loaded again
+    assert await extraredis.delete_prefix(b'kvtable', steps=1) == 4
+    assert await redis.keys(b'kvtable:*') == []
+    assert await extraredis.count_prefix(b'kvtable') == 0
+
+
+@pytest_mark_asyncio
+async def test_ttl(redis, monkeypatch):
+    extraredis = ExtraRedisAsync(redis, ttls={b'p': 100})
+    await extraredis.set(b'p', b'a', b'1')
+    await extraredis.set(b'p', b'b', b'1', px=5000)
+    await extraredis.set(b'q', b'a', b'1')
+    assert 99_000 < await redis.pttl(b'p:a') <= 100_000
+    assert 4000 < await redis.pttl(b'p:b') <= 5000
+    assert await redis.pttl(b'q:a') == -1
+    with pytest.raises(ValueError):
+        await extraredis.set(b'p', b'a', b'1', ex=1, px=1000)
+
+    await extraredis.mset(b'q', {b'a': b'1', b'b': b'2'}, exat=time.time() + 50)
+    assert await extraredis.mget(b'q', [b'a', b'b']) == {b'a': b'1', b'b': b'2'}
+    assert [40_000 < await redis.pttl(k) <= 50_000 for k in (b'q:a', b'q:b')] == [True, True]
+
+    await extraredis.hset_fields(b'h', b'0', {b'a': b'1'}, ex=10)
+    await extraredis.hset_field(b'h', b'1', b'a', b'1', ex=10, per_field=True)
+    await extraredis.mhset_fields(b'h', {b'2': {b'a': b'1', b'b': b'2'}}, ex=10, per_field=True)
+    await extraredis.mhset_field(b'h', b'c', {b'2': b'3', b'3': b'3'}, ex=10)
+    assert 9000 < await redis.pttl(b'h:0') <= 10_000
+    assert await redis.pttl(b'h:1') == -1
+    assert [9000 < t <= 10_000 for t in await redis.hpttl(b'h:1', b'a')] == [True]
+    assert [9000 < t <= 10_000 for t in await redis.hpttl(b'h:2', b'a', b'b')] == [True, True]
+    assert await redis.hpttl(b'h:2', b'c') == [-1]
+    assert 9000 < await redis.pttl(b'h:3') <= 10_000
+
+    monkeypatch.setattr(random, 'randint', lambda a, b: b)
+    extraredis = ExtraRedisAsync(redis, ttls={b'p': 100}, ttl_jitter=0.5)
+    await extraredis.mset(b'p', {b'c': b'1'})
+    assert 149_000 < await redis.pttl(b'p:c') <= 150_000
+
+
+@pytest_mark_asyncio
+async def test_instrumentation(redis, kvtable, khashtable):
+    class Recorder(Hook):
+        def __init__(self):
+            self.calls = []
+
+        def before(self, call):
+            self.calls.append(('before', call.method, call.prefix, call.keys))
+
+        def after(self, call):
+            self.calls.append(('after', call.method, call.prefix, call.keys, call.reply_bytes, call.error is not None))
+
+    recorder = Recorder()
+    collector = HistogramCollector()
+    extraredis = ExtraRedisAsync(redis, hooks=[recorder, collector])
+    await extraredis.mget(b'kvtable', [b'0', b'1'])
+    await extraredis.mget(b'kvtable')
+    await extraredis.mhget_field(b'khashtable', b'a')  # calls mhget_fields, reported once
+    assert [kv async for kv in extraredis.iter_mget(b'kvtable')]
+    with pytest.raises(Exception):
+        await extraredis.hget_field(b'kvtable', b'0', b'a')
+    assert recorder.calls == [
+        ('before', 'mget', b'kvtable', 2),
+        ('after', 'mget', b'kvtable', 2, 4, False),
+        ('before', 'mget', b'kvtable', None),
+        ('after', 'mget', b'kvtable', 3, 6, False),
+        ('before', 'mhget_field', b'khashtable', None),
+        ('after', 'mhget_field', b'khashtable', 3, 6, False),
+        ('before', 'iter_mget', b'kvtable', None),
+        ('after', 'iter_mget', b'kvtable', 3, 6, False),
+        ('before', 'hget_field', b'kvtable', 1),
+        ('after', 'hget_field', b'kvtable', 1, 0, True),
+    ]
+    stats = collector.stats()
+    assert stats['mget', b'kvtable']['count'] == 2
+    assert stats['mget', b'kvtable']['keys'] == 5
+    assert stats['hget_field', b'kvtable']['errors'] == 1
+
+
+@pytest_mark_asyncio
+async def test_output(redis, extraredis, extraredis_decode, kvtable, khashtable):
+    assert await extraredis.mget(b'kvtable', iter([b'1', b'5']), output='lists') == ([b'1', b'5'], [b'1', None])
+    keys, values = await extraredis.mget(b'kvtable', output='buffer')
+    assert keys == [b'0', b'1', b'2']
+    assert [bytes(v) for v in values] == [b'0', b'1', b'2']
+    with pytest.raises(ValueError):
+        await extraredis_decode.mget('kvtable', output='buffer')
+    with pytest.raises(ValueError):
+        await ExtraRedisAsync(redis, codec='json').mget(b'kvtable', output='buffer')
+    with pytest.raises(ValueError):
+        await extraredis.mget(b'kvtable', output='columns')
+
+    assert await extraredis.mhget_fields(b'khashtable', [b'1', b'5'], [b'a', b'c'], output='lists') == (
+        [b'1', b'5'], [[b'1', b'100'], [None, None]],
+    )
+    assert await extraredis_decode.mhget_fields('khashtable', fields=['b'], output='lists') == (['0', '1', '2'], [['0'], ['10'], ['20']])
+    assert await extraredis.mhget_fields(b'khashtable', [b'0'], output='lists') == ([b'0'], [{b'a': b'0', b'b': b'0', b'c': b'0'}])
+    assert await extraredis.mhget_field(b'khashtable', b'b', output='lists') == ([b'0', b'1', b'2'], [b'0', b'10', b'20'])
+
+
+@pytest_mark_asyncio
+async def test_output_columns(extraredis, extraredis_decode, khashtable, monkeypatch):
+    monkeypatch.setattr(columns, 'numpy', None)
+    index, cols = await extraredis.mhget_fields(b'khashtable', [b'0', b'2', b'5'], [b'a', b'b'], output='columns', dtypes={b'b': float})
+    assert index == [b'0', b'2', b'5']
+    assert cols[b'a'] == [b'0', b'2', None]
+    assert cols[b'b'].typecode == 'd'
+    assert cols[b'b'].tolist()[:2] == [0.0, 20.0]
+    assert math.isnan(cols[b'b'][2])
+    with pytest.raises(ValueError):
+        await extraredis.mhget_fields(b'khashtable', [b'5'], [b'a'], output='columns', dtypes={b'a': int})
+    with pytest.raises(ValueError):
+        await extraredis.mhget_fields(b'khashtable', output='columns')
+    assert await extraredis.mhget_fields(b'khashtable', [], [b'a'], output='columns', dtypes={b'a': int}) == ([], {b'a': array.array('q')})
+
+    numpy = pytest.importorskip('numpy')
+    monkeypatch.setattr(columns, 'numpy', numpy)
+    index, cols = await extraredis_decode.mhget_fields('khashtable', fields=['a', 'c'], output='columns', dtypes={'a': int, 'c': 'float32'})
+    assert index.tolist() == ['0', '1', '2']
+    assert cols['a'].dtype == numpy.int64
+    assert cols['a'].tolist() == [0, 1, 2]
+    assert cols['c'].dtype == numpy.float32
+    assert cols['c'].tolist() == [0, 100, 200]
+    index, _ = await extraredis.mhget_fields(b'khashtable', [b'0', b'0\x00'], [b'a'], output='columns')
+    assert index.dtype == object
+    assert index.tolist() == [b'0', b'0\x00']
+
+
+@record(b'user')
+class User:
+    id: int
+    name: str
+    score: float | None = None
+    active: bool = True
+
+
+@pytest_mark_asyncio
+async def test_records(redis):
+    extraredis = ExtraRedisAsync(redis)
+    users = [User(1, 'a', 0.5), User(2, 'b', active=False)]
+    await extraredis.mset_records(users, ex=100)
+    assert await redis.hgetall(b'user:2') == {b'name': b'b', b'active': b'0'}
+    assert await redis.ttl(b'user:1') == 100
+    assert not hasattr(users[0], '__dict__')
+    await redis.hset(b'user:1', b'extra', b'not read')
+    assert await extraredis.mget_records(User, [1, 2, 3]) == users + [None]
+    assert sorted(await extraredis.mget_records(User), key=lambda u: u.id) == users
+    with pytest.raises(TypeError):
+        await extraredis.mset_records([users[0], object()])
+    with pytest.raises(TypeError):
+        await extraredis.mset_records([object()])
+
+
+@pytest_mark_asyncio
+async def test_indexes(redis, redis_decode):
+    pytest.importorskip('lupa')
+    extraredis = ExtraRedisAsync(redis, indexes={b'u': {b'age': 'numeric', b'city': 'equal'}})
+    await extraredis.mhset_fields(b'u', {
+        b'0': {b'age': 30, b'city': b'paris', b'name': b'a'},
+        b'1': {b'age': 20, b'city': b'rome', b'name': b'b'},
+        b'2': {b'age': 40, b'city': b'paris', b'name': b'c'},
+    })
+    await extraredis.hset_field(b'u', b'1', b'city', b'paris')
+    await extraredis.hset_fields(b'u', b'0', {b'city': b'oslo', b'age': b'unknown'}, ex=100)
+    await extraredis.mhset_field(b'u', b'age', {b'3': 25})
+    assert await redis.hgetall(b'u:0') == {b'age': b'unknown', b'city': b'oslo', b'name': b'a'}
+    assert await redis.ttl(b'u:0') == 100
+
+    assert sorted(await extraredis.find_equal(b'u', b'city', b'paris')) == [b'1', b'2']
+    assert await extraredis.find_equal(b'u', b'city', b'oslo', fields=[b'name']) == {b'0': {b'name': b'a'}}
+    assert len(await extraredis.find_equal(b'u', b'city', b'paris', limit=1)) == 1
+    assert await extraredis.find_equal(b'u', b'city', b'rome') == []
+    assert await extraredis.find_range(b'u', b'age') == [b'1', b'3', b'2']
+    assert await extraredis.find_range(b'u', b'age', 21, '(40') == [b'3']
+    assert await extraredis.find_range(b'u', b'age', desc=True, limit=2, fields=[b'age']) == {b'2': {b'age': b'40'}, b'3': {b'age': b'25'}}
+    assert await extraredis.find_range(b'u', b'age', offset=1) == [b'3', b'2']
+
+    await extraredis.delete(b'u', b'2')  # index entries are deleted with the hash
+    assert await redis.smembers(b'__idx__:u:e:4:city:paris') == {b'u:1'}
+    assert await extraredis.find_equal(b'u', b'city', b'paris') == [b'1']
+    assert await extraredis.find_range(b'u', b'age') == [b'1', b'3']
+
+    # entries of hashes changed or deleted without the index are skipped and cleaned up, limit counts real matches
+    await extraredis.mhset_field(b'u', b'age', {str(i).encode(): i for i in range(10, 15)})
+    await redis.delete(b'u:10', b'u:11')
+    await redis.hset(b'u:12', b'age', 100)
+    assert await extraredis.find_range(b'u', b'age', 10, 20, limit=2) == [b'13', b'14']
+    assert await extraredis.find_range(b'u', b'age', 10, 200) == [b'13', b'14', b'1', b'3', b'12']
+    assert await redis.zrange(b'__idx__:u:n:age', 0, -1) == [b'u:13', b'u:14', b'u:1', b'u:3', b'u:12']
+    await redis.hset(b'u:1', b'city', b'rome')
+    await extraredis.hset_field(b'u', b'3', b'city', b'paris')
+    assert await extraredis.find_equal(b'u', b'city', b'paris', limit=1) == [b'3']
+    assert await redis.smembers(b'__idx__:u:e:4:city:paris') == {b'u:3'}
+
+    assert await extraredis.delete_prefix(b'u') == 6
+    assert await redis.keys(b'__idx__:*') == []
+
+    # (field, value) pairs joined with ':' the same way don't share an index key
+    colliding = ExtraRedisAsync(redis, indexes={b'c': {b'a': 'equal', b'a:b': 'equal'}})
+    await colliding.hset_fields(b'c', b'0', {b'a': b'b:c'})
+    await colliding.hset_fields(b'c', b'1', {b'a:b': b'c'})
+    assert await colliding.find_equal(b'c', b'a', b'b:c') == [b'0']
+    assert await colliding.find_equal(b'c', b'a:b', b'c') == [b'1']
+    assert await colliding.find_equal(b'c', b'a', b'b:c') == [b'0']
+
+    extraredis_decode = ExtraRedisAsync(redis_decode, indexes={'u': {'tag': 'equal', 'größe': 'equal'}}, codec='json')
+    await extraredis_decode.hset_fields('u', '0', {'tag': 'x', 'n': 1, 'größe': 'xl'})
+    assert await extraredis_decode.find_equal('u', 'tag', 'x', fields=['n']) == {'0': {'n': 1}}
+    assert await extraredis_decode.find_equal('u', 'größe', 'xl') == ['0']  # the length prefix counts bytes, as in lua
+
+
+@pytest_mark_asyncio
+async def test_export_import_prefix(extraredis, redis, tmp_path, monkeypatch):
+    path = str(tmp_path / 'kv.dump')
+    await extraredis.mset(b'kv', {str(i).encode(): i for i in range(50)})
+    await extraredis.hset_fields(b'kv', b'h', {b'a': 1}, ex=100)
+    await extraredis.set(b'other', b'0', 0)
+    assert await extraredis.export_prefix(b'kv', path, count=10) == 51
+    assert not (tmp_path / 'kv.dump.checkpoint').exists()
+
+    await extraredis.delete_prefix(b'kv')
+    assert await extraredis.import_prefix(path) == 51
+    assert await extraredis.mget(b'kv', [b'0', b'49']) == {b'0': b'0', b'49': b'49'}
+    assert await redis.hgetall(b'kv:h') == {b'a': b'1'}
+    assert 0 < await redis.ttl(b'kv:h') <= 100
+    assert await redis.ttl(b'kv:0') == -1
+    assert await extraredis.import_prefix(path, b'copy') == 51
+    assert await extraredis.get(b'copy', b'7') == b'7'
+    with pytest.raises(ResponseError):
+        await extraredis.import_prefix(path, b'copy', replace=False)
+
+    # interrupted export continues from the SCAN cursor of the last written block
+    zpath = str(tmp_path / 'kvz.dump')
+    write_block = dumpfile.DumpWriter._write_block
+    blocks = []
+
+    def failing_write_block(self, records, cursor):
+        if len(blocks) == 2:
+            raise RuntimeError
+        blocks.append(len(records))
+        write_block(self, records, cursor)
+
+    monkeypatch.setattr(dumpfile.DumpWriter, '_write_block', failing_write_block)
+    with pytest.raises(RuntimeError):
+        await extraredis.export_prefix(b'kv', zpath, count=10, compression='zlib')
+    monkeypatch.undo()
+    assert (tmp_path / 'kvz.dump.checkpoint').exists()
+    assert sum(blocks) + await extraredis.export_prefix(b'kv', zpath, count=10, compression='zlib', resume=True) == 51
+    await extraredis.delete_prefix(b'copy')
+    assert await extraredis.import_prefix(zpath, b'copy') == 51
+    assert await extraredis.mget(b'copy', [str(i).encode() for i in range(50)]) == {str(i).encode(): str(i).encode() for i in range(50)}
+
+    # interrupted import continues after the last restored block
+    (tmp_path / 'kv.dump.import-checkpoint').write_text(f'{{"offset": {(tmp_path / "kv.dump").stat().st_size}}}')
+    assert await extraredis.import_prefix(path, b'copy', resume=True) == 0
+    (tmp_path / 'bad.dump').write_bytes(b'not a dump file')
+    with pytest.raises(ValueError):
+        await extraredis.import_prefix(str(tmp_path / 'bad.dump'))
+
+
+@pytest_mark_asyncio
+async def test_copy_rename_migrate_prefix(extraredis, redis):
+    await extraredis.mset(b'v1', {str(i).encode(): i for i in range(30)}, ex=100)
+    await extraredis.hset_fields(b'v1', b'h', {b'a': 1})
+    assert await extraredis.copy_prefix(b'v1', b'v2', count=7, concurrency=2) == 31
+    assert await redis.hgetall(b'v2:h') == {b'a': b'1'}
+    assert 0 < await redis.ttl(b'v2:0') <= 100
+    await extraredis.set(b'v2', b'0', b'changed')
+    assert await extraredis.copy_prefix(b'v1', b'v2') == 0
+    assert await extraredis.get(b'v2', b'0') == b'changed'
+    assert await extraredis.copy_prefix(b'v1', b'v2', replace=True) == 31
+    assert await extraredis.get(b'v2', b'0') == b'0'
+    with pytest.raises(ValueError):
+        await extraredis.copy_prefix(b'v1', b'v1:old')
+
+    progress = []
+    assert await extraredis.rename_prefix(b'v2', b'v3', count=10, progress=progress.append) == 31
+    assert progress[-1] == 31
+    assert await extraredis.count_prefix(b'v2') == 0
+    assert await extraredis.get(b'v3', b'29') == b'29'
+    await extraredis.set(b'v1', b'0', b'changed')
+    assert await extraredis.rename_prefix(b'v1', b'v3') == 0
+    assert await extraredis.rename_prefix(b'v1', b'v3', replace=True) == 31
+    assert await extraredis.get(b'v3', b'0') == b'changed'
+
+    target = ExtraRedisAsync(fake_redis_module.FakeRedis())
+    await target.set(b'v3', b'0', b'exists')
+    assert await extraredis.migrate_prefix(b'v3', target, copy=True) == 30
+    assert await target.get(b'v3', b'0') == b'exists'
+    assert await extraredis.migrate_prefix(b'v3', target, b'v4', concurrency=3, count=5) == 31
+    assert await extraredis.count_prefix(b'v3') == 0
+    assert await target.mget(b'v4', [b'0', b'h']) == {b'0': b'changed', b'h': None}
+    assert await target.redis.hgetall(b'v4:h') == {b'a': b'1'}
+    assert 0 < await target.redis.ttl(b'v4:1') <= 100
+
+
+@pytest_mark_asyncio
+async def test_zset_set_list(extraredis, redis):
+    assert await extraredis.zadd(b'board', b'0', {b'a': 1, b'b': 2}) == 2
+    assert await extraredis.mzadd(b'board', {b'0': {b'c': 3}, b'1': {b'a': 5}, b'2': {}}, ex=100) == {b'0': 1, b'1': 1, b'2': 0}
+    assert 0 < await redis.ttl(b'board:1') <= 100
+    assert await extraredis.zrange(b'board', b'0') == [(b'a', 1.0), (b'b', 2.0), (b'c', 3.0)]
+    assert await extraredis.zrange(b'board', b'0', 0, 0, desc=True, withscores=False) == [b'c']
+    assert await extraredis.mzrange(b'board', [b'0', b'1', b'3'], 0, 1, desc=True, chunk_size=2) == {
+        b'0': [(b'c', 3.0), (b'b', 2.0)],
+        b'1': [(b'a', 5.0)],
+        b'3': [],
+    }
+    assert await extraredis.zmscore(b'board', b'0', [b'a', b'x']) == [1.0, None]
+    assert await extraredis.zmscore(b'board', b'0', []) == []
+    assert await extraredis.mzmscore(b'board', {b'0': [b'b'], b'1': [b'a', b'b'], b'2': []}) == {b'0': [2.0], b'1': [5.0, None], b'2': []}
+
+    assert await extraredis.sadd(b'tags', b'0', [b'x', b'y']) == 2
+    assert await extraredis.msadd(b'tags', {b'0': {b'y', b'z'}, b'1': [b'x']}, concurrency=2, chunk_size=1) == {b'0': 1, b'1': 1}
+    assert await extraredis.smismember(b'tags', b'0', [b'x', b'w']) == [True, False]
+    assert await extraredis.msmismember(b'tags', {b'0': [b'z'], b'1': [b'y', b'x'], b'2': [b'x']}) == {b'0': [True], b'1': [False, True], b'2': [False]}
+
+    assert await extraredis.rpush(b'queue', b'0', [b'a', b'b']) == 2
+    assert await extraredis.mrpush(b'queue', {b'0': [b'c'], b'1': (str(i).encode() for i in range(5)), b'2': []}, px=100_000) == {b'0': 3, b'1': 5, b'2': None}
+    assert 0 < await redis.pttl(b'queue:0') <= 100_000
+    assert await extraredis.lrange(b'queue', b'0', 1) == [b'b', b'c']
+    assert await extraredis.mlrange(b'queue', [b'0', b'1', b'2'], 0, 1) == {b'0': [b'a', b'b'], b'1': [b'0', b'1'], b'2': []}
+
+
+@pytest_mark_asyncio
+async def test_migrate_prefix_server_side(extraredis, redis, monkeypatch):
+    target = ExtraRedisAsync(fake_redis_module.FakeRedis(username='u', password='p'))
+    await extraredis.mset(b'm', {str(i).encode(): i for i in range(10)})
+    await target.set(b'm', b'0', b'exists')
+    execute_command = redis.execute_command
+    calls = []
+    created = {}  # keys another client creates in target while MIGRATE runs
+
+    async def fake_execute_command(*args, **kwargs):
+        # MIGRATE between two fakeredis servers: RESTORE of DUMP, as the source server would do
+        if args[0] != 'MIGRATE':
+            return await execute_command(*args, **kwargs)
+        calls.append(args)
+        pkeys = args[args.index('KEYS') + 1:]
+        for pkey, value in created.items():
+            await target.redis.set(pkey, value)
+        moved = 0
+        busy = False
+        for pkey in pkeys:
+            value = await redis.dump(pkey)
+            if value is None:
+                continue
+            if 'REPLACE' not in args and await target.redis.exists(pkey):
+                busy = True
+                continue
+            await target.redis.restore(pkey, 0, value, replace='REPLACE' in args)
+            if 'COPY' not in args:
+                await redis.delete(pkey)
+            moved += 1
+        if busy:
+            raise ResponseError('BUSYKEY Target key name already exists.')
+        return b'OK' if moved else b'NOKEY'
+
+    monkeypatch.setattr(redis, 'execute_command', fake_execute_command)
+    with pytest.raises(ResponseError, match='unknown command'):
+        await execute_command('MIGRATE', 'localhost', 6379, '', 0, 5000, 'KEYS', b'm:1')
+    # without address: DUMP / RESTORE, MIGRATE is not sent
+    assert await extraredis.migrate_prefix(b'm', target, copy=True, count=4) == 9
+    assert calls == []
+    await target.delete(b'm', *(str(i).encode() for i in range(1, 10)))
+
+    assert await extraredis.migrate_prefix(b'm', target, copy=True, count=4, address=('10.0.0.2', 6380)) == 9
+    assert calls[0][:7] == ('MIGRATE', '10.0.0.2', 6380, '', 0, 5000, 'COPY')
+    assert calls[0][7:10] == ('AUTH2', 'u', 'p')
+    assert await target.get(b'm', b'0') == b'exists'  # existing keys are skipped, as with RESTORE
+    assert await target.get(b'm', b'9') == b'9'
+    await target.delete(b'm', *(str(i).encode() for i in range(1, 10)))
+    created[b'm:5'] = b'created'
+    assert await extraredis.migrate_prefix(b'm', target, copy=True, address=('10.0.0.2', 6380)) == 8  # BUSYKEY for m:5
+    assert await target.get(b'm', b'5') == b'created'
+    await target.delete(b'm', *(str(i).encode() for i in range(1, 10)))
+    assert await extraredis.migrate_prefix(b'm', target, address=('10.0.0.2', 6380)) == 8
+    assert await extraredis.mget(b'm') == {b'0': b'0', b'5': b'5'}
+    created.clear()
+    assert await extraredis.migrate_prefix(b'm', target, replace=True, address=('10.0.0.2', 6380)) == 2
+    assert await extraredis.count_prefix(b'm') == 0
+    assert await target.get(b'm', b'0') == b'0'
+    with pytest.raises(ValueError):
+        await extraredis.migrate_prefix(b'm', target, b'n', address=('10.0.0.2', 6380))
+    with pytest.raises(ValueError):
+        await extraredis.migrate_prefix(b'm', extraredis)
+
+    # batches run on the shared executor, the EXISTS checks must not wait for it again
+    small = ExtraRedisAsync(redis, chunk_size=1, concurrency=2)
+    await small.mset(b'm', {str(i).encode(): i for i in range(200)})
+    assert await small.migrate_prefix(b'm', target, replace=True, count=5, concurrency=64, address=('10.0.0.2', 6380)) == 200
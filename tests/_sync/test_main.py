@@ -1,6 +1,21 @@
+import array
+import math
+import random
+import time
+
 import pytest
+from redis.exceptions import ResponseError
 
+from extraredis import ClientCache
 from extraredis import ExtraRedis
+from extraredis import columns
+from extraredis import dumpfile
+from extraredis._sync.tracking import ClientTracking
+from extraredis.client_cache import MISSING
+from extraredis.compression import CompressedCodec
+from extraredis.instrumentation import HistogramCollector
+from extraredis.instrumentation import Hook
+from extraredis.records import record
 
 import fakeredis.aioredis as fake_redis_sync  # isort:skip
 import fakeredis as fake_redis_sync  # isort:skip
@@ -288,3 +303,811 @@ def test_mhset_fields(extraredis, extraredis_decode, khashtable):
         '2': {'a': '222', 'b': '2222', 'c': '22222'},
         '3': {'a': '333', 'b': '3333', 'c': '33333'},
     }
+
+
+@pytest_mark_sync
+def test_scan_prefix(extraredis, extraredis_decode, kvtable, khashtable):
+    batches = [b for b in extraredis.scan_prefix(b'kvtable', count=1)]
+    assert sorted(k for b in batches for k in b) == [b'kvtable:0', b'kvtable:1', b'kvtable:2']
+    assert extraredis.maddprefix(b'kvtable', _type='hash') == []
+    assert extraredis.maddprefix(b'khashtable', _type='hash') == [b'khashtable:0', b'khashtable:1', b'khashtable:2']
+    assert extraredis_decode.maddprefix('khashtable', _type='string') == []
+
+
+@pytest_mark_sync
+def test_scan_prefix_escapes_glob(extraredis):
+    extraredis.mset(b'a*', {b'1': b'1'})
+    extraredis.mset(b'ab', {b'1': b'1'})
+    assert extraredis.maddprefix(b'a*') == [b'a*:1']
+
+
+@pytest_mark_sync
+def test_scan_prefix_deduplicates(extraredis, monkeypatch):
+    replies = [(1, [b'p:0', b'p:1']), (0, [b'p:1', b'p:2'])]
+
+    def scan(cursor, **kwargs):
+        return replies.pop(0)
+
+    monkeypatch.setattr(extraredis.redis, 'scan', scan)
+    assert extraredis.maddprefix(b'p') == [b'p:0', b'p:1', b'p:2']
+
+
+@pytest_mark_sync
+def test_mget_skips_other_types(extraredis, kvtable):
+    extraredis.hset_field(b'kvtable', b'h', b'a', b'1')
+    assert extraredis.mget(b'kvtable') == {b'0': b'0', b'1': b'1', b'2': b'2'}
+    assert extraredis.mhget_fields(b'kvtable') == {b'h': {b'a': b'1'}}
+
+
+@pytest_mark_sync
+def test_iter_mget(extraredis, extraredis_decode, kvtable):
+    assert [kv for kv in extraredis.iter_mget(b'kvtable', count=1)] == [(b'0', b'0'), (b'1', b'1'), (b'2', b'2')]
+    assert [kv for kv in extraredis_decode.iter_mget('kvtable')] == [('0', '0'), ('1', '1'), ('2', '2')]
+    assert [kv for kv in extraredis.iter_mget(b'missing')] == []
+
+
+@pytest_mark_sync
+def test_iter_mhget_fields(extraredis, extraredis_decode, khashtable):
+    assert dict([kv for kv in extraredis.iter_mhget_fields(b'khashtable', count=1)]) == {
+        b'0': {b'a': b'0', b'b': b'0', b'c': b'0'},
+        b'1': {b'a': b'1', b'b': b'10', b'c': b'100'},
+        b'2': {b'a': b'2', b'b': b'20', b'c': b'200'},
+    }
+    assert dict([kv for kv in extraredis_decode.iter_mhget_fields('khashtable', fields=['a', 'z'])]) == {
+        '0': {'a': '0', 'z': None},
+        '1': {'a': '1', 'z': None},
+        '2': {'a': '2', 'z': None},
+    }
+
+
+@pytest_mark_sync
+def test_chunking(redis, monkeypatch):
+    extraredis = ExtraRedis(redis, chunk_size=2)
+    mapping = {str(i).encode(): str(i * 10).encode() for i in range(5)}
+    calls = []
+    mset = redis.mset
+
+    def mset_spy(m):
+        calls.append(len(m))
+        return mset(m)
+
+    monkeypatch.setattr(redis, 'mset', mset_spy)
+    extraredis.mset(b'chunks', mapping)
+    assert calls == [2, 2, 1]
+    extraredis.mset(b'chunks', mapping, chunk_size=10)
+    assert calls == [2, 2, 1, 5]
+
+    keys = [b'4', b'0', b'7', b'2', b'1']
+    assert list((extraredis.mget(b'chunks', keys)).items()) == [(k, mapping.get(k)) for k in keys]
+    assert extraredis.mget(b'chunks', chunk_size=3) == mapping
+
+    hmapping = {k: {b'v': v} for k, v in mapping.items()}
+    extraredis.mhset_fields(b'hchunks', hmapping)
+    extraredis.mhset_field(b'hchunks', b'w', mapping)
+    assert extraredis.mhget_field(b'hchunks', b'v', keys) == {k: mapping.get(k) for k in keys}
+    assert extraredis.mhget_fields(b'hchunks', fields=[b'w'], chunk_size=1) == {k: {b'w': v} for k, v in mapping.items()}
+
+    extraredis.delete(b'chunks', *keys)
+    assert extraredis.mget(b'chunks') == {b'3': b'30'}
+
+
+@pytest_mark_sync
+def test_pipeline_atomic(extraredis, khashtable, monkeypatch):
+    transactions = []
+    pipeline = extraredis.redis.pipeline
+
+    def pipeline_spy(transaction=True):
+        transactions.append(transaction)
+        return pipeline(transaction=transaction)
+
+    monkeypatch.setattr(extraredis.redis, 'pipeline', pipeline_spy)
+    extraredis.mhget_fields(b'khashtable')
+    extraredis.mhget_fields(b'khashtable', atomic=True)
+    extraredis.mhset_field(b'khashtable', b'a', {b'1': b'1'})
+    extraredis.mhset_fields(b'khashtable', {b'1': {b'a': b'1'}}, atomic=False)
+    assert transactions == [False, True, True, False]
+
+
+@pytest_mark_sync
+def test_decode_responses_resolved_once(redis, monkeypatch):
+    extraredis = ExtraRedis(redis)
+    assert (extraredis.decode_responses, extraredis.sep) == (False, b':')
+
+    def fail():
+        raise AssertionError('get_connection_kwargs called after construction')
+
+    monkeypatch.setattr(redis, 'get_connection_kwargs', fail)
+    extraredis.mset(b'p', {b'1': b'1'})
+    assert extraredis.mget(b'p') == {b'1': b'1'}
+    assert extraredis.maddprefix(b'p', [b'1', b'2']) == [b'p:1', b'p:2']
+
+
+@pytest_mark_sync
+def test_hash_tag(redis, redis_decode):
+    extraredis = ExtraRedis(redis, hash_tag=True)
+    extraredis.mset(b'kv', {b'0': b'0', b'1': b'1'})
+    extraredis.set(b'kv', b'2', b'2')
+    assert redis.keys() == [b'{kv}:0', b'{kv}:1', b'{kv}:2']
+    assert extraredis.mget(b'kv') == {b'0': b'0', b'1': b'1', b'2': b'2'}
+
+    extraredis_decode = ExtraRedis(redis_decode, hash_tag=True)
+    extraredis_decode.mhset_fields('h', {'0': {'a': '0'}})
+    assert extraredis_decode.maddprefix('h') == ['{h}:0']
+    assert extraredis_decode.mhget_fields('h') == {'0': {'a': '0'}}
+
+
+class FakeClusterNode:
+    def __init__(self, name, pkeys):
+        self.name = name
+        self.pkeys = pkeys
+
+
+@pytest_mark_sync
+def test_cluster_scan_fan_out(extraredis, monkeypatch):
+    nodes = [
+        FakeClusterNode('node0', [b'p:0', b'p:1', b'p:2']),
+        FakeClusterNode('node1', [b'p:3']),
+        FakeClusterNode('node2', []),
+    ]
+    calls = []
+
+    def scan(cursor, match, count, _type, target_nodes):
+        calls.append((target_nodes.name, cursor))
+        pkeys = target_nodes.pkeys[cursor:cursor + count]
+        cursor = cursor + count if cursor + count < len(target_nodes.pkeys) else 0
+        return {target_nodes.name: cursor}, pkeys
+
+    def mget_nonatomic(pkeys):
+        return [k.removeprefix(b'p:') for k in pkeys]
+
+    extraredis.cluster = True
+    monkeypatch.setattr(extraredis.redis, 'get_primaries', lambda: nodes, raising=False)
+    monkeypatch.setattr(extraredis.redis, 'scan', scan)
+    monkeypatch.setattr(extraredis.redis, 'mget_nonatomic', mget_nonatomic, raising=False)
+    assert [b for b in extraredis.scan_prefix(b'p', count=2)] == [[b'p:0', b'p:1', b'p:3'], [b'p:2']]
+    assert sorted(calls) == [('node0', 0), ('node0', 2), ('node1', 0), ('node2', 0)]
+    assert extraredis.mget(b'p') == {b'0': b'0', b'1': b'1', b'3': b'3', b'2': b'2'}
+
+
+class FakeInvalidator:
+    def __init__(self):
+        self.pending = []
+
+    def process(self, cache):
+        cache.invalidate(self.pending)
+        self.pending.clear()
+
+
+@pytest_mark_sync
+def test_client_cache(redis, kvtable, khashtable, monkeypatch):
+    invalidator = FakeInvalidator()
+    cache = ClientCache()
+    extraredis = ExtraRedis(redis, cache=cache, invalidator=invalidator)
+    assert extraredis.get(b'kvtable', b'1') == b'1'
+    assert extraredis.get(b'kvtable', b'7') is None
+    assert extraredis.hget_field(b'khashtable', b'1', b'a') == b'1'
+    assert extraredis.hget_fields(b'khashtable', b'2') == {b'a': b'2', b'b': b'20', b'c': b'200'}
+    assert cache.misses == 4
+
+    redis.set(b'kvtable:1', b'changed elsewhere')
+    redis.hset(b'khashtable:1', b'a', b'changed elsewhere')
+    assert extraredis.get(b'kvtable', b'1') == b'1'
+    assert extraredis.get(b'kvtable', b'7') is None
+    assert extraredis.hget_field(b'khashtable', b'1', b'a') == b'1'
+    assert extraredis.hget_fields(b'khashtable', b'2') == {b'a': b'2', b'b': b'20', b'c': b'200'}
+    assert cache.hits == 4
+
+    invalidator.pending += [b'kvtable:1', b'khashtable:1']
+    assert extraredis.get(b'kvtable', b'1') == b'changed elsewhere'
+    assert extraredis.hget_field(b'khashtable', b'1', b'a') == b'changed elsewhere'
+
+    extraredis.set(b'kvtable', b'1', b'1')
+    assert extraredis.get(b'kvtable', b'1') == b'1'
+
+    # a write and its invalidation processed while the read is in flight: the value read is not cached
+    get = redis.get
+
+    def get_racing(pkey):
+        value = get(pkey)
+        redis.set(pkey, b'written during the read')
+        invalidator.pending.append(pkey)
+        extraredis.process_invalidations()
+        return value
+
+    monkeypatch.setattr(redis, 'get', get_racing)
+    invalidator.pending.append(b'kvtable:1')
+    assert extraredis.get(b'kvtable', b'1') == b'1'
+    monkeypatch.undo()
+    assert extraredis.get(b'kvtable', b'1') == b'written during the read'
+
+
+class FakeTrackingConnection:
+    def __init__(self, replies=()):
+        self.replies = list(replies)
+        self.is_connected = True
+
+    def can_read(self):
+        return bool(self.replies)
+
+    def read_response(self):
+        return self.replies.pop(0)
+
+
+@pytest_mark_sync
+def test_client_tracking_reconnect(redis, monkeypatch):
+    tracking = ClientTracking(redis)
+    started = []
+
+    def start():
+        started.append(True)
+        tracking.listener = FakeTrackingConnection([[b'message', b'__redis__:invalidate', [b'k']]])
+        tracking.tracker = FakeTrackingConnection()
+
+    def close():
+        tracking.listener = tracking.tracker = None
+
+    monkeypatch.setattr(tracking, 'start', start)
+    monkeypatch.setattr(tracking, 'close', close)
+    tracking.start()
+    cache = ClientCache()
+    cache.set(b'k', None, b'1')
+    cache.set(b'j', None, b'2')
+    tracking.process(cache)
+    assert cache.get(b'k') is MISSING
+    assert cache.get(b'j') == b'2'
+
+    tracking.listener.is_connected = False  # can_read() would reconnect without the subscription
+    tracking.process(cache)
+    assert len(cache) == 0
+    assert len(started) == 2
+    cache.set(b'j', None, b'2')
+    tracking.tracker.replies.append(b'')  # the server closed the tracking connection
+    tracking.process(cache)
+    assert len(cache) == 0
+    assert len(started) == 3
+
+
+@pytest_mark_sync
+def test_client_cache_mget(redis, kvtable, khashtable, monkeypatch):
+    extraredis = ExtraRedis(redis, cache=ClientCache(), invalidator=FakeInvalidator())
+    assert extraredis.get(b'kvtable', b'0') == b'0'
+    assert extraredis.hget_field(b'khashtable', b'0', b'b') == b'0'
+    requested = []
+    mget = redis.mget
+
+    def mget_spy(pkeys):
+        requested.extend(pkeys)
+        return mget(pkeys)
+
+    monkeypatch.setattr(redis, 'mget', mget_spy)
+    assert extraredis.mget(b'kvtable', [b'0', b'1', b'7']) == {b'0': b'0', b'1': b'1', b'7': None}
+    assert requested == [b'kvtable:1', b'kvtable:7']
+    assert extraredis.mget(b'kvtable', [b'0', b'1', b'7']) == {b'0': b'0', b'1': b'1', b'7': None}
+    assert requested == [b'kvtable:1', b'kvtable:7']
+
+    assert extraredis.mhget_field(b'khashtable', b'b', [b'0', b'1']) == {b'0': b'0', b'1': b'10'}
+    redis.hset(b'khashtable:1', b'b', b'changed elsewhere')
+    assert extraredis.mhget_field(b'khashtable', b'b', [b'0', b'1']) == {b'0': b'0', b'1': b'10'}
+    extraredis.mhset_field(b'khashtable', b'b', {b'1': b'11'})
+    assert extraredis.mhget_field(b'khashtable', b'b', [b'0', b'1']) == {b'0': b'0', b'1': b'11'}
+
+    # results are copies of the cached hashes
+    (extraredis.hget_fields(b'khashtable', b'2'))[b'a'] = b'mutated'
+    (extraredis.mhget_fields(b'khashtable', [b'2']))[b'2'][b'b'] = b'mutated'
+    assert extraredis.hget_fields(b'khashtable', b'2') == {b'a': b'2', b'b': b'20', b'c': b'200'}
+    assert extraredis.mhget_fields(b'khashtable', [b'2']) == {b'2': {b'a': b'2', b'b': b'20', b'c': b'200'}}
+
+
+@pytest_mark_sync
+def test_codecs(redis, khashtable):
+    extraredis = ExtraRedis(redis, codec='json', codecs={b'raw': 'raw', b'khashtable': 'raw'})
+    extraredis.set(b'j', b'0', {'a': 1})
+    extraredis.mset(b'j', {b'1': [1, 2], b'2': None})
+    assert redis.get(b'j:1') == b'[1,2]'
+    assert extraredis.get(b'j', b'0') == {'a': 1}
+    assert extraredis.mget(b'j', [b'0', b'1', b'2', b'7']) == {b'0': {'a': 1}, b'1': [1, 2], b'2': None, b'7': None}
+    assert dict([kv for kv in extraredis.iter_mget(b'j')]) == {b'0': {'a': 1}, b'1': [1, 2], b'2': None}
+
+    extraredis.hset_field(b'h', b'0', b'a', 1.5)
+    extraredis.hset_fields(b'h', b'0', {b'b': 'x'})
+    extraredis.mhset_field(b'h', b'a', {b'1': [1]})
+    extraredis.mhset_fields(b'h', {b'2': {b'a': True}})
+    assert extraredis.hget_field(b'h', b'0', b'a') == 1.5
+    assert extraredis.hget_fields(b'h', b'0') == {b'a': 1.5, b'b': 'x'}
+    assert extraredis.mhget_field(b'h', b'a', [b'0', b'1', b'2']) == {b'0': 1.5, b'1': [1], b'2': True}
+    assert extraredis.mhget_fields(b'h', fields=[b'a', b'b']) == {
+        b'0': {b'a': 1.5, b'b': 'x'},
+        b'1': {b'a': [1], b'b': None},
+        b'2': {b'a': True, b'b': None},
+    }
+    assert dict([kv for kv in extraredis.iter_mhget_fields(b'h')]) == {b'0': {b'a': 1.5, b'b': 'x'}, b'1': {b'a': [1]}, b'2': {b'a': True}}
+
+    extraredis.set(b'raw', b'0', b'{not json')
+    assert extraredis.get(b'raw', b'0') == b'{not json'
+    assert extraredis.hget_fields(b'khashtable', b'1') == {b'a': b'1', b'b': b'10', b'c': b'100'}
+
+
+@pytest_mark_sync
+def test_compression(redis):
+    extraredis = ExtraRedis(redis, codec=CompressedCodec('json', threshold=64))
+    small = {'a': 1}
+    big = {'html': '<p>' * 1000}
+    extraredis.mset(b'c', {b'small': small, b'big': big})
+    assert redis.get(b'c:small') == b'{"a":1}'
+    assert len(redis.get(b'c:big')) < 100
+    assert extraredis.mget(b'c') == {b'big': big, b'small': small}
+    extraredis.mhset_fields(b'hc', {b'0': {b'small': small, b'big': big}})
+    assert extraredis.mhget_fields(b'hc', fields=[b'small', b'big', b'z']) == {b'0': {b'small': small, b'big': big, b'z': None}}
+
+
+@pytest_mark_sync
+def test_concurrent_chunks(redis, monkeypatch):
+    extraredis = ExtraRedis(redis, chunk_size=2, concurrency=3)
+    mapping = {str(i).encode(): {b'a': str(i).encode(), b'b': str(i * 10).encode()} for i in range(11)}
+    extraredis.mhset_fields(b'h', mapping)
+    extraredis.mhset_field(b'h', b'c', {k: v[b'a'] for k, v in mapping.items()}, concurrency=2)
+
+    in_flight = []
+    calls = []
+    mhget_pkeys = extraredis._mhget_pkeys
+
+    def spy(*args):
+        in_flight.append(1)
+        calls.append(len(in_flight))
+        try:
+            return mhget_pkeys(*args)
+        finally:
+            in_flight.pop()
+
+    monkeypatch.setattr(extraredis, '_mhget_pkeys', spy)
+    keys = list(reversed(mapping))
+    assert list((extraredis.mhget_fields(b'h', keys, [b'a', b'b'])).items()) == [(k, mapping[k]) for k in keys]
+    assert len(calls) == 6
+    assert max(calls) <= 3
+    assert extraredis.mhget_field(b'h', b'c', keys, concurrency=1) == {k: mapping[k][b'a'] for k in keys}
+
+
+@pytest_mark_sync
+def test_hscan(redis, extraredis_decode, khashtable, monkeypatch):
+    big = {f'f{i}'.encode(): str(i).encode() for i in range(20)} | {b'g0': b'x'}
+    redis.hset(b'big:0', mapping=big)
+    extraredis = ExtraRedis(redis, hscan_threshold=10)
+    assert dict([kv for kv in extraredis.iter_hget_fields(b'big', b'0', count=3)]) == big
+    assert dict([kv for kv in extraredis.iter_hget_fields(b'big', b'0', match=b'f1*')]) == {
+        k: v for k, v in big.items() if k.startswith(b'f1')
+    }
+    assert extraredis.hget_fields(b'big', b'0', match=b'g*') == {b'g0': b'x'}
+    assert extraredis_decode.hget_fields('khashtable', '1', match='[ab]') == {'a': '1', 'b': '10'}
+    with pytest.raises(ValueError):
+        extraredis.hget_fields(b'big', b'0', fields=[b'f0'], match=b'g*')
+
+    hscans = []
+    hscan = redis.hscan
+
+    def hscan_spy(name, *args, **kwargs):
+        hscans.append(name)
+        return hscan(name, *args, **kwargs)
+
+    monkeypatch.setattr(redis, 'hscan', hscan_spy)
+    assert extraredis.hget_fields(b'big', b'0') == big
+    assert extraredis.hget_fields(b'khashtable', b'1') == {b'a': b'1', b'b': b'10', b'c': b'100'}
+    assert extraredis.mhget_fields(b'big') == {b'0': big}
+    assert hscans == []  # HSCAN steps of all scanned hashes are pipelined
+    redis.hset(b'big:1', mapping=big)
+    extraredis_steps = ExtraRedis(redis, scan_count=3)
+    assert extraredis_steps.mhget_fields(b'big', [b'0', b'1', b'2'], match=b'f1*') == {
+        b'0': {k: v for k, v in big.items() if k.startswith(b'f1')},
+        b'1': {k: v for k, v in big.items() if k.startswith(b'f1')},
+        b'2': {},
+    }
+    assert hscans == []
+    assert extraredis.mhget_fields(b'khashtable', match=b'a') == {b'0': {b'a': b'0'}, b'1': {b'a': b'1'}, b'2': {b'a': b'2'}}
+    assert dict([kv for kv in extraredis.iter_mhget_fields(b'khashtable', match=b'c')]) == {
+        b'0': {b'c': b'0'}, b'1': {b'c': b'100'}, b'2': {b'c': b'200'},
+    }
+
+
+@pytest_mark_sync
+def test_scripts(redis, extraredis_decode, kvtable, khashtable):
+    pytest.importorskip('lupa')
+    extraredis = ExtraRedis(redis, scan_count=2, codec='utf8')
+    assert extraredis.count_prefix(b'kvtable', steps=1) == 3
+    assert extraredis.count_prefix(b'khashtable', _type='hash') == 3
+    assert extraredis.count_prefix(b'khashtable', _type='string') == 0
+    assert extraredis.mhget_field_server(b'khashtable', b'b') == {b'0': '0', b'1': '10', b'2': '20'}
+    assert extraredis.mhget_field_server(b'khashtable', b'b', [b'2', b'3'], chunk_size=1) == {b'2': '20', b'3': None}
+    assert extraredis_decode.mhget_field_server('khashtable', 'c', steps=1) == {'0': '0', '1': '100', '2': '200'}
+
+    assert extraredis.mset_nx(b'kvtable', {b'2': 'x', b'3': 'y'}) == {b'2': False, b'3': True}
+    assert extraredis.mget(b'kvtable', [b'2', b'3']) == {b'2': '2', b'3': 'y'}
+
+    redis.script_flush()  # EVALSHA fails with NOSCRIPT and the script is loaded again
+    assert extraredis.delete_prefix(b'kvtable', steps=1) == 4
+    assert redis.keys(b'kvtable:*') == []
+    assert extraredis.count_prefix(b'kvtable') == 0
+
+
+@pytest_mark_sync
+def test_ttl(redis, monkeypatch):
+    extraredis = ExtraRedis(redis, ttls={b'p': 100})
+    extraredis.set(b'p', b'a', b'1')
+    extraredis.set(b'p', b'b', b'1', px=5000)
+    extraredis.set(b'q', b'a', b'1')
+    assert 99_000 < redis.pttl(b'p:a') <= 100_000
+    assert 4000 < redis.pttl(b'p:b') <= 5000
+    assert redis.pttl(b'q:a') == -1
+    with pytest.raises(ValueError):
+        extraredis.set(b'p', b'a', b'1', ex=1, px=1000)
+
+    extraredis.mset(b'q', {b'a': b'1', b'b': b'2'}, exat=time.time() + 50)
+    assert extraredis.mget(b'q', [b'a', b'b']) == {b'a': b'1', b'b': b'2'}
+    assert [40_000 < redis.pttl(k) <= 50_000 for k in (b'q:a', b'q:b')] == [True, True]
+
+    extraredis.hset_fields(b'h', b'0', {b'a': b'1'}, ex=10)
+    extraredis.hset_field(b'h', b'1', b'a', b'1', ex=10, per_field=True)
+    extraredis.mhset_fields(b'h', {b'2': {b'a': b'1', b'b': b'2'}}, ex=10, per_field=True)
+    extraredis.mhset_field(b'h', b'c', {b'2': b'3', b'3': b'3'}, ex=10)
+    assert 9000 < redis.pttl(b'h:0') <= 10_000
+    assert redis.pttl(b'h:1') == -1
+    assert [9000 < t <= 10_000 for t in redis.hpttl(b'h:1', b'a')] == [True]
+    assert [9000 < t <= 10_000 for t in redis.hpttl(b'h:2', b'a', b'b')] == [True, True]
+    assert redis.hpttl(b'h:2', b'c') == [-1]
+    assert 9000 < redis.pttl(b'h:3') <= 10_000
+
+    monkeypatch.setattr(random, 'randint', lambda a, b: b)
+    extraredis = ExtraRedis(redis, ttls={b'p': 100}, ttl_jitter=0.5)
+    extraredis.mset(b'p', {b'c': b'1'})
+    assert 149_000 < redis.pttl(b'p:c') <= 150_000
+
+
+@pytest_mark_sync
+def test_instrumentation(redis, kvtable, khashtable):
+    class Recorder(Hook):
+        def __init__(self):
+            self.calls = []
+
+        def before(self, call):
+            self.calls.append(('before', call.method, call.prefix, call.keys))
+
+        def after(self, call):
+            self.calls.append(('after', call.method, call.prefix, call.keys, call.reply_bytes, call.error is not None))
+
+    recorder = Recorder()
+    collector = HistogramCollector()
+    extraredis = ExtraRedis(redis, hooks=[recorder, collector])
+    extraredis.mget(b'kvtable', [b'0', b'1'])
+    extraredis.mget(b'kvtable')
+    extraredis.mhget_field(b'khashtable', b'a')  # calls mhget_fields, reported once
+    assert [kv for kv in extraredis.iter_mget(b'kvtable')]
+    with pytest.raises(Exception):
+        extraredis.hget_field(b'kvtable', b'0', b'a')
+    assert recorder.calls == [
+        ('before', 'mget', b'kvtable', 2),
+        ('after', 'mget', b'kvtable', 2, 4, False),
+        ('before', 'mget', b'kvtable', None),
+        ('after', 'mget', b'kvtable', 3, 6, False),
+        ('before', 'mhget_field', b'khashtable', None),
+        ('after', 'mhget_field', b'khashtable', 3, 6, False),
+        ('before', 'iter_mget', b'kvtable', None),
+        ('after', 'iter_mget', b'kvtable', 3, 6, False),
+        ('before', 'hget_field', b'kvtable', 1),
+        ('after', 'hget_field', b'kvtable', 1, 0, True),
+    ]
+    stats = collector.stats()
+    assert stats['mget', b'kvtable']['count'] == 2
+    assert stats['mget', b'kvtable']['keys'] == 5
+    assert stats['hget_field', b'kvtable']['errors'] == 1
+
+
+@pytest_mark_sync
+def test_output(redis, extraredis, extraredis_decode, kvtable, khashtable):
+    assert extraredis.mget(b'kvtable', iter([b'1', b'5']), output='lists') == ([b'1', b'5'], [b'1', None])
+    keys, values = extraredis.mget(b'kvtable', output='buffer')
+    assert keys == [b'0', b'1', b'2']
+    assert [bytes(v) for v in values] == [b'0', b'1', b'2']
+    with pytest.raises(ValueError):
+        extraredis_decode.mget('kvtable', output='buffer')
+    with pytest.raises(ValueError):
+        ExtraRedis(redis, codec='json').mget(b'kvtable', output='buffer')
+    with pytest.raises(ValueError):
+        extraredis.mget(b'kvtable', output='columns')
+
+    assert extraredis.mhget_fields(b'khashtable', [b'1', b'5'], [b'a', b'c'], output='lists') == (
+        [b'1', b'5'], [[b'1', b'100'], [None, None]],
+    )
+    assert extraredis_decode.mhget_fields('khashtable', fields=['b'], output='lists') == (['0', '1', '2'], [['0'], ['10'], ['20']])
+    assert extraredis.mhget_fields(b'khashtable', [b'0'], output='lists') == ([b'0'], [{b'a': b'0', b'b': b'0', b'c': b'0'}])
+    assert extraredis.mhget_field(b'khashtable', b'b', output='lists') == ([b'0', b'1', b'2'], [b'0', b'10', b'20'])
+
+
+@pytest_mark_sync
+def test_output_columns(extraredis, extraredis_decode, khashtable, monkeypatch):
+    monkeypatch.setattr(columns, 'numpy', None)
+    index, cols = extraredis.mhget_fields(b'khashtable', [b'0', b'2', b'5'], [b'a', b'b'], output='columns', dtypes={b'b': float})
+    assert index == [b'0', b'2', b'5']
+    assert cols[b'a'] == [b'0', b'2', None]
+    assert cols[b'b'].typecode == 'd'
+    assert cols[b'b'].tolist()[:2] == [0.0, 20.0]
+    assert math.isnan(cols[b'b'][2])
+    with pytest.raises(ValueError):
+        extraredis.mhget_fields(b'khashtable', [b'5'], [b'a'], output='columns', dtypes={b'a': int})
+    with pytest.raises(ValueError):
+        extraredis.mhget_fields(b'khashtable', output='columns')
+    assert extraredis.mhget_fields(b'khashtable', [], [b'a'], output='columns', dtypes={b'a': int}) == ([], {b'a': array.array('q')})
+
+    numpy = pytest.importorskip('numpy')
+    monkeypatch.setattr(columns, 'numpy', numpy)
+    index, cols = extraredis_decode.mhget_fields('khashtable', fields=['a', 'c'], output='columns', dtypes={'a': int, 'c': 'float32'})
+    assert index.tolist() == ['0', '1', '2']
+    assert cols['a'].dtype == numpy.int64
+    assert cols['a'].tolist() == [0, 1, 2]
+    assert cols['c'].dtype == numpy.float32
+    assert cols['c'].tolist() == [0, 100, 200]
+    index, _ = extraredis.mhget_fields(b'khashtable', [b'0', b'0\x00'], [b'a'], output='columns')
+    assert index.dtype == object
+    assert index.tolist() == [b'0', b'0\x00']
+
+
+@record(b'user')
+class User:
+    id: int
+    name: str
+    score: float | None = None
+    active: bool = True
+
+
+@pytest_mark_sync
+def test_records(redis):
+    extraredis = ExtraRedis(redis)
+    users = [User(1, 'a', 0.5), User(2, 'b', active=False)]
+    extraredis.mset_records(users, ex=100)
+    assert redis.hgetall(b'user:2') == {b'name': b'b', b'active': b'0'}
+    assert redis.ttl(b'user:1') == 100
+    assert not hasattr(users[0], '__dict__')
+    redis.hset(b'user:1', b'extra', b'not read')
+    assert extraredis.mget_records(User, [1, 2, 3]) == users + [None]
+    assert sorted(extraredis.mget_records(User), key=lambda u: u.id) == users
+    with pytest.raises(TypeError):
+        extraredis.mset_records([users[0], object()])
+    with pytest.raises(TypeError):
+        extraredis.mset_records([object()])
+
+
+@pytest_mark_sync
+def test_indexes(redis, redis_decode):
+    pytest.importorskip('lupa')
+    extraredis = ExtraRedis(redis, indexes={b'u': {b'age': 'numeric', b'city': 'equal'}})
+    extraredis.mhset_fields(b'u', {
+        b'0': {b'age': 30, b'city': b'paris', b'name': b'a'},
+        b'1': {b'age': 20, b'city': b'rome', b'name': b'b'},
+        b'2': {b'age': 40, b'city': b'paris', b'name': b'c'},
+    })
+    extraredis.hset_field(b'u', b'1', b'city', b'paris')
+    extraredis.hset_fields(b'u', b'0', {b'city': b'oslo', b'age': b'unknown'}, ex=100)
+    extraredis.mhset_field(b'u', b'age', {b'3': 25})
+    assert redis.hgetall(b'u:0') == {b'age': b'unknown', b'city': b'oslo', b'name': b'a'}
+    assert redis.ttl(b'u:0') == 100
+
+    assert sorted(extraredis.find_equal(b'u', b'city', b'paris')) == [b'1', b'2']
+    assert extraredis.find_equal(b'u', b'city', b'oslo', fields=[b'name']) == {b'0': {b'name': b'a'}}
+    assert len(extraredis.find_equal(b'u', b'city', b'paris', limit=1)) == 1
+    assert extraredis.find_equal(b'u', b'city', b'rome') == []
+    assert extraredis.find_range(b'u', b'age') == [b'1', b'3', b'2']
+    assert extraredis.find_range(b'u', b'age', 21, '(40') == [b'3']
+    assert extraredis.find_range(b'u', b'age', desc=True, limit=2, fields=[b'age']) == {b'2': {b'age': b'40'}, b'3': {b'age': b'25'}}
+    assert extraredis.find_range(b'u', b'age', offset=1) == [b'3', b'2']
+
+    extraredis.delete(b'u', b'2')  # index entries are deleted with the hash
+    assert redis.smembers(b'__idx__:u:e:4:city:paris') == {b'u:1'}
+    assert extraredis.find_equal(b'u', b'city', b'paris') == [b'1']
+    assert extraredis.find_range(b'u', b'age') == [b'1', b'3']
+
+    # entries of hashes changed or deleted without the index are skipped and cleaned up, limit counts real matches
+    extraredis.mhset_field(b'u', b'age', {str(i).encode(): i for i in range(10, 15)})
+    redis.delete(b'u:10', b'u:11')
+    redis.hset(b'u:12', b'age', 100)
+    assert extraredis.find_range(b'u', b'age', 10, 20, limit=2) == [b'13', b'14']
+    assert extraredis.find_range(b'u', b'age', 10, 200) == [b'13', b'14', b'1', b'3', b'12']
+    assert redis.zrange(b'__idx__:u:n:age', 0, -1) == [b'u:13', b'u:14', b'u:1', b'u:3', b'u:12']
+    redis.hset(b'u:1', b'city', b'rome')
+    extraredis.hset_field(b'u', b'3', b'city', b'paris')
+    assert extraredis.find_equal(b'u', b'city', b'paris', limit=1) == [b'3']
+    assert redis.smembers(b'__idx__:u:e:4:city:paris') == {b'u:3'}
+
+    assert extraredis.delete_prefix(b'u') == 6
+    assert redis.keys(b'__idx__:*') == []
+
+    # (field, value) pairs joined with ':' the same way don't share an index key
+    colliding = ExtraRedis(redis, indexes={b'c': {b'a': 'equal', b'a:b': 'equal'}})
+    colliding.hset_fields(b'c', b'0', {b'a': b'b:c'})
+    colliding.hset_fields(b'c', b'1', {b'a:b': b'c'})
+    assert colliding.find_equal(b'c', b'a', b'b:c') == [b'0']
+    assert colliding.find_equal(b'c', b'a:b', b'c') == [b'1']
+    assert colliding.find_equal(b'c', b'a', b'b:c') == [b'0']
+
+    extraredis_decode = ExtraRedis(redis_decode, indexes={'u': {'tag': 'equal', 'größe': 'equal'}}, codec='json')
+    extraredis_decode.hset_fields('u', '0', {'tag': 'x', 'n': 1, 'größe': 'xl'})
+    assert extraredis_decode.find_equal('u', 'tag', 'x', fields=['n']) == {'0': {'n': 1}}
+    assert extraredis_decode.find_equal('u', 'größe', 'xl') == ['0']  # the length prefix counts bytes, as in lua
+
+
+@pytest_mark_sync
+def test_export_import_prefix(extraredis, redis, tmp_path, monkeypatch):
+    path = str(tmp_path / 'kv.dump')
+    extraredis.mset(b'kv', {str(i).encode(): i for i in range(50)})
+    extraredis.hset_fields(b'kv', b'h', {b'a': 1}, ex=100)
+    extraredis.set(b'other', b'0', 0)
+    assert extraredis.export_prefix(b'kv', path, count=10) == 51
+    assert not (tmp_path / 'kv.dump.checkpoint').exists()
+
+    extraredis.delete_prefix(b'kv')
+    assert extraredis.import_prefix(path) == 51
+    assert extraredis.mget(b'kv', [b'0', b'49']) == {b'0': b'0', b'49': b'49'}
+    assert redis.hgetall(b'kv:h') == {b'a': b'1'}
+    assert 0 < redis.ttl(b'kv:h') <= 100
+    assert redis.ttl(b'kv:0') == -1
+    assert extraredis.import_prefix(path, b'copy') == 51
+    assert extraredis.get(b'copy', b'7') == b'7'
+    with pytest.raises(ResponseError):
+        extraredis.import_prefix(path, b'copy', replace=False)
+
+    # interrupted export continues from the SCAN cursor of the last written block
+    zpath = str(tmp_path / 'kvz.dump')
+    write_block = dumpfile.DumpWriter._write_block
+    blocks = []
+
+    def failing_write_block(self, records, cursor):
+        if len(blocks) == 2:
+            raise RuntimeError
+        blocks.append(len(records))
+        write_block(self, records, cursor)
+
+    monkeypatch.setattr(dumpfile.DumpWriter, '_write_block', failing_write_block)
+    with pytest.raises(RuntimeError):
+        extraredis.export_prefix(b'kv', zpath, count=10, compression='zlib')
+    monkeypatch.undo()
+    assert (tmp_path / 'kvz.dump.checkpoint').exists()
+    assert sum(blocks) + extraredis.export_prefix(b'kv', zpath, count=10, compression='zlib', resume=True) == 51
+    extraredis.delete_prefix(b'copy')
+    assert extraredis.import_prefix(zpath, b'copy') == 51
+    assert extraredis.mget(b'copy', [str(i).encode() for i in range(50)]) == {str(i).encode(): str(i).encode() for i in range(50)}
+
+    # interrupted import continues after the last restored block
+    (tmp_path / 'kv.dump.import-checkpoint').write_text(f'{{"offset": {(tmp_path / "kv.dump").stat().st_size}}}')
+    assert extraredis.import_prefix(path, b'copy', resume=True) == 0
+    (tmp_path / 'bad.dump').write_bytes(b'not a dump file')
+    with pytest.raises(ValueError):
+        extraredis.import_prefix(str(tmp_path / 'bad.dump'))
+
+
+@pytest_mark_sync
+def test_copy_rename_migrate_prefix(extraredis, redis):
+    extraredis.mset(b'v1', {str(i).encode(): i for i in range(30)}, ex=100)
+    extraredis.hset_fields(b'v1', b'h', {b'a': 1})
+    assert extraredis.copy_prefix(b'v1', b'v2', count=7, concurrency=2) == 31
+    assert redis.hgetall(b'v2:h') == {b'a': b'1'}
+    assert 0 < redis.ttl(b'v2:0') <= 100
+    extraredis.set(b'v2', b'0', b'changed')
+    assert extraredis.copy_prefix(b'v1', b'v2') == 0
+    assert extraredis.get(b'v2', b'0') == b'changed'
+    assert extraredis.copy_prefix(b'v1', b'v2', replace=True) == 31
+    assert extraredis.get(b'v2', b'0') == b'0'
+    with pytest.raises(ValueError):
+        extraredis.copy_prefix(b'v1', b'v1:old')
+
+    progress = []
+    assert extraredis.rename_prefix(b'v2', b'v3', count=10, progress=progress.append) == 31
+    assert progress[-1] == 31
+    assert extraredis.count_prefix(b'v2') == 0
+    assert extraredis.get(b'v3', b'29') == b'29'
+    extraredis.set(b'v1', b'0', b'changed')
+    assert extraredis.rename_prefix(b'v1', b'v3') == 0
+    assert extraredis.rename_prefix(b'v1', b'v3', replace=True) == 31
+    assert extraredis.get(b'v3', b'0') == b'changed'
+
+    target = ExtraRedis(fake_redis_module.FakeRedis())
+    target.set(b'v3', b'0', b'exists')
+    assert extraredis.migrate_prefix(b'v3', target, copy=True) == 30
+    assert target.get(b'v3', b'0') == b'exists'
+    assert extraredis.migrate_prefix(b'v3', target, b'v4', concurrency=3, count=5) == 31
+    assert extraredis.count_prefix(b'v3') == 0
+    assert target.mget(b'v4', [b'0', b'h']) == {b'0': b'changed', b'h': None}
+    assert target.redis.hgetall(b'v4:h') == {b'a': b'1'}
+    assert 0 < target.redis.ttl(b'v4:1') <= 100
+
+
+@pytest_mark_sync
+def test_zset_set_list(extraredis, redis):
+    assert extraredis.zadd(b'board', b'0', {b'a': 1, b'b': 2}) == 2
+    assert extraredis.mzadd(b'board', {b'0': {b'c': 3}, b'1': {b'a': 5}, b'2': {}}, ex=100) == {b'0': 1, b'1': 1, b'2': 0}
+    assert 0 < redis.ttl(b'board:1') <= 100
+    assert extraredis.zrange(b'board', b'0') == [(b'a', 1.0), (b'b', 2.0), (b'c', 3.0)]
+    assert extraredis.zrange(b'board', b'0', 0, 0, desc=True, withscores=False) == [b'c']
+    assert extraredis.mzrange(b'board', [b'0', b'1', b'3'], 0, 1, desc=True, chunk_size=2) == {
+        b'0': [(b'c', 3.0), (b'b', 2.0)],
+        b'1': [(b'a', 5.0)],
+        b'3': [],
+    }
+    assert extraredis.zmscore(b'board', b'0', [b'a', b'x']) == [1.0, None]
+    assert extraredis.zmscore(b'board', b'0', []) == []
+    assert extraredis.mzmscore(b'board', {b'0': [b'b'], b'1': [b'a', b'b'], b'2': []}) == {b'0': [2.0], b'1': [5.0, None], b'2': []}
+
+    assert extraredis.sadd(b'tags', b'0', [b'x', b'y']) == 2
+    assert extraredis.msadd(b'tags', {b'0': {b'y', b'z'}, b'1': [b'x']}, concurrency=2, chunk_size=1) == {b'0': 1, b'1': 1}
+    assert extraredis.smismember(b'tags', b'0', [b'x', b'w']) == [True, False]
+    assert extraredis.msmismember(b'tags', {b'0': [b'z'], b'1': [b'y', b'x'], b'2': [b'x']}) == {b'0': [True], b'1': [False, True], b'2': [False]}
+
+    assert extraredis.rpush(b'queue', b'0', [b'a', b'b']) == 2
+    assert extraredis.mrpush(b'queue', {b'0': [b'c'], b'1': (str(i).encode() for i in range(5)), b'2': []}, px=100_000) == {b'0': 3, b'1': 5, b'2': None}
+    assert 0 < redis.pttl(b'queue:0') <= 100_000
+    assert extraredis.lrange(b'queue', b'0', 1) == [b'b', b'c']
+    assert extraredis.mlrange(b'queue', [b'0', b'1', b'2'], 0, 1) == {b'0': [b'a', b'b'], b'1': [b'0', b'1'], b'2': []}
+
+
+@pytest_mark_sync
+def test_migrate_prefix_server_side(extraredis, redis, monkeypatch):
+    target = ExtraRedis(fake_redis_module.FakeRedis(username='u', password='p'))
+    extraredis.mset(b'm', {str(i).encode(): i for i in range(10)})
+    target.set(b'm', b'0', b'exists')
+    execute_command = redis.execute_command
+    calls = []
+    created = {}  # keys another client creates in target while MIGRATE runs
+
+    def fake_execute_command(*args, **kwargs):
+        # MIGRATE between two fakeredis servers: RESTORE of DUMP, as the source server would do
+        if args[0] != 'MIGRATE':
+            return execute_command(*args, **kwargs)
+        calls.append(args)
+        pkeys = args[args.index('KEYS') + 1:]
+        for pkey, value in created.items():
+            target.redis.set(pkey, value)
+        moved = 0
+        busy = False
+        for pkey in pkeys:
+            value = redis.dump(pkey)
+            if value is None:
+                continue
+            if 'REPLACE' not in args and target.redis.exists(pkey):
+                busy = True
+                continue
+            target.redis.restore(pkey, 0, value, replace='REPLACE' in args)
+            if 'COPY' not in args:
+                redis.delete(pkey)
+            moved += 1
+        if busy:
+            raise ResponseError('BUSYKEY Target key name already exists.')
+        return b'OK' if moved else b'NOKEY'
+
+    monkeypatch.setattr(redis, 'execute_command', fake_execute_command)
+    with pytest.raises(ResponseError, match='unknown command'):
+        execute_command('MIGRATE', 'localhost', 6379, '', 0, 5000, 'KEYS', b'm:1')
+    # without address: DUMP / RESTORE, MIGRATE is not sent
+    assert extraredis.migrate_prefix(b'm', target, copy=True, count=4) == 9
+    assert calls == []
+    target.delete(b'm', *(str(i).encode() for i in range(1, 10)))
+
+    assert extraredis.migrate_prefix(b'm', target, copy=True, count=4, address=('10.0.0.2', 6380)) == 9
+    assert calls[0][:7] == ('MIGRATE', '10.0.0.2', 6380, '', 0, 5000, 'COPY')
+    assert calls[0][7:10] == ('AUTH2', 'u', 'p')
+    assert target.get(b'm', b'0') == b'exists'  # existing keys are skipped, as with RESTORE
+    assert target.get(b'm', b'9') == b'9'
+    target.delete(b'm', *(str(i).encode() for i in range(1, 10)))
+    created[b'm:5'] = b'created'
+    assert extraredis.migrate_prefix(b'm', target, copy=True, address=('10.0.0.2', 6380)) == 8  # BUSYKEY for m:5
+    assert target.get(b'm', b'5') == b'created'
+    target.delete(b'm', *(str(i).encode() for i in range(1, 10)))
+    assert extraredis.migrate_prefix(b'm', target, address=('10.0.0.2', 6380)) == 8
+    assert extraredis.mget(b'm') == {b'0': b'0', b'5': b'5'}
+    created.clear()
+    assert extraredis.migrate_prefix(b'm', target, replace=True, address=('10.0.0.2', 6380)) == 2
+    assert extraredis.count_prefix(b'm') == 0
+    assert target.get(b'm', b'0') == b'0'
+    with pytest.raises(ValueError):
+        extraredis.migrate_prefix(b'm', target, b'n', address=('10.0.0.2', 6380))
+    with pytest.raises(ValueError):
+        extraredis.migrate_prefix(b'm', extraredis)
+
+    # batches run on the shared executor, the EXISTS checks must not wait for it again
+    small = ExtraRedis(redis, chunk_size=1, concurrency=2)
+    small.mset(b'm', {str(i).encode(): i for i in range(200)})
+    assert small.migrate_prefix(b'm', target, replace=True, count=5, concurrency=64, address=('10.0.0.2', 6380)) == 200
@@ -0,0 +1,61 @@
+import asyncio
+
+import fakeredis.aioredis as fake_redis_async
+import pytest
+from redis import exceptions as redis_exceptions
+
+from extraredis import ExtraRedisAsync
+from extraredis.autobatch import AutoBatchRedis
+
+
+@pytest.fixture
+def redis():
+    return fake_redis_async.FakeRedis()
+
+
+@pytest.mark.asyncio
+async def test_autobatch_coalesces(redis):
+    await redis.mset({f'kv:{i}'.encode(): str(i).encode() for i in range(100)})
+    await redis.hset(b'h:0', mapping={b'a': b'0', b'b': b'00'})
+    batcher = AutoBatchRedis(redis)
+    extraredis = ExtraRedisAsync(batcher)
+    gets = [extraredis.get(b'kv', str(i).encode()) for i in range(100)] + [extraredis.get(b'kv', b'missing')]
+    hgets = [extraredis.hget_field(b'h', b'0', b'a'), extraredis.hget_field(b'h', b'0', b'b'), extraredis.hget_field(b'h', b'1', b'a')]
+    results = await asyncio.gather(*gets, *hgets)
+    assert results == [str(i).encode() for i in range(100)] + [None, b'0', b'00', None]
+    assert batcher.batches == 1
+
+    assert await extraredis.get(b'kv', b'1') == b'1'
+    assert batcher.batches == 2
+
+
+@pytest.mark.asyncio
+async def test_autobatch_window_and_max_batch(redis):
+    await redis.set(b'kv:0', b'0')
+    batcher = AutoBatchRedis(redis, window=0.01, max_batch=3)
+    extraredis = ExtraRedisAsync(batcher)
+
+    async def delayed_get(delay):
+        await asyncio.sleep(delay)
+        return await extraredis.get(b'kv', b'0')
+
+    assert await asyncio.gather(delayed_get(0), delayed_get(0.001)) == [b'0', b'0']
+    assert batcher.batches == 1
+    await asyncio.gather(*[extraredis.get(b'kv', str(i).encode()) for i in range(6)])
+    assert batcher.batches == 3
+
+
+@pytest.mark.asyncio
+async def test_autobatch_error(redis):
+    await redis.hset(b'kv:h', b'a', b'1')
+    await redis.set(b'kv:s', b'1')
+    extraredis = ExtraRedisAsync(AutoBatchRedis(redis))
+    results = await asyncio.gather(
+        extraredis.hget_field(b'kv', b'h', b'a'),
+        extraredis.hget_field(b'kv', b's', b'a'),
+        extraredis.get(b'kv', b's'),
+        return_exceptions=True,
+    )
+    assert results[0] == b'1'
+    assert isinstance(results[1], redis_exceptions.ResponseError)  # only the call of the failed HMGET fails
+    assert results[2] == b'1'
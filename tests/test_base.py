@@ -1,6 +1,17 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
+from extraredis import codecs
+from extraredis import compression
+from extraredis import concurrency
+from extraredis import instrumentation
 from extraredis import util
+from extraredis.buffers import BytesBuffer
+from extraredis.client_cache import MISSING
+from extraredis.client_cache import ClientCache
 
 
 def test_encode_list():
@@ -33,3 +44,183 @@ def test_encode_dict_values():
 
 def test_decode_dict_values():
     assert util.decode_dict_values({'a': b'b', 'c': b'd'}) == {'a': 'b', 'c': 'd'}
+
+
+def test_escape_glob():
+    assert util.escape_glob('a*b?[c]') == 'a\\*b\\?\\[c\\]'
+    assert util.escape_glob(b'a*b') == b'a\\*b'
+
+
+def test_chunked():
+    assert list(util.chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(util.chunked([], 2)) == []
+
+
+def test_gather(monkeypatch):
+    funcs = [lambda i=i: i * 10 for i in range(5)]
+    assert concurrency.gather_sync(funcs) == [0, 10, 20, 30, 40]
+    assert concurrency.gather_sync(funcs, concurrency=2) == [0, 10, 20, 30, 40]
+    executor = concurrency.executor_sync()
+    monkeypatch.setattr(concurrency, 'ThreadPoolExecutor', None)  # no pool per call
+    assert concurrency.gather_sync(funcs, executor=executor) == [0, 10, 20, 30, 40]
+    assert concurrency.gather_sync(funcs, concurrency=2, executor=executor) == [0, 10, 20, 30, 40]
+    executor.shutdown()
+
+    async def f(i):
+        return i * 10
+
+    afuncs = [functools.partial(f, i) for i in range(5)]
+    assert asyncio.run(concurrency.gather_async(afuncs)) == [0, 10, 20, 30, 40]
+    assert asyncio.run(concurrency.gather_async(afuncs, concurrency=2)) == [0, 10, 20, 30, 40]
+
+
+def test_client_cache_lru():
+    cache = ClientCache(max_entries=2)
+    cache.set(b'a', None, b'1')
+    cache.set(b'b', None, b'2')
+    assert cache.get(b'a') == b'1'
+    cache.set(b'c', None, b'3')
+    assert cache.get(b'b') is MISSING
+    assert cache.get(b'a') == b'1'
+    assert cache.stats() == {'entries': 2, 'bytes': 4, 'hits': 2, 'misses': 1, 'evictions': 1, 'invalidations': 0}
+
+
+def test_client_cache_max_bytes():
+    cache = ClientCache(max_bytes=9)
+    cache.set(b'a', None, b'x' * 4)
+    cache.set(b'b', None, b'x' * 4)
+    assert len(cache) == 1 and cache.nbytes == 5
+    cache.set(b'c', None, b'x' * 100)
+    assert cache.get(b'c') is MISSING
+
+
+def test_client_cache_invalidate():
+    cache = ClientCache()
+    cache.set(b'h', b'a', b'1')
+    cache.set(b'h', b'b', b'2')
+    cache.set(b'k', None, None)
+    assert cache.get(b'k') is None
+    cache.invalidate([b'h', b'missing'])
+    assert cache.get(b'h', b'a') is MISSING
+    assert cache.get(b'h', b'b') is MISSING
+    assert cache.invalidations == 2
+    cache.clear()
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_client_cache_reading():
+    cache = ClientCache()
+    with cache.reading([b'a', b'b']):
+        with cache.reading([b'a']):
+            cache.invalidate([b'a'])
+            cache.set(b'a', None, b'old')
+        cache.set(b'a', None, b'old')  # still stale for the outer read
+        cache.set(b'b', None, b'1')
+    assert cache.get(b'a') is MISSING
+    assert cache.get(b'b') == b'1'
+    cache.set(b'a', None, b'new')
+    assert cache.get(b'a') == b'new'
+    with cache.reading([b'c']):
+        cache.clear()
+        cache.set(b'c', None, b'old')
+    assert cache.get(b'c') is MISSING
+    assert cache.reads == {} and cache.stale == set()
+
+
+@pytest.mark.parametrize('name', ['raw', 'utf8', 'json', 'pickle', 'msgpack'])
+def test_codec_roundtrip(name):
+    if name == 'msgpack':
+        pytest.importorskip('msgpack')
+    codec = codecs.get_codec(name)
+    value = {
+        'raw': b'abc',
+        'utf8': 'abc',
+        'json': {'a': [1, 2.5, None, 'x']},
+        'pickle': {'a': (1, b'x')},
+        'msgpack': {'a': [1, b'x']},
+    }[name]
+    assert codec.decode(codec.encode(value)) == value
+    assert codec.decode_dict(codec.encode_dict({'k': value, 'n': value}) | {'z': None}) == {'k': value, 'n': value, 'z': None}
+
+
+def test_get_codec():
+    codec = codecs.PickleCodec()
+    assert codecs.get_codec(codec) is codec
+    assert codecs.get_codec(None) is None
+    with pytest.raises(ValueError):
+        codecs.get_codec('xml')
+
+
+@pytest.mark.parametrize('algorithm', ['zlib', 'lzma', 'zstd', 'lz4'])
+def test_compressed_codec(algorithm):
+    if algorithm == 'zstd':
+        pytest.importorskip('zstandard')
+    if algorithm == 'lz4':
+        pytest.importorskip('lz4')
+    codec = compression.CompressedCodec(algorithm=algorithm, threshold=100)
+    small = b'x' * 10
+    big = b'x' * 1000
+    assert codec.encode(small) == small
+    assert codec.encode(big).startswith(compression.MAGIC)
+    assert len(codec.encode(big)) < len(big)
+    assert codec.decode_many(codec.encode_many([small, big])) + codec.decode_many([None]) == [small, big, None]
+
+
+def test_compressed_codec_magic_prefix():
+    codec = compression.CompressedCodec(threshold=100)
+    value = compression.MAGIC + b'\x01not compressed'
+    assert codec.encode(value) != value
+    assert codec.decode(codec.encode(value)) == value
+
+
+def test_compressed_codec_mixed_algorithms():
+    zlib_codec = compression.CompressedCodec('json', algorithm='zlib', threshold=0)
+    lzma_codec = compression.CompressedCodec('json', algorithm='lzma', threshold=0)
+    assert lzma_codec.decode(zlib_codec.encode({'a': 1})) == {'a': 1}
+
+
+def test_compressed_codec_executor():
+    values = [str(i).encode() * 100 for i in range(50)]
+    with ThreadPoolExecutor(4) as executor:
+        codec = compression.CompressedCodec(threshold=64, executor=executor, parallel_threshold=8)
+        encoded = codec.encode_many(values)
+        assert codec.decode_many(encoded) == values
+        assert codec.decode_dict(codec.encode_dict(dict(enumerate(values)))) == dict(enumerate(values))
+
+
+def test_histogram_collector():
+    collector = instrumentation.HistogramCollector(buckets=(0.001, 0.01, float('inf')))
+    for duration in (0.0005, 0.0005, 0.005, 1):
+        call = instrumentation.Call('mget', b'p', keys=2, request_bytes=10)
+        call.duration = duration
+        collector.after(call)
+    stats = collector.stats()[('mget', b'p')]
+    assert (stats['count'], stats['keys'], stats['request_bytes'], stats['errors']) == (4, 8, 40, 0)
+    assert stats['p50'] == 0.001
+    assert collector.quantile('mget', b'p', 0.75) == 0.01
+    assert stats['p99'] == float('inf')
+
+
+def test_prometheus_hook():
+    prometheus_client = pytest.importorskip('prometheus_client')
+    registry = prometheus_client.CollectorRegistry()
+    hook = instrumentation.PrometheusHook(registry)
+    call = instrumentation.Call('mget', b'p', keys=3)
+    call.duration = 0.01
+    hook.after(call)
+    assert registry.get_sample_value('extraredis_call_keys_total', {'method': 'mget', 'prefix': 'p'}) == 3
+
+
+def test_bytes_buffer():
+    buffer = BytesBuffer([b'ab', None, b'', b'cde'])
+    assert len(buffer) == 4
+    assert buffer.data == b'abcde'
+    assert isinstance(buffer[0], memoryview)
+    assert buffer[0].obj is buffer.data  # no copy
+    assert buffer[1] is None
+    assert buffer.tolist() == [b'ab', None, b'', b'cde']
+    assert buffer[-1] == b'cde'
+    assert buffer[1:] == [None, b'', b'cde']
+    assert buffer[::-2] == [b'cde', None]
+    with pytest.raises(TypeError):
+        BytesBuffer(['a'])
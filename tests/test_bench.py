@@ -0,0 +1,31 @@
+import json
+import sys
+
+import pytest
+
+from extraredis import bench
+
+
+def test_bench(tmp_path):
+    output = tmp_path / 'bench.json'
+    report = bench.main(['--n-keys', '5', '--value-size', '8', '--repeat', '1', '--output', str(output)])
+    assert json.loads(output.read_text()) == report
+    results = report['results']
+    assert len(results) == len(bench.OPS) * 2 * 2  # sync/async * bytes/str
+    assert {r['op'] for r in results} == set(bench.OPS)
+    for r in results:
+        assert r['ops_per_sec'] > 0
+        assert r['p50_ms'] <= r['p99_ms']
+        assert r['keys_per_call'] in (1, 5)
+
+
+def test_bench_allocations():
+    report = bench.main(['--n-keys', '50', '--repeat', '1', '--client', 'sync', '--decode', 'bytes', '--ops', 'mget', 'mget_lists', '--allocations', '--output', '/dev/null'])
+    size = {r['op']: r['bytes_per_key'] for r in report['results'] if r['value_size'] == 16}
+    assert 0 < size['mget_lists'] < size['mget']
+
+
+def test_bench_without_fakeredis(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'fakeredis', None)
+    with pytest.raises(ImportError, match=r'extraredis\[bench\]'):
+        bench.make_client(bench.ExtraRedis, None, False)
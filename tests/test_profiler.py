@@ -0,0 +1,44 @@
+import fakeredis.aioredis as fake_redis_async
+import pytest
+
+from extraredis import ExtraRedisAsync
+from extraredis.profiler import Profiler
+from extraredis.records import record
+
+
+@record(b'r')
+class Row:
+    id: str
+    value: str
+
+
+@pytest.mark.asyncio
+async def test_profiler():
+    redis = fake_redis_async.FakeRedis()
+    await redis.mset({b'a:0': b'0', b'a:1': b'1', b'b:0': b'x' * 100})
+    profiler = Profiler(sample_rate=1, slow_threshold=0, max_slow=2, hot_scan_calls=3)
+    extraredis = ExtraRedisAsync(redis, hooks=[profiler])
+    for _ in range(2):
+        await extraredis.mget(b'a', [b'0', b'1'])
+    await extraredis.get(b'b', b'0')
+    assert [p for p, _ in profiler.top_prefixes('calls')] == [b'a', b'b']
+    assert profiler.top_prefixes('bytes') == [(b'b', 101), (b'a', 12)]
+    assert profiler.top_prefixes('keys', n=1) == [(b'a', 4)]
+    assert len(profiler.slow_calls()) == 2
+    sites = dict(profiler.top_sites())
+    assert len(sites) == 2
+    assert all(site[0] == __file__ and site[2] == 'test_profiler' for site in sites)
+    assert sorted((s['calls'], s['keys'], s['prefixes']) for s in sites.values()) == [(1, 1, {b'b': 1}), (2, 4, {b'a': 2})]
+    assert 'top prefixes by duration' in profiler.report()
+
+    with pytest.warns(RuntimeWarning, match='scans the whole keyspace'):
+        for _ in range(3):
+            await extraredis.mget(b'a')
+    with pytest.warns(RuntimeWarning, match='scans the whole keyspace'):
+        for _ in range(3):
+            [kv async for kv in extraredis.iter_mget(b'a')]
+    with pytest.warns(RuntimeWarning, match='mget_records'):
+        for _ in range(3):
+            await extraredis.mget_records(Row)  # the nested mhget_fields is not instrumented
+    profiler.clear()
+    assert profiler.top_prefixes() == []
@@ -0,0 +1,129 @@
+import asyncio
+
+import fakeredis.aioredis as fake_redis_async
+import pytest
+
+from extraredis import ExtraRedisAsync
+from extraredis.readthrough import ReadThroughCache
+
+
+@pytest.fixture
+def extraredis():
+    return ExtraRedisAsync(fake_redis_async.FakeRedis(), codec='json')
+
+
+@pytest.mark.asyncio
+async def test_read_through(extraredis):
+    calls = []
+
+    async def loader(keys):
+        calls.append(keys)
+        await asyncio.sleep(0.1)  # longer than the reads of the other calls, which then wait for this load
+        return {k: {'id': k.decode()} for k in keys if k != b'missing'}
+
+    await extraredis.set(b'user', b'0', {'id': 'cached'})
+    cache = ReadThroughCache(extraredis, b'user', loader, ex=60)
+    results = await asyncio.gather(
+        cache.get_many([b'0', b'1', b'2', b'missing']),
+        cache.get_many([b'2', b'3']),
+        cache.get(b'1'),
+    )
+    assert results == [
+        {b'0': {'id': 'cached'}, b'1': {'id': '1'}, b'2': {'id': '2'}, b'missing': None},
+        {b'2': {'id': '2'}, b'3': {'id': '3'}},
+        {'id': '1'},
+    ]
+    assert calls == [[b'1', b'2', b'missing'], [b'3']]  # keys 2 and 1 of the other calls are single-flighted
+    assert await extraredis.mget(b'user', [b'1', b'3', b'missing']) == {b'1': {'id': '1'}, b'3': {'id': '3'}, b'missing': None}
+    assert await extraredis.redis.ttl(b'user:1') == 60
+
+    assert await cache.get(b'3') == {'id': '3'}
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['loads']) == (2, 6, 2)
+    assert stats['mean_load_seconds'] > 0
+
+
+@pytest.mark.asyncio
+async def test_read_through_hash_and_errors(extraredis):
+    def loader(keys):
+        if b'bad' in keys:
+            raise KeyError('bad')
+        return {k: {'a': 1, 'b': 2} for k in keys}
+
+    cache = ReadThroughCache(extraredis, b'h', loader, hash=True, fields=['a'])
+    assert await cache.get(b'0') == {'a': 1}
+    assert await extraredis.hget_fields(b'h', b'0') == {b'a': 1, b'b': 2}
+    with pytest.raises(KeyError):
+        await cache.get_many([b'1', b'bad'])
+    assert cache.load_errors == 1
+    assert await cache.get(b'1') == {'a': 1}
+
+    # buffered and in-flight values are projected like the ones read from redis
+    cache = ReadThroughCache(extraredis, b'h', loader, hash=True, fields=['a'], write_behind=60)
+    await cache.set(b'2', {'a': 3, 'b': 4})
+    assert await cache.get(b'2') == {'a': 3}
+    cache._schedule_flush()
+    assert await cache.get(b'2') == {'a': 3}
+    await cache.close()
+    assert await cache.get(b'2') == {'a': 3}
+
+
+@pytest.mark.asyncio
+async def test_write_behind(extraredis):
+    cache = ReadThroughCache(extraredis, b'kv', lambda keys: {}, write_behind=0.01, max_buffer=3)
+    await cache.set(b'0', 0)
+    await cache.set_many({b'1': 1})
+    assert await extraredis.mget(b'kv', [b'0', b'1']) == {b'0': None, b'1': None}
+    assert await cache.get_many([b'0', b'1']) == {b'0': 0, b'1': 1}  # served from the buffer
+    await asyncio.sleep(0.05)
+    assert await extraredis.mget(b'kv', [b'0', b'1']) == {b'0': 0, b'1': 1}
+    assert cache.writes == 1
+
+    await cache.set_many({b'2': 2, b'3': 3, b'4': 4})  # max_buffer reached, flushed without waiting for the timer
+    await cache.set(b'5', 5)
+    await cache.close()
+    assert cache.writes == 3
+    assert await extraredis.mget(b'kv', [b'2', b'5']) == {b'2': 2, b'5': 5}
+
+
+@pytest.mark.asyncio
+async def test_write_behind_races(extraredis, monkeypatch):
+    calls = []
+
+    async def loader(keys):
+        calls.append(keys)
+        await asyncio.sleep(0.02)
+        return {k: 'old-from-db' for k in keys}
+
+    mset = extraredis.mset
+    failures = []
+
+    async def slow_mset(*args, **kwargs):
+        await asyncio.sleep(0.05)
+        if failures:
+            raise failures.pop()
+        await mset(*args, **kwargs)
+
+    monkeypatch.setattr(extraredis, 'mset', slow_mset)
+    cache = ReadThroughCache(extraredis, b'kv', loader, write_behind=0.01)
+    await cache.set(b'0', 'new')
+    await asyncio.sleep(0.02)  # the flush is running
+    assert await cache.get(b'0') == 'new'
+    assert calls == []
+
+    load = asyncio.ensure_future(cache.get(b'1'))
+    await asyncio.sleep(0)
+    await cache.set(b'1', 'new')  # set while loading: the loaded value is not written back
+    assert await load == 'old-from-db'
+    await cache.flush()
+    assert await extraredis.mget(b'kv', [b'0', b'1']) == {b'0': 'new', b'1': 'new'}
+
+    failures.append(ConnectionError('down'))
+    await cache.set(b'2', 'new')
+    await asyncio.sleep(0.02)
+    await cache.set(b'3', 'new')
+    with pytest.raises(ConnectionError):
+        await cache.flush()  # the failed batch is buffered again
+    assert await cache.get(b'2') == 'new'
+    await cache.close()
+    assert await extraredis.mget(b'kv', [b'2', b'3']) == {b'2': 'new', b'3': 'new'}